@@ -0,0 +1,416 @@
+#!/usr/bin/env python3.4
+"""
+End-to-end benchmark of the test sequence without hardware: a simulated Linduino on the serial port, a fake WaveDump that follows the file of comunication and fake analysis programs; the time by phase and by class of command is saved as JSON and compared with a baseline.
+"""
+import os
+import sys
+import json
+import stat
+import time
+import shutil
+import argparse
+import tempfile
+import threading
+
+import SPMT_Project
+
+from SPMT_Project import Orchestrator, MAXIMUM_CHANNELS
+from SPMT_Trace import tracer
+
+DEFAULT_RESULTS_FILE    = "./benchmark_results.json"
+DEFAULT_BASELINE_FILE   = "./benchmark_baseline.json"
+DEFAULT_TIME_SCALE      = 0.01          # Simulated durations (sleeps, triggers, analyses) are multiplied by this factor
+DEFAULT_THRESHOLD       = 0.20          # A metric 20% above its baseline is a regression...
+MINIMUM_DIFFERENCE      = 0.05          # ...when it is also longer by this many seconds (noise of short metrics)
+
+SIMULATED_PORT          = "simulated"
+ANALYSIS_DURATION       = 2.0           # Seconds of each (fake) analysis program, before scaling
+WAVEDUMP_EVENT_RATE     = 200.0         # Events by second and channel written by the fake WaveDump
+WAVEDUMP_RECORD_LENGTH  = 256
+WAVEDUMP_MEAN_PHOTOELECTRONS = 1.0    # LED light of the synthetic events (SPMT_Synthetic)
+
+# Default identity of the HV module of each channel
+BENCHMARK_HV_ID = ["A7501PB", "%03d", 847.3831157965, 3.712840922]
+
+# Classes of commands of Linduino by their first field
+COMMAND_CLASSES = {"1": "dac", "9": "mux", "17": "monitor", "16": "trigger", "18": "sweep"}
+
+# Fake WaveDump: acquires ("a") synthetic events until it is asked to stop ("s") or quit ("q"), as the modified WaveDump of the stand
+FAKE_WAVEDUMP = '''#!{python}
+import os
+import sys
+import time
+
+# Started after "a" has been written: files are created at once, even if the acquisition is shorter than the start of Python
+channels = int(os.environ.get("SPMT_BENCHMARK_CHANNELS", "{channels}"))
+
+for channel in range(channels):
+    open("wave_%d.txt" % channel, "w").close()
+
+sys.path.insert(0, {repository!r})
+from SPMT_Synthetic import WaveformGenerator, WaveFileWriter
+
+generators = [WaveformGenerator(recordLength={recordLength}, seed=channel) for channel in range(channels)]
+writers = None
+
+while (True):
+    try:
+        with open("comunicazioneW.txt", "r") as fileComunica:
+            command = fileComunica.read().strip()
+    except (IOError, OSError):
+        command = ""
+
+    if ((command == "a") and (writers is None)):
+        writers = [WaveFileWriter("wave_%d.txt" % channel, channel=channel) for channel in range(channels)]
+    elif ((command in ("s", "q")) and (writers is not None)):
+        for writer in writers:
+            writer.close()
+        writers = None
+
+    if (command == "q"):
+        break
+
+    if (writers is not None):
+        for generator, writer in zip(generators, writers):
+            writer.write(generator.generate(max(1, int({rate} * 0.05)), meanPhotoelectrons={meanPhotoelectrons})[0])
+            writer.flush()
+
+    time.sleep(0.05)
+'''
+
+# Fake analysis program: after its duration, writes the result file expected by the orchestrator
+FAKE_ANALYSIS = '''#!{python}
+import time
+
+time.sleep({duration})
+
+with open({fileName!r}, "w") as fileResult:
+    fileResult.write({content!r})
+'''
+
+"""
+Stand-in of serial.Serial for the Linduino program: DAC, MUX, monitors (IMon and VMon) and trigger
+"""
+class SimulatedLinduino():
+    # Set by the benchmark before the orchestrator opens the port
+    timeScale = DEFAULT_TIME_SCALE
+    iFactor   = 1.2541993281
+    vFactor   = 2.0
+
+    def __init__(self, port=None, baudrate=115200, *args, **kwargs):
+        self.port           = port
+        self.lock           = threading.Lock()
+        self.fields         = []            # Fields received, each one ends with '\n'
+        self.currentField   = ""
+        self.output         = b""
+        self.voltages       = {}            # Channel -> voltage received (half of the output)
+        self.monitorMode    = False
+        self.triggerEnd     = None          # Time when the pulses being triggered finish
+        self.commandCounts  = {}
+
+
+    def write(self, data):
+        with self.lock:
+            for character in data.decode():
+                if (character == '\n'):
+                    self.fields.append(self.currentField)
+                    self.currentField = ""
+                    self.__parse()
+                else:
+                    self.currentField += character
+
+        return len(data)
+
+
+    def __count(self, command):
+        name = COMMAND_CLASSES.get(command, command)
+        self.commandCounts[name] = self.commandCounts.get(name, 0) + 1
+
+
+    def __parse(self):
+        fields = self.fields
+
+        while (fields):
+            if (self.monitorMode):
+                # Monitor mode: each channel returns "IMon VMon", '9' exits
+                field = fields.pop(0)
+
+                if (field == "9"):
+                    self.monitorMode = False
+                    self.output += b"Exit monitor\r\n"
+                else:
+                    voltage = 2.0 * self.voltages.get(int(field), 0.0)
+                    self.output += ("%.3f %.3f\n" % (voltage * self.iFactor, voltage * self.vFactor)).encode()
+                continue
+
+            command = fields[0]
+
+            if ((command == "1") and (len(fields) >= 5)):
+                self.voltages[int(fields[1])] = float(fields[4])
+                self.output += b"DAC updated\r\n"
+                del fields[:5]
+            elif ((command == "9") and (len(fields) >= 2) and (fields[1] == "0")):
+                self.output += b"MUX disabled\r\n"
+                del fields[:2]
+            elif ((command == "9") and (len(fields) >= 3)):
+                # The voltage read is in the 5th line; the board doubles the voltage received
+                self.output += ("Set Mux\r\nEnable\r\nChannel\r\n%s\r\n%.3f\r\n" % (fields[2], 2.0 * self.voltages.get(int(fields[2]), 0.0))).encode()
+                del fields[:3]
+            elif (command == "17"):
+                self.monitorMode = True
+                self.output += b"Monitor\r\n"
+                del fields[:1]
+            elif ((command == "16") and (len(fields) >= 6)):
+                interval = float(fields[1])
+                pulses = int(fields[3])
+                self.triggerEnd = time.time() + (pulses * interval / 1000.0) * self.timeScale
+                self.output += b"Loop trigger\r\n"
+                del fields[:6]
+            elif (command == "18"):
+                # Firmware without linearity sweep: no answer, the host executes the steps
+                del fields[:1]
+            elif (len(fields) >= 6):
+                print("Simulated Linduino: unknown command %s..." % command)
+                del fields[:1]
+                continue
+            else:
+                # Command not complete yet
+                break
+
+            self.__count(command)
+
+
+    def inWaiting(self):
+        with self.lock:
+            if ((self.triggerEnd is not None) and (time.time() >= self.triggerEnd)):
+                self.output += b"Fine trigger\n"
+                self.triggerEnd = None
+
+            return len(self.output)
+
+
+    @property
+    def in_waiting(self):
+        return self.inWaiting()
+
+
+    def read(self, size=1):
+        with self.lock:
+            data = self.output[:size]
+            self.output = self.output[size:]
+
+        return data
+
+
+    def close(self):
+        pass
+
+
+def createFakePrograms(workDir, numberOfChannels, timeScale=DEFAULT_TIME_SCALE):
+    # Fake WaveDump and analysis programs (executable scripts) in "workDir"; returns the path of WaveDump
+    gainTable = "".join("Canale %d\nV guadagno 1180.5\n" % channel for channel in range(MAXIMUM_CHANNELS))
+    analyses = {"Fondo.exe":        ("./Parametri_gaussiana_dark.cfg", "0.0 1.0\n"),
+                "10percFauth_v1":   ("./DarkCountGaussParameters.txt", "0.0 1.0 2.0\n"),
+                "10Percento.exe":   ("./Cerca.txt", "0 \n"),
+                "Ricerca.exe":      ("./Continua.txt", "0 \n"),
+                "Single_ph.exe":    ("./tabella_tensioni_guadagno_7*10^5.cfg", gainTable),
+                "Linearity.exe":    ("./Linearita.txt", "\n")}
+
+    programs = {"wavedump": FAKE_WAVEDUMP.format(python=sys.executable, channels=numberOfChannels, repository=os.path.dirname(os.path.abspath(__file__)),
+                                                 rate=WAVEDUMP_EVENT_RATE, recordLength=WAVEDUMP_RECORD_LENGTH,
+                                                 meanPhotoelectrons=WAVEDUMP_MEAN_PHOTOELECTRONS)}
+
+    for program, (fileName, content) in analyses.items():
+        programs[program] = FAKE_ANALYSIS.format(python=sys.executable, duration=ANALYSIS_DURATION * timeScale, fileName=fileName, content=content)
+
+    for program, source in programs.items():
+        fileName = os.path.join(workDir, program)
+
+        with open(fileName, "w") as fileProgram:
+            fileProgram.write(source)
+
+        os.chmod(fileName, os.stat(fileName).st_mode | stat.S_IXUSR | stat.S_IXGRP | stat.S_IXOTH)
+
+    return os.path.join(workDir, "wavedump")
+
+
+def summarizeTrace(events):
+    # -----------------------------------------------------------------
+    # Seconds by phase (begin/end events) and by category of span
+    # (dac, mux, trigger, analysis...); a span inside another one of
+    # the same category and thread (acquisition to a precision and its
+    # acquisitions, blocks of triggers...) is already counted by the
+    # outer one. Spans of different categories are counted in both.
+    # -----------------------------------------------------------------
+    phases = {}
+    categories = {}
+    phaseStarts = {}
+    openSpans = {}          # End of the outermost span by (thread, category)
+
+    # Outer spans first when two start at the same time
+    for event in sorted(events, key=lambda event: (event.get("ts", 0.0), -event.get("dur", 0.0))):
+        if (event.get("cat") == "phase"):
+            if (event["ph"] == "B"):
+                phaseStarts[event["name"]] = event["ts"]
+            elif ((event["ph"] == "E") and (event["name"] in phaseStarts)):
+                phases[event["name"]] = round(phases.get(event["name"], 0.0) + (event["ts"] - phaseStarts.pop(event["name"])) / 1e6, 3)
+        elif (event.get("ph") == "X"):
+            key = (event.get("tid"), event["cat"])
+
+            if (event["ts"] < openSpans.get(key, event["ts"])):
+                continue
+
+            openSpans[key] = event["ts"] + event["dur"]
+            category = categories.setdefault(event["cat"], {"count": 0, "seconds": 0.0})
+            category["count"] += 1
+            category["seconds"] = round(category["seconds"] + event["dur"] / 1e6, 3)
+
+    return phases, categories
+
+
+def runBenchmark(configuration=None, numberOfChannels=1, timeScale=DEFAULT_TIME_SCALE, workDir=None, keepWorkDir=False):
+    # Executes the whole sequence in "workDir" (a temporary folder by default); returns the results
+    temporaryWorkDir = (workDir is None)
+    workDir = os.path.abspath(workDir or tempfile.mkdtemp(prefix="SPMT_benchmark_"))
+    os.makedirs(os.path.join(workDir, "logs"), exist_ok=True)
+
+    waveDumpProgram = createFakePrograms(workDir, numberOfChannels, timeScale=timeScale)
+    originalSerial = SPMT_Project.serial.Serial
+    originalSleep = SPMT_Project.sleep
+    originalFolder = os.getcwd()
+    simulators = []
+
+    def openSimulator(*args, **kwargs):
+        simulators.append(SimulatedLinduino(*args, **kwargs))
+        return simulators[-1]
+
+    SimulatedLinduino.timeScale = timeScale
+    SPMT_Project.serial.Serial = openSimulator
+    # Waits of the sequence are scaled as the simulated hardware
+    SPMT_Project.sleep = lambda seconds: originalSleep(seconds * timeScale)
+    os.environ["SPMT_BENCHMARK_CHANNELS"] = str(MAXIMUM_CHANNELS if (numberOfChannels > 1) else 1)
+
+    try:
+        os.chdir(workDir)
+
+        orchestrator = Orchestrator(linduinoPort=SIMULATED_PORT, waveDumpProgram=waveDumpProgram)
+        orchestrator.interactive = False
+        orchestrator.traceRun = True
+        orchestrator.catalogFileName = os.path.join(workDir, "catalog.sqlite")
+        orchestrator.numberOfChannels = numberOfChannels
+        orchestrator.highVoltageIDs = [[BENCHMARK_HV_ID[0], BENCHMARK_HV_ID[1] % channel, BENCHMARK_HV_ID[2], BENCHMARK_HV_ID[3]] for channel in range(numberOfChannels)]
+
+        if (configuration):
+            orchestrator.setConfiguration(configuration)
+
+        SimulatedLinduino.iFactor = orchestrator.currentFactor
+        SimulatedLinduino.vFactor = orchestrator.voltageFactor
+
+        startTime = time.time()
+        result = orchestrator.executeProgram()
+        wallTime = time.time() - startTime
+
+        orchestrator.spmtControllerObj.linduinoObj.closeConnection()
+    finally:
+        os.chdir(originalFolder)
+        SPMT_Project.serial.Serial = originalSerial
+        SPMT_Project.sleep = originalSleep
+
+        if (temporaryWorkDir and (not keepWorkDir)):
+            shutil.rmtree(workDir, ignore_errors=True)
+
+    phases, categories = summarizeTrace(list(tracer.events))
+    commands = {}
+
+    for simulator in simulators:
+        for name, count in simulator.commandCounts.items():
+            commands[name] = commands.get(name, 0) + count
+
+    return {"date": time.strftime("%Y-%m-%d %H:%M:%S"),
+            "timeScale": timeScale,
+            "numberOfChannels": numberOfChannels,
+            "result": result,
+            "wallTime": round(wallTime, 3),
+            "phases": phases,
+            "categories": categories,
+            "commands": commands}
+
+
+def compareWithBaseline(results, baseline, threshold=DEFAULT_THRESHOLD, minimumDifference=MINIMUM_DIFFERENCE):
+    # Regressions (messages) of the times in "results" against "baseline"
+    if ((baseline.get("timeScale") != results.get("timeScale")) or (baseline.get("numberOfChannels") != results.get("numberOfChannels"))):
+        return ["Baseline measured with other time scale or number of channels, not comparable..."]
+
+    metrics = [("wallTime", results["wallTime"], baseline.get("wallTime"))]
+    metrics += [("phase %s" % name, seconds, baseline.get("phases", {}).get(name)) for name, seconds in results["phases"].items()]
+    metrics += [("category %s" % name, values["seconds"], baseline.get("categories", {}).get(name, {}).get("seconds")) for name, values in results["categories"].items()]
+
+    regressions = []
+
+    if (results["result"] != baseline.get("result")):
+        regressions.append("Result of the run %s, baseline %s" % (results["result"], baseline.get("result")))
+
+    for name, seconds, reference in metrics:
+        if ((reference is not None) and (seconds > reference * (1.0 + threshold)) and ((seconds - reference) > minimumDifference)):
+            regressions.append("%s: %.3f s, baseline %.3f s (+%.0f%%)" % (name, seconds, reference, 100.0 * (seconds - reference) / max(reference, 1e-9)))
+
+    for name, count in results["commands"].items():
+        reference = baseline.get("commands", {}).get(name)
+
+        if ((reference is not None) and (count > reference * (1.0 + threshold))):
+            regressions.append("commands %s: %d, baseline %d" % (name, count, reference))
+
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the SPMT test sequence against simulated hardware.")
+    parser.add_argument("config", nargs="?", help="configuration file (.json, or .csv saved by the UI)")
+    parser.add_argument("--channels", type=int, default=1, choices=[1, MAXIMUM_CHANNELS], help="number of channels")
+    parser.add_argument("--time-scale", type=float, default=DEFAULT_TIME_SCALE, help="factor of simulated durations (1.0 is real time)")
+    parser.add_argument("--output", default=DEFAULT_RESULTS_FILE, help="JSON file of results")
+    parser.add_argument("--baseline", default=DEFAULT_BASELINE_FILE, help="JSON file of results to compare with")
+    parser.add_argument("--threshold", type=float, default=DEFAULT_THRESHOLD, help="relative increase of a time considered a regression")
+    parser.add_argument("--save-baseline", action="store_true", help="store these results as the new baseline")
+    parser.add_argument("--workdir", help="folder of the run (kept), instead of a temporary one")
+    arguments = parser.parse_args()
+
+    configuration = None
+
+    if (arguments.config):
+        # Imported here: SPMT_Headless configures nothing at import, but only its loader is needed
+        from SPMT_Headless import loadConfigurationFile
+        configuration = loadConfigurationFile(arguments.config)
+
+    results = runBenchmark(configuration=configuration, numberOfChannels=arguments.channels, timeScale=arguments.time_scale, workDir=arguments.workdir)
+
+    with open(arguments.output, "w") as fileResults:
+        json.dump(results, fileResults, indent=4)
+
+    print("Run result %d in %.3f s (time scale %g)" % (results["result"], results["wallTime"], results["timeScale"]))
+
+    for name, seconds in results["phases"].items():
+        print("    %-20s %8.3f s" % (name, seconds))
+
+    for name, values in sorted(results["categories"].items()):
+        print("    %-20s %8.3f s in %d spans" % (name, values["seconds"], values["count"]))
+
+    if (arguments.save_baseline):
+        shutil.copyfile(arguments.output, arguments.baseline)
+        print("Baseline saved in %s..." % arguments.baseline)
+        return 0
+
+    if (not os.path.exists(arguments.baseline)):
+        print("No baseline %s to compare with..." % arguments.baseline)
+        return 0
+
+    with open(arguments.baseline, "r") as fileBaseline:
+        regressions = compareWithBaseline(results, json.load(fileBaseline), threshold=arguments.threshold)
+
+    for regression in regressions:
+        print("REGRESSION %s" % regression)
+
+    return (1 if regressions else 0)
+
+
+if __name__ == "__main__": sys.exit(main())
@@ -0,0 +1,86 @@
+#!/usr/bin/env python3.4
+"""
+Cooperative cancellation of a run: the thread of the run (and the analyses it submits) holds a token, and every wait of the sequence returns as soon as the token is cancelled.
+"""
+import time
+import threading
+
+from contextlib import contextmanager
+
+"""
+Raised by the waits of a cancelled run; the orchestrator catches it and turns the voltages off
+"""
+class RunCancelled(Exception):
+    pass
+
+"""
+Token shared by the UI (who cancels) and the thread of the run (who waits)
+"""
+class CancellationToken():
+    def __init__(self):
+        self.event  = threading.Event()
+        self.reason = None
+
+
+    def cancel(self, reason="cancelled"):
+        self.reason = reason
+        self.event.set()
+
+
+    def isCancelled(self):
+        return self.event.is_set()
+
+
+    def check(self):
+        if (self.event.is_set()):
+            raise RunCancelled(self.reason)
+
+
+    def wait(self, seconds):
+        # Same as time.sleep, but returns (raising RunCancelled) as soon as the token is cancelled
+        if (self.event.wait(seconds)):
+            raise RunCancelled(self.reason)
+
+
+# Token of the run executed by each thread
+__state = threading.local()
+
+
+def setCurrentToken(token):
+    __state.token = token
+
+
+def getCurrentToken():
+    return getattr(__state, "token", None)
+
+
+def checkCancelled():
+    token = getCurrentToken()
+
+    if (token is not None):
+        token.check()
+
+
+def cancellableSleep(seconds):
+    token = getCurrentToken()
+
+    if (token is None):
+        time.sleep(seconds)
+    else:
+        token.wait(seconds)
+
+
+@contextmanager
+def shielded():
+    # -----------------------------------------------------------------
+    # The cleanup of a cancelled run (voltages off, exit monitor mode)
+    # must run to the end: inside this block the waits are not
+    # cancellable.
+    # -----------------------------------------------------------------
+    token = getCurrentToken()
+    setCurrentToken(None)
+
+    try:
+        yield
+    finally:
+        setCurrentToken(token)
@@ -0,0 +1,227 @@
+#!/usr/bin/env python3.4
+"""
+Local catalog (SQLite) of every test run: configuration, HV identities, measured voltages and monitors, duration of each phase and analysis outputs.
+"""
+import sys
+import json
+import sqlite3
+import argparse
+
+from contextlib import contextmanager
+from datetime import datetime
+
+DEFAULT_CATALOG_FILE = "./catalog.sqlite"
+
+CATALOG_SCHEMA = """
+CREATE TABLE IF NOT EXISTS runs (
+    id              INTEGER PRIMARY KEY AUTOINCREMENT,
+    startTime       TEXT NOT NULL,
+    endTime         TEXT,
+    folder          TEXT,
+    status          TEXT NOT NULL,
+    message         TEXT,
+    configuration   TEXT
+);
+CREATE TABLE IF NOT EXISTS modules (
+    runId           INTEGER NOT NULL REFERENCES runs(id),
+    channel         INTEGER NOT NULL,
+    model           TEXT,
+    serialNumber    TEXT,
+    aFactor         REAL,
+    bFactor         REAL
+);
+CREATE TABLE IF NOT EXISTS measurements (
+    runId           INTEGER NOT NULL REFERENCES runs(id),
+    channel         INTEGER NOT NULL,
+    quantity        TEXT NOT NULL,
+    value           REAL,
+    time            TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS phases (
+    runId           INTEGER NOT NULL REFERENCES runs(id),
+    name            TEXT NOT NULL,
+    startTime       TEXT NOT NULL,
+    duration        REAL,
+    status          TEXT
+);
+CREATE TABLE IF NOT EXISTS results (
+    runId           INTEGER NOT NULL REFERENCES runs(id),
+    phase           TEXT,
+    channel         INTEGER,
+    key             TEXT NOT NULL,
+    value           TEXT
+);
+CREATE INDEX IF NOT EXISTS modulesSerialNumber ON modules(serialNumber);
+CREATE INDEX IF NOT EXISTS modulesRun ON modules(runId);
+CREATE INDEX IF NOT EXISTS runsStartTime ON runs(startTime);
+CREATE INDEX IF NOT EXISTS measurementsRun ON measurements(runId);
+CREATE INDEX IF NOT EXISTS phasesRun ON phases(runId);
+CREATE INDEX IF NOT EXISTS resultsRun ON results(runId);
+"""
+
+"""
+Catalog of runs; each method opens its own connection, so it can be used from the execution thread and from the UI
+"""
+class RunCatalog():
+    def __init__(self, fileName=DEFAULT_CATALOG_FILE):
+        self.fileName = fileName
+
+        with self.__connect() as connection:
+            connection.executescript(CATALOG_SCHEMA)
+
+
+    @contextmanager
+    def __connect(self):
+        connection = sqlite3.connect(self.fileName, timeout=30)
+        connection.row_factory = sqlite3.Row
+
+        try:
+            # Commit (or rollback on exception) and always close
+            with connection:
+                yield connection
+        finally:
+            connection.close()
+
+
+    def __now(self):
+        return datetime.now().isoformat(sep=' ', timespec='seconds')
+
+
+    def startRun(self, configuration={}, highVoltageIDs=[], folder=None):
+        with self.__connect() as connection:
+            cursor = connection.execute("INSERT INTO runs (startTime, folder, status, configuration) VALUES (?, ?, ?, ?)",
+                                        (self.__now(), folder, "running", json.dumps(configuration)))
+            runId = cursor.lastrowid
+
+            # --------------------------------------------
+            # Each cell of the array has:
+            # 0. HV model
+            # 1. S/N
+            # 2. f(x) = a.x + b (a)
+            # 3. f(x) = a.x + b (b)
+            # --------------------------------------------
+            connection.executemany("INSERT INTO modules (runId, channel, model, serialNumber, aFactor, bFactor) VALUES (?, ?, ?, ?, ?, ?)",
+                                   [(runId, channel, str(hvDevice[0]), str(hvDevice[1]), float(hvDevice[2]), float(hvDevice[3]))
+                                    for channel, hvDevice in enumerate(highVoltageIDs)])
+
+        return runId
+
+
+    def finishRun(self, runId, status="done", message=None):
+        with self.__connect() as connection:
+            connection.execute("UPDATE runs SET endTime = ?, status = ?, message = ? WHERE id = ?", (self.__now(), status, message, runId))
+
+
+    def addMeasurements(self, runId, quantity, values, channels=None):
+        if (channels is None):
+            channels = range(len(values))
+
+        now = self.__now()
+
+        with self.__connect() as connection:
+            connection.executemany("INSERT INTO measurements (runId, channel, quantity, value, time) VALUES (?, ?, ?, ?, ?)",
+                                   [(runId, channel, quantity, float(value), now) for channel, value in zip(channels, values)])
+
+
+    def addPhase(self, runId, name, startTime, duration, status="done"):
+        with self.__connect() as connection:
+            connection.execute("INSERT INTO phases (runId, name, startTime, duration, status) VALUES (?, ?, ?, ?, ?)",
+                               (runId, name, datetime.fromtimestamp(startTime).isoformat(sep=' ', timespec='seconds'), duration, status))
+
+
+    def addResult(self, runId, phase, key, value, channel=None):
+        if (not isinstance(value, str)):
+            value = json.dumps(value)
+
+        with self.__connect() as connection:
+            connection.execute("INSERT INTO results (runId, phase, channel, key, value) VALUES (?, ?, ?, ?, ?)",
+                               (runId, phase, channel, key, value))
+
+
+    def findRunsBySerialNumber(self, serialNumber):
+        with self.__connect() as connection:
+            return [dict(row) for row in connection.execute(
+                "SELECT runs.id, runs.startTime, runs.status, runs.folder, modules.channel, modules.model, modules.serialNumber "
+                "FROM modules JOIN runs ON runs.id = modules.runId WHERE modules.serialNumber = ? ORDER BY runs.startTime",
+                (str(serialNumber),))]
+
+
+    def findRunsByDate(self, firstDate, lastDate=None):
+        # Dates as "YYYY-MM-DD"; the last date is inclusive
+        lastDate = lastDate or firstDate
+
+        with self.__connect() as connection:
+            return [dict(row) for row in connection.execute(
+                "SELECT id, startTime, endTime, status, folder FROM runs WHERE startTime >= ? AND startTime < ? ORDER BY startTime",
+                (firstDate, lastDate + "~"))]
+
+
+    def getPhaseDurations(self, maximumRuns=200):
+        # Successful phases of the last runs, with the configuration of their run (to calibrate estimates of duration)
+        with self.__connect() as connection:
+            rows = [dict(row) for row in connection.execute(
+                "SELECT phases.runId, phases.name, phases.duration, runs.configuration FROM phases JOIN runs ON runs.id = phases.runId "
+                "WHERE phases.status = 'done' AND phases.runId IN (SELECT id FROM runs ORDER BY id DESC LIMIT ?) ORDER BY phases.runId",
+                (maximumRuns,))]
+
+        for row in rows:
+            row["configuration"] = json.loads(row["configuration"] or "{}")
+
+        return rows
+
+
+    def countResults(self, key, maximumRuns=200):
+        # Number of results "key" of each of the last runs (like iterations of a search)
+        with self.__connect() as connection:
+            return [row[0] for row in connection.execute(
+                "SELECT COUNT(*) FROM results WHERE key = ? AND runId IN (SELECT id FROM runs ORDER BY id DESC LIMIT ?) GROUP BY runId",
+                (key, maximumRuns))]
+
+
+    def getRun(self, runId):
+        with self.__connect() as connection:
+            run = connection.execute("SELECT * FROM runs WHERE id = ?", (runId,)).fetchone()
+
+            if (run is None):
+                return None
+
+            run = dict(run)
+            run["configuration"] = json.loads(run["configuration"] or "{}")
+            run["modules"]       = [dict(row) for row in connection.execute("SELECT * FROM modules WHERE runId = ? ORDER BY channel", (runId,))]
+            run["measurements"]  = [dict(row) for row in connection.execute("SELECT * FROM measurements WHERE runId = ?", (runId,))]
+            run["phases"]        = [dict(row) for row in connection.execute("SELECT * FROM phases WHERE runId = ?", (runId,))]
+            run["results"]       = [dict(row) for row in connection.execute("SELECT * FROM results WHERE runId = ?", (runId,))]
+
+        return run
+
+
+"""
+Main()
+"""
+def main():
+    parser = argparse.ArgumentParser(description="Query the catalog of SPMT runs.")
+    parser.add_argument("--catalog", default=DEFAULT_CATALOG_FILE, help="SQLite catalog file")
+    parser.add_argument("--sn", help="list the runs of the module with this serial number")
+    parser.add_argument("--date", nargs="+", help="list the runs of a date (or between two dates), as YYYY-MM-DD")
+    parser.add_argument("--run", type=int, help="show every detail of one run")
+    arguments = parser.parse_args()
+
+    catalog = RunCatalog(arguments.catalog)
+
+    if (arguments.sn):
+        rows = catalog.findRunsBySerialNumber(arguments.sn)
+    elif (arguments.date):
+        rows = catalog.findRunsByDate(*arguments.date[:2])
+    elif (arguments.run):
+        rows = [catalog.getRun(arguments.run)]
+    else:
+        parser.print_help()
+        return 1
+
+    for row in rows:
+        print(json.dumps(row, indent=(4 if arguments.run else None)))
+
+    return 0
+
+
+if __name__ == "__main__": sys.exit(main())
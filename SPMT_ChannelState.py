@@ -0,0 +1,132 @@
+#!/usr/bin/env python3.4
+"""
+Per-channel state of a run (calibration of the HV module, setpoints, readbacks, monitors and validation flags) in one NumPy structured array, with vectorized conversion and validation.
+"""
+import numpy
+
+# Linduino doubles the voltage it receives (0.0V to 10.0V of output), so it is sent half of the desired voltage
+LINDUINO_OUTPUT_GAIN = 2.0
+
+CHANNEL_STATE_DTYPE = numpy.dtype([("channel",      numpy.int16),
+                                   ("model",        "U32"),             # HV module (CAEN)
+                                   ("serialNumber", "U32"),
+                                   ("a",            numpy.float64),     # Calibration of the module, f(x) = a.x + b
+                                   ("b",            numpy.float64),
+                                   ("setpoint",     numpy.float64),     # Voltage wanted at the output of Linduino
+                                   ("readback",     numpy.float64),     # Voltage read by MUX
+                                   ("dacCorrection", numpy.float64),    # Added to the setpoint sent to Linduino (closed-loop trimming)
+                                   ("iMon",         numpy.float64),
+                                   ("vMon",         numpy.float64),
+                                   ("dacValid",     numpy.bool_),
+                                   ("iMonValid",    numpy.bool_),
+                                   ("vMonValid",    numpy.bool_)])
+
+
+def toLinduinoUnits(voltages):
+    # Voltage(s) to send to Linduino for the desired output voltage(s)
+    if (numpy.isscalar(voltages)):
+        return float(voltages) / LINDUINO_OUTPUT_GAIN
+
+    return (numpy.asarray(voltages, dtype=numpy.float64) / LINDUINO_OUTPUT_GAIN).tolist()
+
+
+def toFloatArray(values):
+    # Floats of "values" (numbers or strings), NaN where a value cannot be converted
+    try:
+        return numpy.asarray(values, dtype=numpy.float64)
+    except (TypeError, ValueError):
+        converted = numpy.full(len(values), numpy.nan)
+
+        for index, value in enumerate(values):
+            try:
+                converted[index] = float(value)
+            except (TypeError, ValueError):
+                pass
+
+        return converted
+
+
+def parseMonitors(monitorArray):
+    # Pairs [IMon, VMon] (strings returned by Linduino) to two arrays, NaN for a channel not read
+    iMon = toFloatArray([monitor[0] if ((monitor is not None) and (len(monitor) > 1)) else None for monitor in monitorArray])
+    vMon = toFloatArray([monitor[1] if ((monitor is not None) and (len(monitor) > 1)) else None for monitor in monitorArray])
+
+    return iMon, vMon
+
+
+def validateVoltages(voltagesArray, reference, maxError=0.02):
+    # Mask of channels whose voltage read is within "maxError" of the reference (one for all channels, or one per channel)
+    voltages = toFloatArray(voltagesArray)
+    reference = numpy.broadcast_to(toFloatArray(numpy.atleast_1d(reference)), voltages.shape)
+
+    with numpy.errstate(invalid="ignore"):
+        return (numpy.abs(voltages - reference) <= maxError)
+
+
+def validateMonitors(voltagesArray, iMon, vMon, vFactor=2.0, iFactor=1.2541993281, maxVMonError=0.03, maxIMonError=0.03):
+    # -----------------------------------------------------------------
+    # IMon (PMT) and VMon (HV module) relative to the voltages read by
+    # MUX; returns the masks of valid IMon and VMon and the references.
+    # -----------------------------------------------------------------
+    voltages = toFloatArray(voltagesArray)
+    iReference = numpy.round(voltages * iFactor, 3)
+    vReference = numpy.round(voltages * vFactor, 3)
+
+    with numpy.errstate(divide="ignore", invalid="ignore"):
+        iMask = (numpy.abs(numpy.round(iMon, 3) - iReference) / iReference <= maxIMonError)
+        vMask = (numpy.abs(numpy.round(vMon, 3) - vReference) / vReference <= maxVMonError)
+
+    return iMask, vMask, iReference, vReference
+
+
+"""
+State of the channels in use; row "index" is the channel getChannelsInUse()[index] and the row "index" of highVoltageIDs
+"""
+class ChannelState():
+    def __init__(self, channels, highVoltageIDs=[]):
+        self.state = numpy.zeros(len(channels), dtype=CHANNEL_STATE_DTYPE)
+        self.state["channel"] = channels
+
+        for name in ["a", "b", "setpoint", "readback", "iMon", "vMon"]:
+            self.state[name] = numpy.nan
+
+        # Each row of highVoltageIDs: HV model, S/N, f(x) = a.x + b (a), f(x) = a.x + b (b)
+        for index, hvDevice in enumerate(highVoltageIDs[:len(channels)]):
+            self.state[index]["model"]          = str(hvDevice[0])
+            self.state[index]["serialNumber"]   = str(hvDevice[1])
+            self.state[index]["a"]              = float(hvDevice[2])
+            self.state[index]["b"]              = float(hvDevice[3])
+
+
+    def __len__(self):
+        return len(self.state)
+
+
+    def getLabel(self, index):
+        # (HV model, S/N) of the channel, used in the names of files
+        return str(self.state["model"][index]), str(self.state["serialNumber"][index])
+
+
+    def calculateSetpoints(self, output):
+        # Input of each HV module for the desired "output" voltage: x = (output - b) / a
+        self.state["setpoint"] = (float(output) - self.state["b"]) / self.state["a"]
+
+        return self.state["setpoint"].tolist()
+
+
+    def setReadback(self, voltagesArray, validVoltages):
+        # Voltages read by MUX and the mask returned by validateVoltages
+        self.state["readback"] = toFloatArray(voltagesArray)
+        self.state["dacValid"] = validVoltages
+
+
+    def setMonitors(self, monitorArray, validIMon, validVMon):
+        # Pairs [IMon, VMon] read and the masks returned by validateMonitors
+        self.state["iMon"], self.state["vMon"] = parseMonitors(monitorArray)
+        self.state["iMonValid"] = validIMon
+        self.state["vMonValid"] = validVMon
+
+
+    def isValid(self):
+        # Mask of channels valid in all checks
+        return (self.state["dacValid"] & self.state["iMonValid"] & self.state["vMonValid"])
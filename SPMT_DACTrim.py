@@ -0,0 +1,61 @@
+#!/usr/bin/env python3.4
+"""
+Corrections of the DAC voltages learned by the closed-loop trimming, kept by S/N of the HV module, so the next run of the same module starts already corrected.
+"""
+import os
+import json
+import time
+
+DEFAULT_DAC_CORRECTION_FILE = "./dac_corrections.json"
+
+"""
+Correction (added to the voltage wanted, so MUX reads the voltage wanted) of the DAC of each HV module, in a JSON file
+"""
+class DACCorrectionCache():
+    def __init__(self, fileName=DEFAULT_DAC_CORRECTION_FILE, maximumCorrection=0.5):
+        self.fileName           = fileName
+        # A larger correction is a hardware problem, not something to be trimmed (and remembered)
+        self.maximumCorrection  = maximumCorrection
+        self.modules            = {}
+        self.load()
+
+
+    def load(self):
+        if (not os.path.exists(self.fileName)):
+            return
+
+        try:
+            with open(self.fileName, "r") as fileCorrections:
+                self.modules = json.load(fileCorrections)
+        except:
+            self.modules = {}
+            print("Exception when loading DAC corrections %s..." % self.fileName)
+
+
+    def save(self):
+        try:
+            with open(self.fileName + ".tmp", "w") as fileCorrections:
+                json.dump(self.modules, fileCorrections, indent=4)
+
+            os.replace(self.fileName + ".tmp", self.fileName)
+        except:
+            print("Exception when saving DAC corrections %s..." % self.fileName)
+
+
+    def getCorrection(self, serialNumber):
+        return self.modules.get(str(serialNumber), {}).get("correction", 0.0)
+
+
+    def getCorrections(self, serialNumbers):
+        return [self.getCorrection(serialNumber) for serialNumber in serialNumbers]
+
+
+    def setCorrection(self, serialNumber, correction):
+        # Returns False (and keeps the previous one) when the correction is out of the accepted range
+        if ((not serialNumber) or (abs(correction) > self.maximumCorrection)):
+            return False
+
+        self.modules[str(serialNumber)] = {"correction": round(float(correction), 4),
+                                           "updated": time.strftime("%Y-%m-%d %H:%M:%S")}
+
+        return True
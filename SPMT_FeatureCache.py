@@ -0,0 +1,213 @@
+#!/usr/bin/env python3.4
+"""
+Cache of per-event features of wave files: features are extracted once per file and stored as a columnar table (.npz) next to the data, keyed by the content hash of the file and the extraction parameters.
+"""
+import os
+import re
+import sys
+import json
+import time
+import hashlib
+import argparse
+import numpy
+
+from SPMT_Waveform import readWaveFile, extractFeatures, DEFAULT_BASELINE_LENGTH, DEFAULT_POLARITY
+from SPMT_Histogram import OnlineHistogram
+
+FEATURE_CACHE_FOLDER    = ".features"       # Sub-folder (beside the wave files) where the tables are stored
+FEATURE_CACHE_INDEX     = "index.json"      # Map of (file, size, mtime) to content hash, to avoid hashing again
+FEATURE_COLUMNS         = ("baseline", "amplitude", "charge", "peakTime")
+HASH_BLOCK_SIZE         = 4*1024*1024
+WAVE_FILE_PATTERN       = re.compile(r"^wave_(\d+)(_.*)?\.txt$")      # wave_N.txt, wave_N_ph.txt, wave_N_LED_high.txt...
+
+"""
+Least recently used store of feature tables
+"""
+class FeatureCache():
+    def __init__(self, cacheFolder=None, maximumEntries=64):
+        # When "cacheFolder" is None, tables are stored in a sub-folder of each wave file folder
+        self.cacheFolder    = cacheFolder
+        self.maximumEntries = maximumEntries
+        self.hits           = 0
+        self.misses         = 0
+
+
+    def getFolder(self, fileName):
+        if (self.cacheFolder):
+            return self.cacheFolder
+
+        return os.path.join(os.path.dirname(os.path.abspath(fileName)), FEATURE_CACHE_FOLDER)
+
+
+    def getFeatures(self, fileName, recordLength=None, baselineLength=DEFAULT_BASELINE_LENGTH, polarity=DEFAULT_POLARITY, integrationWindow=None):
+        parameters = {"recordLength": recordLength,
+                      "baselineLength": baselineLength,
+                      "polarity": polarity,
+                      "integrationWindow": list(integrationWindow) if integrationWindow else None}
+
+        try:
+            folder = self.getFolder(fileName)
+            os.makedirs(folder, exist_ok=True)
+
+            key = self.__makeKey(self.getContentHash(fileName), parameters)
+            tableFileName = os.path.join(folder, key + ".npz")
+
+            if (os.path.exists(tableFileName)):
+                # Refresh access time, used as LRU criterion
+                os.utime(tableFileName, None)
+                self.hits += 1
+
+                with numpy.load(tableFileName) as table:
+                    return {column: table[column] for column in FEATURE_COLUMNS}
+        except:
+            print("Exception when looking for cached features of %s..." % fileName)
+            return self.__extract(fileName, parameters)
+
+        self.misses += 1
+        features = self.__extract(fileName, parameters)
+
+        try:
+            # Write to a temporary file first, so an interrupted run never leaves a corrupted table
+            temporaryFileName = tableFileName + ".tmp.npz"
+            numpy.savez(temporaryFileName, **features)
+            os.replace(temporaryFileName, tableFileName)
+
+            self.evict(folder)
+        except:
+            print("Exception when storing cached features of %s..." % fileName)
+            pass
+
+        return features
+
+
+    def __extract(self, fileName, parameters):
+        waves = readWaveFile(fileName, recordLength=parameters["recordLength"])
+
+        return extractFeatures(waves,
+                               baselineLength=parameters["baselineLength"],
+                               polarity=parameters["polarity"],
+                               integrationWindow=parameters["integrationWindow"])
+
+
+    def __makeKey(self, contentHash, parameters):
+        return hashlib.sha1((contentHash + json.dumps(parameters, sort_keys=True)).encode()).hexdigest()
+
+
+    def getContentHash(self, fileName):
+        # -----------------------------------------------------------------
+        # Hashing a large wave file is not free; the hash is remembered
+        # in the index by (absolute name, size, modification time), so it
+        # is only computed again when the file really changes.
+        # -----------------------------------------------------------------
+        stat = os.stat(fileName)
+        indexKey = "%s|%d|%d" % (os.path.abspath(fileName), stat.st_size, stat.st_mtime_ns)
+        indexFileName = os.path.join(self.getFolder(fileName), FEATURE_CACHE_INDEX)
+
+        index = {}
+
+        if (os.path.exists(indexFileName)):
+            try:
+                with open(indexFileName, "r") as indexFile:
+                    index = json.load(indexFile)
+            except:
+                index = {}
+
+        if (indexKey in index):
+            return index[indexKey]
+
+        sha = hashlib.sha1()
+
+        with open(fileName, "rb") as waveFile:
+            for block in iter(lambda: waveFile.read(HASH_BLOCK_SIZE), b""):
+                sha.update(block)
+
+        # Forget old entries of the same file, and the ones of files deleted (or moved) since then
+        absoluteName = os.path.abspath(fileName) + "|"
+        index = {key: value for key, value in index.items()
+                 if ((not key.startswith(absoluteName)) and os.path.exists(key.rsplit("|", 2)[0]))}
+        index[indexKey] = sha.hexdigest()
+
+        with open(indexFileName, "w") as indexFile:
+            json.dump(index, indexFile)
+
+        return index[indexKey]
+
+
+    def evict(self, folder):
+        # Remove the least recently used tables above the maximum number of entries
+        tables = [os.path.join(folder, name) for name in os.listdir(folder) if name.endswith(".npz")]
+
+        if (len(tables) <= self.maximumEntries):
+            return
+
+        tables.sort(key=os.path.getmtime)
+
+        for tableFileName in tables[:len(tables) - self.maximumEntries]:
+            try:
+                os.remove(tableFileName)
+            except OSError:
+                print("Error removing cached features %s..." % tableFileName)
+                pass
+
+
+def reanalyseFolder(folder, amplitudeThreshold=50.0, chargeThreshold=100.0, integrationWindow=None, cache=None):
+    # -----------------------------------------------------------------
+    # Summary of every wave file kept in "folder" (and its sub-folders),
+    # from the cached features: only the first analysis of a file (or
+    # of new extraction parameters) reads the raw samples, changing the
+    # thresholds never does.
+    # -----------------------------------------------------------------
+    cache = cache or FeatureCache()
+    summaries = []
+
+    for path, folders, fileNames in os.walk(folder):
+        folders[:] = [name for name in sorted(folders) if (name != FEATURE_CACHE_FOLDER)]
+
+        for fileName in sorted(fileNames):
+            if (not WAVE_FILE_PATTERN.match(fileName)):
+                continue
+
+            features = cache.getFeatures(os.path.join(path, fileName), integrationWindow=integrationWindow)
+
+            if ((features is None) or (len(features["charge"]) == 0)):
+                continue
+
+            histogram = OnlineHistogram()
+            histogram.fill(0, features)
+            chargePeak, chargePeakError = histogram.getPeakPosition(0, "charge", threshold=chargeThreshold)
+
+            summaries.append({"file": os.path.relpath(os.path.join(path, fileName), folder),
+                              "events": len(features["charge"]),
+                              "baseline": float(features["baseline"].mean()),
+                              "chargePeak": chargePeak,
+                              "chargePeakError": chargePeakError,
+                              "fractionAboveThreshold": float((features["amplitude"] > amplitudeThreshold).mean())})
+
+    return summaries
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Re-analyse the wave files of a run folder from the cached features.")
+    parser.add_argument("folder", help="folder of the run (wave files in it or in its sub-folders)")
+    parser.add_argument("--amplitude-threshold", type=float, default=50.0, help="ADC counts above baseline of an event with light")
+    parser.add_argument("--charge-threshold", type=float, default=100.0, help="charge above the pedestal to look for the peak")
+    parser.add_argument("--integration-window", type=int, nargs=2, metavar=("FIRST", "LAST"), help="samples of the charge integration (new extraction)")
+    arguments = parser.parse_args()
+
+    cache = FeatureCache()
+    startTime = time.time()
+    summaries = reanalyseFolder(arguments.folder, amplitudeThreshold=arguments.amplitude_threshold, chargeThreshold=arguments.charge_threshold,
+                                integrationWindow=arguments.integration_window, cache=cache)
+
+    for summary in summaries:
+        print("%-40s %8d events, baseline %8.2f, charge peak %s, above threshold %.4f" %
+              (summary["file"], summary["events"], summary["baseline"],
+               ("%.1f +- %.1f" % (summary["chargePeak"], summary["chargePeakError"])) if (summary["chargePeak"] is not None) else "none",
+               summary["fractionAboveThreshold"]))
+
+    print("%d files in %.2f s (%d from cache, %d extracted)" % (len(summaries), time.time() - startTime, cache.hits, cache.misses))
+
+    return 0
+
+
+if __name__ == "__main__": sys.exit(main())
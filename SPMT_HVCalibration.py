@@ -0,0 +1,201 @@
+#!/usr/bin/env python3.4
+"""
+Calibration f(x) = a.x + b of each HV module (by model and S/N), refitted by online least squares from the input voltages (MUX) and outputs (VMon) measured in every run.
+"""
+import os
+import json
+import time
+
+DEFAULT_HV_CALIBRATION_FILE = "./HV_calibration.json"
+MAX_LEVELS = 16
+
+"""
+Store of HV calibrations in a JSON file; each module keeps its refitted coefficients, the ones typed by the operator (nominal), the first refit (baseline), the distinct input levels and the weighted sums of the least squares.
+Runs use the nominal coefficients; the refitted ones only when the operator opts in
+"""
+class HVCalibrationStore():
+    def __init__(self, fileName=DEFAULT_HV_CALIBRATION_FILE, forgetting=0.98, maxDrift=0.01, minimumSpread=0.05):
+        self.fileName       = fileName
+        # Weight of the previous points at each new one, so the fit follows a module that ages
+        self.forgetting     = forgetting
+        # Relative difference of the output (refit against baseline) that flags the module as drifting
+        self.maxDrift       = maxDrift
+        # Below this standard deviation of the inputs (V) only "b" is refitted, the slope is not defined
+        self.minimumSpread  = minimumSpread
+        self.modules        = {}
+        self.load()
+
+
+    def load(self):
+        if (not os.path.exists(self.fileName)):
+            return
+
+        try:
+            with open(self.fileName, "r") as fileCalibration:
+                self.modules = json.load(fileCalibration)
+        except:
+            self.modules = {}
+            print("Exception when loading HV calibration %s..." % self.fileName)
+
+
+    def save(self):
+        try:
+            with open(self.fileName + ".tmp", "w") as fileCalibration:
+                json.dump(self.modules, fileCalibration, indent=4)
+
+            os.replace(self.fileName + ".tmp", self.fileName)
+        except:
+            print("Exception when saving HV calibration %s..." % self.fileName)
+
+
+    @staticmethod
+    def getKey(model, serialNumber):
+        return "%s/%s" % (str(model).strip(), str(serialNumber).strip())
+
+
+    def get(self, model, serialNumber, refitted=False):
+        # -----------------------------------------------------------------
+        # (a, b) of the module, or None when it is not known: the nominal
+        # coefficients, unless the refitted ones are asked for and the fit
+        # is usable (the refit is only recorded until the operator opts in).
+        # -----------------------------------------------------------------
+        module = self.modules.get(self.getKey(model, serialNumber))
+
+        if (module is None):
+            return None
+
+        if (refitted and self.isFitUsable(model, serialNumber)):
+            return module["a"], module["b"]
+
+        return tuple(module["nominal"])
+
+
+    def getFit(self, model, serialNumber):
+        # (a, b) refitted for the module, or None when it is not known
+        module = self.modules.get(self.getKey(model, serialNumber))
+
+        if (module is None):
+            return None
+
+        return module["a"], module["b"]
+
+
+    def isFitUsable(self, model, serialNumber):
+        # The slope is only defined by inputs at 2 levels at least (a single voltage by run only moves "b")
+        return len(self.modules.get(self.getKey(model, serialNumber), {}).get("levels", [])) >= 2
+
+
+    def isDrifting(self, model, serialNumber):
+        return self.modules.get(self.getKey(model, serialNumber), {}).get("drifting", False)
+
+
+    def fillCoefficients(self, highVoltageIDs, refitted=False):
+        # -----------------------------------------------------------------
+        # Same as the UI: (model, S/N, a, b) of each known module with the
+        # refitted coefficients in store, only when the operator opts in
+        # and the fit is usable, unless the configuration brings a new
+        # calibration of the module (other than the nominal one).
+        # -----------------------------------------------------------------
+        if (not refitted):
+            return [list(highVoltageID) for highVoltageID in highVoltageIDs]
+
+        filled = []
+
+        for model, serialNumber, a, b in highVoltageIDs:
+            module = self.modules.get(self.getKey(model, serialNumber))
+
+            if ((module is not None) and self.isFitUsable(model, serialNumber) and self.__sameCoefficients(float(a), float(b), module["nominal"])):
+                a, b = module["a"], module["b"]
+
+            filled.append([model, serialNumber, a, b])
+
+        return filled
+
+
+    @staticmethod
+    def __sameCoefficients(a, b, reference):
+        return (abs(reference[0] - a) <= 1e-6 * abs(a)) and (abs(reference[1] - b) <= 1e-6 * max(abs(b), 1.0))
+
+
+    def register(self, model, serialNumber, a, b):
+        # -----------------------------------------------------------------
+        # Coefficients used in a run: a new module, or coefficients other
+        # than the nominal ones (a new calibration of the module typed by
+        # the operator) become the nominal ones and restart the fit. The
+        # refitted coefficients (filled from the store) keep the fit.
+        # -----------------------------------------------------------------
+        key = self.getKey(model, serialNumber)
+        module = self.modules.get(key)
+
+        if ((module is not None) and (self.__sameCoefficients(a, b, module["nominal"]) or self.__sameCoefficients(a, b, (module["a"], module["b"])))):
+            return False
+
+        self.modules[key] = {"a": float(a), "b": float(b),
+                             "nominal": [float(a), float(b)],
+                             "baseline": None,
+                             "levels": [],                            # Distinct inputs (V) of the points
+                             "sums": [0.0, 0.0, 0.0, 0.0, 0.0],       # Weighted n, x, y, x^2, x.y
+                             "drifting": False,
+                             "updated": time.strftime("%Y-%m-%d %H:%M:%S")}
+
+        return True
+
+
+    def addPoints(self, model, serialNumber, inputs, outputs):
+        # Adds pairs (input read by MUX, output of the module) and refits; returns False when the module is not in store
+        module = self.modules.get(self.getKey(model, serialNumber))
+
+        if (module is None):
+            return False
+
+        sums = module["sums"]
+        levels = module.setdefault("levels", [])
+
+        for x, y in zip(inputs, outputs):
+            x = float(x)
+            y = float(y)
+
+            if ((x != x) or (y != y)):
+                # NaN, channel not read
+                continue
+
+            if (all(abs(x - level) > self.minimumSpread for level in levels) and (len(levels) < MAX_LEVELS)):
+                levels.append(x)
+
+            sums = [self.forgetting * total for total in sums]
+            sums = [sums[0] + 1.0, sums[1] + x, sums[2] + y, sums[3] + x * x, sums[4] + x * y]
+
+        module["sums"] = sums
+        self.__refit(module)
+        module["updated"] = time.strftime("%Y-%m-%d %H:%M:%S")
+
+        return True
+
+
+    def __refit(self, module):
+        n, sumX, sumY, sumXX, sumXY = module["sums"]
+
+        if (n <= 0.0):
+            return
+
+        meanX = sumX / n
+        meanY = sumY / n
+        varianceX = (sumXX / n) - (meanX * meanX)
+
+        if (varianceX > (self.minimumSpread * self.minimumSpread)):
+            module["a"] = ((sumXY / n) - (meanX * meanY)) / varianceX
+
+        module["b"] = meanY - module["a"] * meanX
+
+        # -----------------------------------------------------------------
+        # Drift: output of the current fit against the one of the first fit
+        # (outputs measured by VMon have their own scale, so the nominal
+        # coefficients are not the reference), where the module is used.
+        # -----------------------------------------------------------------
+        if (module.get("baseline") is None):
+            module["baseline"] = [module["a"], module["b"]]
+            return
+
+        baselineA, baselineB = module["baseline"]
+        baselineY = baselineA * meanX + baselineB
+        module["drifting"] = ((baselineY != 0.0) and (abs(meanY - baselineY) / abs(baselineY) > self.maxDrift))
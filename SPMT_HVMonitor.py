@@ -0,0 +1,205 @@
+#!/usr/bin/env python3.4
+"""
+Continuous monitoring of the high voltage during the whole run: IMon and VMon of every channel are sampled in background into fixed-size ring buffers, and a drift beyond the allowed errors raises an alarm.
+"""
+import time
+import numpy
+import threading
+
+from SPMT_Cancel import RunCancelled, setCurrentToken
+from SPMT_ChannelState import toFloatArray, parseMonitors, validateMonitors
+
+DEFAULT_MONITOR_CAPACITY = 4096         # Samples kept per channel (more than 2 days at one sample per minute)
+
+# Set while a thread (the monitor, or the sequence between two blocks of triggers) samples the monitors
+samplingState = threading.local()
+
+
+def isSampling():
+    return getattr(samplingState, "active", False)
+
+"""
+Time series of IMon and VMon of all channels in preallocated arrays; the oldest samples are overwritten
+"""
+class MonitorRingBuffer():
+    def __init__(self, numberOfChannels=1, capacity=DEFAULT_MONITOR_CAPACITY):
+        self.capacity   = capacity
+        self.times      = numpy.zeros(capacity, dtype=numpy.float64)
+        self.iMon       = numpy.full((capacity, numberOfChannels), numpy.nan, dtype=numpy.float32)
+        self.vMon       = numpy.full((capacity, numberOfChannels), numpy.nan, dtype=numpy.float32)
+        self.index      = 0             # Next position to write
+        self.count      = 0             # Samples written (up to capacity)
+
+
+    def append(self, timestamp, iMon, vMon):
+        self.times[self.index]  = timestamp
+        self.iMon[self.index]   = iMon
+        self.vMon[self.index]   = vMon
+        self.index = (self.index + 1) % self.capacity
+        self.count = min(self.count + 1, self.capacity)
+
+
+    def getSeries(self):
+        # (times, iMon, vMon) in chronological order
+        order = (numpy.arange(self.count) + (self.index - self.count)) % self.capacity
+
+        return self.times[order], self.iMon[order], self.vMon[order]
+
+
+    def save(self, fileName, channels):
+        times, iMon, vMon = self.getSeries()
+        header = "time " + " ".join("IMon%d" % channel for channel in channels) + " " + " ".join("VMon%d" % channel for channel in channels)
+
+        try:
+            numpy.savetxt(fileName, numpy.column_stack([times, iMon, vMon]), fmt="%.3f", header=header, comments="")
+        except:
+            print("Exception when saving monitor time series %s..." % fileName)
+            return False
+
+        return True
+
+
+"""
+Background sampler of the monitors; samples only while Linduino is idle, so it never interleaves commands with the sequence
+"""
+class HVMonitor():
+    def __init__(self, controller, channels, voltagesArray, vFactor=2.0, iFactor=1.2541993281, maxVMonError=0.03, maxIMonError=0.03,
+                 interval=60.0, alarmSamples=2, capacity=DEFAULT_MONITOR_CAPACITY, onSample=None, onAlarm=None):
+        self.controller     = controller
+        self.channels       = list(channels)
+        self.vFactor        = vFactor
+        self.iFactor        = iFactor
+        self.maxVMonError   = maxVMonError
+        self.maxIMonError   = maxIMonError
+        self.interval       = interval
+        # A single sample out of range (spike, voltage still settling) is not an alarm
+        self.alarmSamples   = alarmSamples
+        self.onSample       = onSample          # (channels, iMon, vMon)
+        self.onAlarm        = onAlarm           # (message)
+        self.buffer         = MonitorRingBuffer(numberOfChannels=len(self.channels), capacity=capacity)
+        self.outOfRange     = numpy.zeros(len(self.channels), dtype=numpy.int32)
+        self.alarm          = None
+        self.lock           = threading.Lock()
+        # Samples are taken by the thread of the monitor while Linduino is idle, or by the sequence between two blocks of triggers
+        self.sampleLock     = threading.Lock()
+        self.lastSampleTime = time.time()
+        self.stopEvent      = threading.Event()
+        self.thread         = None
+        self.setReferences(voltagesArray)
+
+
+    def setReferences(self, voltagesArray):
+        # Voltages (as read by MUX) the monitors are compared to; set again whenever the sequence changes the voltages
+        with self.lock:
+            self.voltages = toFloatArray(voltagesArray)
+            self.outOfRange[:] = 0
+
+
+    def start(self, token=None):
+        self.stopEvent.clear()
+        self.thread = threading.Thread(target=self.__run, args=(token,), name="HVMonitor")
+        self.thread.setDaemon(True)
+        self.thread.start()
+
+
+    def stop(self):
+        self.stopEvent.set()
+
+        if (self.thread and (self.thread is not threading.current_thread())):
+            self.thread.join()
+
+        self.thread = None
+
+
+    def __run(self, token):
+        # Same token of the run: the sample in progress stops when the run is cancelled
+        setCurrentToken(token)
+        self.lastSampleTime = time.time()
+
+        # Linduino busy (trigger, MUX...): try again soon, without waiting for a whole interval
+        while (not self.stopEvent.wait(min(1.0, self.interval))):
+            if ((token is not None) and token.isCancelled()):
+                return
+
+            self.sampleIfDue()
+
+
+    def sampleIfDue(self):
+        # Sample when "interval" has passed since the last one; returns True when it sampled
+        if ((time.time() - self.lastSampleTime) < self.interval):
+            return False
+
+        return self.sample()
+
+
+    def sample(self):
+        # -----------------------------------------------------------------
+        # Returns False when Linduino (or the other sampler) was busy and
+        # nothing was read. Entering the monitor mode of Linduino takes
+        # about 3 s (firmware), during which the sequence waits for the bus.
+        # -----------------------------------------------------------------
+        if (not self.sampleLock.acquire(blocking=False)):
+            return False
+
+        samplingState.active = True
+
+        try:
+            return self.__sample()
+        finally:
+            samplingState.active = False
+            self.sampleLock.release()
+
+
+    def __sample(self):
+        try:
+            monitors = self.controller.readMonitorsIfIdle(self.channels)
+        except RunCancelled:
+            return True
+        except:
+            print("Exception when sampling monitors...")
+            return True
+
+        if (monitors is None):
+            return False
+
+        self.lastSampleTime = time.time()
+        iMon, vMon = parseMonitors(monitors)
+
+        if (numpy.isnan(iMon).any() or numpy.isnan(vMon).any()):
+            print("Invalid monitors read: %s..." % str(monitors))
+            return True
+
+        self.buffer.append(time.time(), iMon, vMon)
+
+        if (self.onSample):
+            self.onSample(self.channels, iMon, vMon)
+
+        self.check(iMon, vMon)
+
+        return True
+
+
+    def check(self, iMon, vMon):
+        # -----------------------------------------------------------------
+        # Same criteria of validateModuleMonitor, for all channels at once;
+        # a channel out of range in "alarmSamples" consecutive samples
+        # raises the alarm (once).
+        # -----------------------------------------------------------------
+        with self.lock:
+            validIMon, validVMon, iReference, vReference = validateMonitors(self.voltages, iMon, vMon, vFactor=self.vFactor, iFactor=self.iFactor,
+                                                                            maxVMonError=self.maxVMonError, maxIMonError=self.maxIMonError)
+            bad = ~(validIMon & validVMon)
+            self.outOfRange = numpy.where(bad, self.outOfRange + 1, 0)
+            alarming = numpy.flatnonzero(self.outOfRange >= self.alarmSamples)
+
+            if ((len(alarming) == 0) or self.alarm):
+                return None
+
+            self.alarm = "; ".join("channel %d drifted (VMon %.3f, expected %.3f; IMon %.3f, expected %.3f)" %
+                                   (self.channels[index], vMon[index], vReference[index], iMon[index], iReference[index])
+                                   for index in alarming)
+
+        if (self.onAlarm):
+            self.onAlarm(self.alarm)
+
+        return self.alarm
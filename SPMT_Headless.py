@@ -0,0 +1,178 @@
+#!/usr/bin/env python3.4
+"""
+Run the whole test sequence without UI (Qt is never imported) and without waiting for the operator; progress goes to a structured log (one JSON object per line).
+"""
+import os
+import sys
+import csv
+import json
+import time
+import signal
+import logging
+import argparse
+
+from SPMT_Project import Orchestrator, DEFAULT_LINDUINO_PORT, DEFAULT_WAVEDUMP_PROGRAM
+from SPMT_Catalog import DEFAULT_CATALOG_FILE
+from SPMT_HVCalibration import HVCalibrationStore
+
+# Items of "comboBox_numberOfChannels" in UI; the CSV stores the index
+NUMBER_OF_CHANNELS_OPTIONS = [1, 8]
+
+# Rows of the CSV saved by the UI (SPMT_Interface.save), in the same order of the fields in each tab;
+# after them, one row per channel with the HV identity (model, S/N, a, b)
+CSV_LAYOUT = [["initialVoltage", "maxVoltageError", "voltageFactor", "currentFactor", "maxVMonError", "maxIMonError", "numberOfChannels", "channelNumber"],
+              ["darkCountFreq", "darkCountPulses"],
+              ["channelOfLED_1", "singlePhVoltageLED_1", "singlePhOptFreq", "singlePhOptPulses", "singlePhAcqFreq", "singlePhAcqPulses"],
+              ["highIntensVoltageLED_1", "highIntensOptFreq", "highIntensOptPulses", "highIntensAcqFreq", "highIntensAcqPulses"],
+              ["channelOfLED_2", "channelOfLED_3", "lowIntensVoltageLEDs", "lowIntensVoltageFactor", "lowIntensAcqFreq", "lowIntensAcqPulses"],
+              ["linearityVoltageFactor", "numberOfColpi", "numberOfSteps", "incrementLED_2", "incrementLED_3", "initialVoltageLED_2", "initialVoltageLED_3", "linearityAcqFreq"]]
+
+# Parameters informed as arithmetic expressions in UI, like "((2100/2.5)*(100/66975))"
+EXPRESSION_PARAMETERS = ["voltageFactor", "currentFactor", "lowIntensVoltageFactor", "linearityVoltageFactor"]
+
+LOG_FILE_FORMAT = "./logs/SPMT_%Y-%b-%d_%Hh%Mm%Ss.jsonl"
+
+"""
+Formatter of log records as JSON lines
+"""
+class JsonFormatter(logging.Formatter):
+    def format(self, record):
+        entry = {"time": round(record.created, 3),
+                 "level": record.levelname,
+                 "event": getattr(record, "event", "message"),
+                 "message": record.getMessage()}
+        entry.update(getattr(record, "fields", {}))
+
+        return json.dumps(entry)
+
+
+def loadConfigurationFile(fileName):
+    # -----------------------------------------------------------------
+    # Two formats are accepted:
+    #     .json -> {"initialVoltage": 1200, ..., "highVoltageIDs": [[model, S/N, a, b], ...]}
+    #     .csv  -> the file saved by the UI (button "Save")
+    # -----------------------------------------------------------------
+    if (fileName.lower().endswith(".csv")):
+        configuration = {}
+
+        with open(fileName, "r") as fileCSV:
+            rows = [row for row in csv.reader(fileCSV)]
+
+        for names, row in zip(CSV_LAYOUT, rows):
+            configuration.update(zip(names, row))
+
+        configuration["numberOfChannels"] = NUMBER_OF_CHANNELS_OPTIONS[int(float(configuration["numberOfChannels"]))]
+        configuration["highVoltageIDs"] = rows[len(CSV_LAYOUT):len(CSV_LAYOUT) + configuration["numberOfChannels"]]
+    else:
+        with open(fileName, "r") as fileJSON:
+            configuration = json.load(fileJSON)
+
+    for name in EXPRESSION_PARAMETERS:
+        if (isinstance(configuration.get(name), str)):
+            # Same as UI, but without access to builtins
+            configuration[name] = float(eval(configuration[name], {"__builtins__": {}}, {}))
+
+    return configuration
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run the SPMT test sequence unattended.")
+    parser.add_argument("config", nargs="?", help="configuration file (.json, or .csv saved by the UI)")
+    parser.add_argument("--resume", metavar="CHECKPOINT", help="resume an interrupted run from its checkpoint.json (configuration is taken from it)")
+    parser.add_argument("--log", default=time.strftime(LOG_FILE_FORMAT), help="structured log file (JSON lines)")
+    parser.add_argument("--port", default=DEFAULT_LINDUINO_PORT, help="serial port of the Linduino of this station")
+    parser.add_argument("--wavedump", default=DEFAULT_WAVEDUMP_PROGRAM, help="WaveDump program (reads WaveDumpConfig.txt of the current folder)")
+    parser.add_argument("--catalog", default=DEFAULT_CATALOG_FILE, help="SQLite catalog of runs")
+    parser.add_argument("--debug", action="store_true", help="print the Linduino returns")
+    parser.add_argument("--dry-run", action="store_true", help="only print the estimated duration of the run")
+    parser.add_argument("--record", metavar="FOLDER", help="record the run (serial transcript, wave files, analysis results) for SPMT_Replay.py")
+    arguments = parser.parse_args()
+
+    if (not (arguments.config or arguments.resume)):
+        parser.error("a configuration file or --resume is required")
+
+    # -------------------------
+    # Structured log
+    os.makedirs(os.path.dirname(os.path.abspath(arguments.log)), exist_ok=True)
+    handler = logging.FileHandler(arguments.log)
+    handler.setFormatter(JsonFormatter())
+
+    logger = logging.getLogger("SPMT")
+    logger.setLevel(logging.INFO)
+    logger.addHandler(handler)
+
+    # -------------------------
+    # Orchestrator without operator prompts
+    orchestrator = Orchestrator(linduinoPort=arguments.port, waveDumpProgram=arguments.wavedump)
+    orchestrator.interactive = False
+    orchestrator.catalogFileName = arguments.catalog
+
+    if (arguments.config):
+        try:
+            configuration = loadConfigurationFile(arguments.config)
+        except:
+            print("Error loading configuration file %s..." % arguments.config)
+            logger.error("Error loading configuration file", extra={"event": "configuration", "fields": {"file": arguments.config}})
+            return 2
+
+        orchestrator.setConfiguration(configuration)
+
+        # Refitted coefficients of the known HV modules from the store of calibrations, only when the operator opts in (as the UI does)
+        orchestrator.highVoltageIDs = HVCalibrationStore(orchestrator.hvCalibrationFileName).fillCoefficients(orchestrator.highVoltageIDs,
+                                                                                                              refitted=orchestrator.useRefittedHVCalibration())
+
+    if (arguments.debug):
+        orchestrator.setDebug(debug=True)
+
+    orchestrator.informExecution.connect(lambda message: logger.info(message, extra={"event": "progress"}))
+    orchestrator.updateTable.connect(lambda snapshot: logger.info("table", extra={"event": "table", "fields": {"table": snapshot}}))
+    orchestrator.phaseChanged.connect(lambda phase, status: logger.info(phase, extra={"event": "phase", "fields": {"phase": phase, "status": status}}))
+
+    # Estimated duration (calibrated by the runs in catalog); imported here because the planner uses loadConfigurationFile
+    from SPMT_Planner import RunPlanner, formatEstimate
+
+    planner = RunPlanner(orchestrator.catalogFileName)
+    planner.calibrate()
+    estimate = planner.estimate(orchestrator.getConfiguration())
+
+    if (arguments.dry_run):
+        print(formatEstimate(estimate))
+        return 0
+
+    logger.info(formatEstimate(estimate), extra={"event": "estimate", "fields": {"estimate": estimate}})
+    logger.info("Start of run", extra={"event": "start", "fields": {"configuration": orchestrator.getConfiguration(), "resume": arguments.resume}})
+    recorder = None
+
+    if (arguments.record):
+        # Imported here: recording is optional and SPMT_Replay imports the benchmark
+        from SPMT_Replay import RunRecorder
+
+        recorder = RunRecorder(orchestrator, arguments.record)
+        recorder.start()
+
+    # SIGTERM (stop of the station by the scheduler) and Ctrl-C cancel the run, which turns the voltages off before exiting
+    def cancelRun(signalNumber, frame):
+        logger.info("Signal %d received, cancelling the run" % signalNumber, extra={"event": "signal", "fields": {"signal": signalNumber}})
+
+        if (not orchestrator.cancel("signal %d" % signalNumber)):
+            # Run not started yet (or already finished), nothing to turn off
+            raise SystemExit(1)
+
+    signal.signal(signal.SIGINT, cancelRun)
+    signal.signal(signal.SIGTERM, cancelRun)
+
+    startTime = time.time()
+    result = None
+
+    try:
+        result = orchestrator.executeProgram(resumeFrom=arguments.resume)
+    finally:
+        if (recorder):
+            recorder.stop(result)
+
+    logger.info("End of run", extra={"event": "end", "fields": {"result": result, "duration": round(time.time() - startTime, 3)}})
+
+    return (0 if (result == 0) else 1)
+
+
+if __name__ == "__main__": sys.exit(main())
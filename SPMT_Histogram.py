@@ -0,0 +1,179 @@
+#!/usr/bin/env python3.4
+"""
+Online histogramming of charge and amplitude while WaveDump is still acquiring, so a trigger loop can stop as soon as the spectrum is precise enough.
+"""
+import numpy
+
+from SPMT_Waveform import WaveFileTail, extractFeatures
+
+"""
+Per-channel charge and amplitude histograms with fixed bins
+"""
+class OnlineHistogram():
+    def __init__(self, numberOfChannels=1, chargeRange=(-500.0, 4500.0), amplitudeRange=(-20.0, 480.0), numberOfBins=250):
+        self.numberOfChannels   = numberOfChannels
+        self.numberOfBins       = numberOfBins
+        # Bin edges are fixed, so filling is just a "bincount"
+        self.chargeEdges        = numpy.linspace(chargeRange[0], chargeRange[1], numberOfBins + 1)
+        self.amplitudeEdges     = numpy.linspace(amplitudeRange[0], amplitudeRange[1], numberOfBins + 1)
+        self.chargeHistograms   = numpy.zeros((numberOfChannels, numberOfBins), dtype=numpy.int64)
+        self.amplitudeHistograms = numpy.zeros((numberOfChannels, numberOfBins), dtype=numpy.int64)
+        self.numberOfEvents     = numpy.zeros(numberOfChannels, dtype=numpy.int64)
+
+
+    def reset(self):
+        self.chargeHistograms[:]    = 0
+        self.amplitudeHistograms[:] = 0
+        self.numberOfEvents[:]      = 0
+
+
+    def fill(self, channel, features):
+        self.chargeHistograms[channel]    += self.__binCount(features["charge"], self.chargeEdges)
+        self.amplitudeHistograms[channel] += self.__binCount(features["amplitude"], self.amplitudeEdges)
+        self.numberOfEvents[channel]      += len(features["charge"])
+
+
+    def __binCount(self, values, edges):
+        # Values out of range are discarded (underflow/overflow are not used for statistics)
+        indexes = numpy.searchsorted(edges, values, side="right") - 1
+        indexes = indexes[(indexes >= 0) & (indexes < self.numberOfBins)]
+
+        return numpy.bincount(indexes, minlength=self.numberOfBins)
+
+
+    def getHistogram(self, channel, quantity="charge"):
+        if (quantity == "amplitude"):
+            return self.amplitudeHistograms[channel], self.amplitudeEdges
+
+        return self.chargeHistograms[channel], self.chargeEdges
+
+
+    def getPeakPosition(self, channel, quantity="charge", threshold=0.0, windowBins=10):
+        # -----------------------------------------------------------------
+        # Peak above "threshold" (to skip the pedestal) and its statistical
+        # uncertainty, using the entries of "windowBins" around the maximum:
+        #     position    -> weighted mean of the bin centres;
+        #     uncertainty -> standard deviation / sqrt(entries).
+        # -----------------------------------------------------------------
+        histogram, edges = self.getHistogram(channel, quantity)
+        centres = (edges[:-1] + edges[1:]) / 2.0
+
+        counts = numpy.where(centres > threshold, histogram, 0)
+
+        if (counts.sum() == 0):
+            return None, None
+
+        peakBin = int(counts.argmax())
+        first   = max(peakBin - windowBins, 0)
+        last    = min(peakBin + windowBins + 1, self.numberOfBins)
+
+        weights = counts[first:last]
+        entries = weights.sum()
+        position = float((weights * centres[first:last]).sum() / entries)
+        deviation = float(numpy.sqrt((weights * (centres[first:last] - position)**2).sum() / entries))
+
+        return position, deviation / numpy.sqrt(entries)
+
+
+    def getRelativePeakUncertainty(self, channel, quantity="charge", threshold=0.0, windowBins=10):
+        position, uncertainty = self.getPeakPosition(channel, quantity, threshold, windowBins)
+
+        if ((position is None) or (position == 0.0)):
+            return None
+
+        return abs(uncertainty / position)
+
+
+    def getRelativeRateUncertainty(self, channel, quantity="amplitude", threshold=0.0):
+        # -----------------------------------------------------------------
+        # Rate of events above "threshold" (dark count rate): k of N events,
+        # binomial fraction p = k/N, so the relative uncertainty is
+        #     sqrt(p.(1-p)/N) / p = sqrt((1-p)/k)
+        # -----------------------------------------------------------------
+        histogram, edges = self.getHistogram(channel, quantity)
+        centres = (edges[:-1] + edges[1:]) / 2.0
+
+        above = int(histogram[centres > threshold].sum())
+        events = int(self.numberOfEvents[channel])
+
+        if ((above == 0) or (events == 0)):
+            return None
+
+        return float(numpy.sqrt((1.0 - above / events) / above))
+
+
+    def isConverged(self, precision, quantity="charge", threshold=0.0, minimumEvents=100, statistic="peak"):
+        # -----------------------------------------------------------------
+        # Every channel must have enough events and the statistic within the
+        # desired (relative) precision:
+        #     "peak" -> position of the peak above threshold;
+        #     "rate" -> fraction of events above threshold.
+        # -----------------------------------------------------------------
+        for channel in range(self.numberOfChannels):
+            if (self.numberOfEvents[channel] < minimumEvents):
+                return False
+
+            if (statistic == "rate"):
+                relative = self.getRelativeRateUncertainty(channel, quantity, threshold)
+            else:
+                relative = self.getRelativePeakUncertainty(channel, quantity, threshold)
+
+            if ((relative is None) or (relative > precision)):
+                return False
+
+        return True
+
+
+"""
+Tail the wave files of all channels and keep their histograms up to date
+"""
+class OnlineAccumulator():
+    def __init__(self, waveFileName="./wave_%d.txt", numberOfChannels=1, channelNumber=0, recordLength=None, baselineLength=50, integrationWindow=None, **histogramParameters):
+        self.numberOfChannels   = numberOfChannels
+        self.channelNumber      = channelNumber
+        self.baselineLength     = baselineLength
+        self.integrationWindow  = integrationWindow
+        self.histogram          = OnlineHistogram(numberOfChannels=numberOfChannels, **histogramParameters)
+
+        # In single channel mode, files are named by the channel number, but the histogram index is "0"
+        if (numberOfChannels > 1):
+            channels = range(numberOfChannels)
+        else:
+            channels = [channelNumber]
+
+        self.tails = [WaveFileTail(waveFileName % channel, recordLength=recordLength) for channel in channels]
+
+
+    def reset(self):
+        for tail in self.tails:
+            tail.reset()
+
+        self.histogram.reset()
+
+
+    def update(self):
+        newEvents = 0
+
+        for index, tail in enumerate(self.tails):
+            waves = tail.readEvents()
+
+            if (waves.shape[0] > 0):
+                features = extractFeatures(waves, baselineLength=self.baselineLength, integrationWindow=self.integrationWindow)
+                self.histogram.fill(index, features)
+                newEvents += waves.shape[0]
+
+        return newEvents
+
+
+    def isConverged(self, precision, quantity="charge", threshold=0.0, minimumEvents=100, statistic="peak"):
+        return self.histogram.isConverged(precision, quantity=quantity, threshold=threshold, minimumEvents=minimumEvents, statistic=statistic)
+
+
+    def getStatistics(self, quantity="charge", threshold=0.0):
+        statistics = []
+
+        for channel in range(self.numberOfChannels):
+            position, uncertainty = self.histogram.getPeakPosition(channel, quantity=quantity, threshold=threshold)
+            statistics.append((int(self.histogram.numberOfEvents[channel]), position, uncertainty))
+
+        return statistics
@@ -7,16 +7,74 @@ import csv
 from PyQt5.QtGui import *
 from PyQt5.QtCore import *
 from PyQt5.QtWidgets import *
-from PyQt5.uic import loadUi
-from datetime import datetime
-from threading import Thread
 from SPMT_Project import *
+from SPMT_Planner import RunPlanner, formatEstimate
+from SPMT_LogView import LogListModel
+from SPMT_LiveView import LivePanel
+from SPMT_MonitorTable import MonitorTableModel
+from SPMT_UICache import loadCachedUi
+from SPMT_HVCalibration import HVCalibrationStore
+
+# Milliseconds to wait for the run to turn the voltages off when the window is closed
+RUN_STOP_TIMEOUT = 10000
+
+"""
+Worker that executes the sequence of the orchestrator in a QThread
+"""
+class RunWorker(QObject):
+    finished = pyqtSignal(int)
+
+    def __init__(self, orchestrator):
+        super(RunWorker, self).__init__()
+        self.orchestrator = orchestrator
+
+    def run(self):
+        result = -1
+
+        try:
+            result = self.orchestrator.executeProgram()
+        except:
+            print("Exception when executing the program...")
+        finally:
+            self.finished.emit(result)
+
+
+"""
+Qt signals that forward the (Qt-free) orchestrator signals, so the widgets are always updated in the UI thread
+"""
+class OrchestratorSignals(QObject):
+    updateTable = pyqtSignal(object)
+    resetButtons = pyqtSignal()
+
 
 class SPMT_Interface(QMainWindow):
     def __init__(self, *args):
         super(SPMT_Interface, self).__init__(*args)
         # 
-        self.mainLayout = loadUi('SPMT_UI.ui', self)
+        # Compiled module of the .ui (in cache), regenerated only when the .ui changes
+        self.mainLayout = loadCachedUi('SPMT_UI.ui', self)
+
+        # Monitoring table (Vset, Vmon, Imon), updated by whole snapshots
+        self.tableModel = MonitorTableModel(parent=self)
+        self.mainLayout.tableView_table.setModel(self.tableModel)
+
+        # Log of execution: bounded model, flushed to the view by a timer
+        self.logModel = LogListModel(parent=self)
+        self.mainLayout.listView_logView.setModel(self.logModel)
+        self.logModel.rowsInserted.connect(self.mainLayout.listView_logView.scrollToBottom)
+
+        # Live waveform and charge spectrum, read from the wave files while WaveDump acquires
+        self.livePanel = LivePanel()
+        self.liveDock = QDockWidget("Live view", self)
+        self.liveDock.setWidget(self.livePanel)
+        self.addDockWidget(Qt.RightDockWidgetArea, self.liveDock)
+
+        # Main object of SPMT project (execution program); Linduino is connected in background once the window is shown
+        self.orchestrator = Orchestrator()
+        QTimer.singleShot(0, self.orchestrator.spmtControllerObj.connectInBackground)
+
+        # Calibrations of HV modules by model and S/N, to fill-in the coefficients of the table of identities
+        self.hvCalibration = HVCalibrationStore()
 
         # Set initial configuration
         self.initialSetup()
@@ -28,27 +86,48 @@ class SPMT_Interface(QMainWindow):
         self.pushButton_runProgramm.clicked.connect(self.runProgramm)
         self.pushButton_save.clicked.connect(self.save)
         self.pushButton_open.clicked.connect(self.restore)
-
-        # Main object of SPMT project (execution program)
-        self.orchestrator = Orchestrator()
+        self.mainLayout.tableWidget_inputID.cellChanged.connect(self.changedInputID)
 
         # Attributes
         self.configArray = []
+        self.runThread = None
+        self.runWorker = None
     
-        # Connect all slots
-        self.orchestrator.informExecution.connect(self.informExecution)
-        self.orchestrator.fillTable.connect(self.fillTable)
-        self.orchestrator.resetButtons.connect(self.resetButtons)
+        # Connect all slots (through Qt signals, because orchestrator runs in another thread); the log model is thread-safe
+        self.orchestratorSignals = OrchestratorSignals()
+        self.orchestrator.informExecution.connect(self.logModel.append)
+        self.orchestrator.updateTable.connect(self.orchestratorSignals.updateTable.emit)
+        self.orchestrator.resetButtons.connect(self.orchestratorSignals.resetButtons.emit)
+
+        self.orchestratorSignals.updateTable.connect(self.updateTable)
+        self.orchestratorSignals.resetButtons.connect(self.resetButtons)
 
     #@pyqtSlot()
     def runProgramm(self):
         # Store parameters
         self.__storeConfigParameters()
 
-        # Call execution method from orchestrator...
-        executeProgram = Thread(target=self.orchestrator.executeProgram)
-        executeProgram.setDaemon(True)
-        executeProgram.start()
+        # Estimated duration (calibrated by the runs in catalog), in the log and the status bar; the run starts at once
+        try:
+            planner = RunPlanner(self.orchestrator.catalogFileName)
+            planner.calibrate()
+            estimate = formatEstimate(planner.estimate(self.orchestrator.getConfiguration()))
+        except:
+            estimate = "Duration could not be estimated..."
+
+        self.informExecution(estimate)
+        self.statusBar().showMessage(estimate.splitlines()[0])
+
+        # Call execution method from orchestrator, in a worker thread...
+        self.runThread = QThread(self)
+        self.runWorker = RunWorker(self.orchestrator)
+        self.runWorker.moveToThread(self.runThread)
+        self.runThread.started.connect(self.runWorker.run)
+        self.runWorker.finished.connect(self.runThread.quit)
+        self.runThread.finished.connect(self.resetButtons)
+        self.runThread.start()
+
+        self.livePanel.start(self.orchestrator.numberOfChannels, self.orchestrator.channelNumber)
 
         # Disable run button
         self.pushButton_runProgramm.setEnabled(False)
@@ -233,6 +312,7 @@ class SPMT_Interface(QMainWindow):
         self.fillInputIDTable(0, 1, "066")
         self.fillInputIDTable(0, 2, "847.3831157965")
         self.fillInputIDTable(0, 3, "3.712840922")
+        self.fillCalibration(0)
 
         if (index == 0):
             self.lineEdit_channelNumber.setEnabled(True)
@@ -240,9 +320,42 @@ class SPMT_Interface(QMainWindow):
         else:
             self.lineEdit_channelNumber.setEnabled(False)
 
+    def changedInputID(self, row, col):
+        # Model or S/N typed: coefficients of the module, if it is known
+        if (col in (0, 1)):
+            self.fillCalibration(row)
+
+    def fillCalibration(self, row):
+        model = self.mainLayout.tableWidget_inputID.item(row, 0)
+        serialNumber = self.mainLayout.tableWidget_inputID.item(row, 1)
+
+        if ((model is None) or (serialNumber is None)):
+            return
+
+        calibration = self.hvCalibration.get(model.text(), serialNumber.text(), refitted=self.orchestrator.useRefittedHVCalibration())
+
+        if (calibration is None):
+            return
+
+        edit = bool(model.flags() & Qt.ItemIsEditable)
+        self.fillInputIDTable(row, 2, "%.10g" % calibration[0], edit=edit)
+        self.fillInputIDTable(row, 3, "%.10g" % calibration[1], edit=edit)
+
+        if (self.hvCalibration.isDrifting(model.text(), serialNumber.text())):
+            for col in (2, 3):
+                self.mainLayout.tableWidget_inputID.item(row, col).setBackground(QColor(255, 200, 120))
+                self.mainLayout.tableWidget_inputID.item(row, col).setToolTip("Module drifting from its calibration")
+
     #@pyqtSlot()
     def reset(self):
+        if (self.isRunning()):
+            # The run stops at its next wait and turns the voltages off; buttons are reset when its thread finishes
+            self.orchestrator.cancel()
+            self.pushButton_reset.setEnabled(False)
+            return
+
         self.orchestrator.reset()
+        self.livePanel.stop()
 
         # Disable run button
         self.pushButton_runProgramm.setEnabled(True)
@@ -250,11 +363,26 @@ class SPMT_Interface(QMainWindow):
 
     #@pyqtSlot()
     def exit(self):
-        self.orchestrator.reset()
-        # wait a while
-        sleep(3)
+        # Without a run in progress, just make sure the voltages are off (a run turns them off itself in closeEvent)
+        if (not self.isRunning()):
+            self.orchestrator.reset()
+
         self.close()
 
+    def closeEvent(self, event):
+        if (self.isRunning()):
+            self.orchestrator.cancel()
+            self.runThread.wait(RUN_STOP_TIMEOUT)
+
+        # Last messages to the file of history
+        self.logModel.close()
+        self.livePanel.stop()
+        super(SPMT_Interface, self).closeEvent(event)
+
+
+    def isRunning(self):
+        return ((self.runThread is not None) and self.runThread.isRunning())
+
 
     #@pyqtSlot()
     def save(self):
@@ -373,7 +501,7 @@ class SPMT_Interface(QMainWindow):
 
     def initialSetup(self):
         # Clean the history of execution
-        self.mainLayout.listWidget_logView.clear()
+        self.logModel.clear()
 
         # -------------------------
         # Table to receive (input) identities of High Voltage sources (CAEN)
@@ -388,9 +516,7 @@ class SPMT_Interface(QMainWindow):
         # -------------------------
         # Table to display monitoring information (voltage and current)
         # Clean table values...
-        for row in range(self.mainLayout.tableWidget_table.rowCount()):
-            for col in range(self.mainLayout.tableWidget_table.columnCount()):
-                self.mainLayout.tableWidget_table.setItem(row, col, QTableWidgetItem(""))
+        self.tableModel.clear()
 
         # Set default parameters values for configuration
         # -------------------------
@@ -451,11 +577,11 @@ class SPMT_Interface(QMainWindow):
 
 
     def informExecution(self, message=""):
-        self.mainLayout.listWidget_logView.addItem(datetime.now().strftime('%d/%m/%Y %H:%m:%S') + " - " + message)
+        self.logModel.append(message)
 
     #@pyqtSlot()
-    def fillTable(self, row, col, value):
-        self.mainLayout.tableWidget_table.setItem(row, col, QTableWidgetItem(str(value)))
+    def updateTable(self, snapshot):
+        self.tableModel.setSnapshot(snapshot)
 
     def fillInputIDTable(self, row, col, value, edit=True):
         # --------------------------
@@ -469,6 +595,9 @@ class SPMT_Interface(QMainWindow):
 
     #@pyqtSlot()
     def resetButtons(self):
+        self.livePanel.stop()
+        # Calibrations refitted by the run
+        self.hvCalibration.load()
         self.pushButton_reset.setEnabled(False)
         self.pushButton_runProgramm.setEnabled(True)
 
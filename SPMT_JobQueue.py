@@ -0,0 +1,517 @@
+#!/usr/bin/env python3.4
+"""
+Persistent queue of PMT modules to test and a scheduler that keeps every test station (Linduino + digitizer) busy, running the headless sequence for the queued modules without an operator.
+"""
+import os
+import sys
+import json
+import time
+import sqlite3
+import argparse
+import subprocess
+
+from contextlib import contextmanager
+from datetime import datetime
+
+from SPMT_Headless import loadConfigurationFile
+from SPMT_Catalog import DEFAULT_CATALOG_FILE
+
+DEFAULT_QUEUE_FILE      = "./jobs.sqlite"
+DEFAULT_PRESET_FOLDER   = "./presets"
+DEFAULT_STATIONS_FILE   = "./stations.json"
+
+# Analysis programs called by the sequence from the current folder; linked into the folder of each station
+ANALYSIS_PROGRAMS = ["Fondo.exe", "10percFauth_v1", "10Percento.exe", "Ricerca.exe", "Single_ph.exe", "Linearity.exe"]
+
+QUEUE_SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id              INTEGER PRIMARY KEY AUTOINCREMENT,
+    model           TEXT NOT NULL,
+    serialNumber    TEXT NOT NULL,
+    aFactor         REAL NOT NULL,
+    bFactor         REAL NOT NULL,
+    preset          TEXT NOT NULL,
+    status          TEXT NOT NULL,
+    station         TEXT,
+    attempts        INTEGER NOT NULL DEFAULT 0,
+    maximumAttempts INTEGER NOT NULL DEFAULT 3,
+    createdTime     TEXT NOT NULL,
+    startTime       TEXT,
+    endTime         TEXT,
+    message         TEXT
+);
+CREATE TABLE IF NOT EXISTS stationUsage (
+    station         TEXT NOT NULL,
+    jobs            TEXT NOT NULL,
+    startTime       REAL NOT NULL,
+    endTime         REAL,
+    result          INTEGER
+);
+CREATE INDEX IF NOT EXISTS jobsStatus ON jobs(status);
+CREATE INDEX IF NOT EXISTS stationUsageStation ON stationUsage(station);
+"""
+
+# Status of a job
+JOB_QUEUED  = "queued"
+JOB_RUNNING = "running"
+JOB_DONE    = "done"
+JOB_FAILED  = "failed"
+
+"""
+Queue of modules (model, S/N, calibration a/b and configuration preset), kept in SQLite so it survives restarts
+"""
+class JobQueue():
+    def __init__(self, fileName=DEFAULT_QUEUE_FILE):
+        self.fileName = fileName
+
+        with self.__connect() as connection:
+            connection.executescript(QUEUE_SCHEMA)
+
+
+    @contextmanager
+    def __connect(self):
+        connection = sqlite3.connect(self.fileName, timeout=30)
+        connection.row_factory = sqlite3.Row
+
+        try:
+            with connection:
+                yield connection
+        finally:
+            connection.close()
+
+
+    def __now(self):
+        return datetime.now().isoformat(sep=' ', timespec='seconds')
+
+
+    def addJob(self, model, serialNumber, aFactor, bFactor, preset, maximumAttempts=3):
+        with self.__connect() as connection:
+            cursor = connection.execute("INSERT INTO jobs (model, serialNumber, aFactor, bFactor, preset, status, maximumAttempts, createdTime) "
+                                        "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                                        (str(model), str(serialNumber), float(aFactor), float(bFactor), preset, JOB_QUEUED, maximumAttempts, self.__now()))
+
+        return cursor.lastrowid
+
+
+    def claimJobs(self, station, maximumJobs=1):
+        # -----------------------------------------------------------------
+        # Take the oldest queued job and up to "maximumJobs" queued jobs of
+        # the same preset (one module per channel of the station); the
+        # transaction is exclusive, so two schedulers never take the same job.
+        # A job that has already failed runs alone, so a faulty module does
+        # not make the others of its run fail again.
+        # -----------------------------------------------------------------
+        with self.__connect() as connection:
+            connection.execute("BEGIN IMMEDIATE")
+            first = connection.execute("SELECT * FROM jobs WHERE status = ? ORDER BY id LIMIT 1", (JOB_QUEUED,)).fetchone()
+
+            if (first is None):
+                return []
+
+            if (first["attempts"] > 0):
+                jobs = [dict(first)]
+            else:
+                jobs = [dict(row) for row in connection.execute("SELECT * FROM jobs WHERE status = ? AND preset = ? AND attempts = 0 ORDER BY id LIMIT ?",
+                                                                (JOB_QUEUED, first["preset"], maximumJobs))]
+
+            connection.executemany("UPDATE jobs SET status = ?, station = ?, attempts = attempts + 1, startTime = ?, endTime = NULL WHERE id = ?",
+                                   [(JOB_RUNNING, station, self.__now(), job["id"]) for job in jobs])
+
+        return jobs
+
+
+    def finishJob(self, jobId, succeeded, message=None):
+        # A failed job goes back to the queue until it reaches its maximum number of attempts
+        with self.__connect() as connection:
+            job = connection.execute("SELECT attempts, maximumAttempts FROM jobs WHERE id = ?", (jobId,)).fetchone()
+
+            if (succeeded):
+                status = JOB_DONE
+            elif (job["attempts"] < job["maximumAttempts"]):
+                status = JOB_QUEUED
+            else:
+                status = JOB_FAILED
+
+            connection.execute("UPDATE jobs SET status = ?, endTime = ?, message = ? WHERE id = ?", (status, self.__now(), message, jobId))
+
+        return status
+
+
+    def requeueJob(self, jobId, resetAttempts=True):
+        with self.__connect() as connection:
+            if (resetAttempts):
+                connection.execute("UPDATE jobs SET status = ?, attempts = 0, message = NULL WHERE id = ?", (JOB_QUEUED, jobId))
+            else:
+                connection.execute("UPDATE jobs SET status = ? WHERE id = ?", (JOB_QUEUED, jobId))
+
+
+    def recoverInterruptedJobs(self):
+        # Jobs left "running" by a scheduler that was killed; the attempt is not counted
+        with self.__connect() as connection:
+            cursor = connection.execute("UPDATE jobs SET status = ?, attempts = MAX(attempts - 1, 0) WHERE status = ?", (JOB_QUEUED, JOB_RUNNING))
+
+        return cursor.rowcount
+
+
+    def listJobs(self, status=None):
+        with self.__connect() as connection:
+            if (status):
+                rows = connection.execute("SELECT * FROM jobs WHERE status = ? ORDER BY id", (status,))
+            else:
+                rows = connection.execute("SELECT * FROM jobs ORDER BY id")
+
+            return [dict(row) for row in rows]
+
+
+    def startUsage(self, station, jobIds):
+        with self.__connect() as connection:
+            cursor = connection.execute("INSERT INTO stationUsage (station, jobs, startTime) VALUES (?, ?, ?)",
+                                        (station, json.dumps(jobIds), time.time()))
+
+        return cursor.lastrowid
+
+
+    def finishUsage(self, usageId, result):
+        with self.__connect() as connection:
+            connection.execute("UPDATE stationUsage SET endTime = ?, result = ? WHERE rowid = ?", (time.time(), result, usageId))
+
+
+    def getUtilisation(self, sinceTime=None, untilTime=None):
+        # -----------------------------------------------------------------
+        # Per station: jobs executed, busy time and fraction of the period
+        # (default: from the first usage until now) the station was busy.
+        # -----------------------------------------------------------------
+        untilTime = untilTime or time.time()
+
+        with self.__connect() as connection:
+            rows = [dict(row) for row in connection.execute("SELECT * FROM stationUsage WHERE ? IS NULL OR COALESCE(endTime, ?) >= ?",
+                                                            (sinceTime, untilTime, sinceTime))]
+
+        if (sinceTime is None):
+            sinceTime = min([row["startTime"] for row in rows], default=untilTime)
+
+        period = max(untilTime - sinceTime, 1e-9)
+        utilisation = {}
+
+        for row in rows:
+            busy = min(row["endTime"] or untilTime, untilTime) - max(row["startTime"], sinceTime)
+            station = utilisation.setdefault(row["station"], {"executions": 0, "failures": 0, "busyTime": 0.0})
+            station["executions"] += 1
+            station["failures"]   += int(row["result"] not in (None, 0))
+            station["busyTime"]   += max(busy, 0.0)
+
+        for station in utilisation.values():
+            station["utilisation"] = round(station["busyTime"] / period, 4)
+            station["busyTime"]    = round(station["busyTime"], 1)
+
+        return utilisation
+
+
+"""
+One test station: serial port of its Linduino, the WaveDump program and a working folder (with the WaveDumpConfig.txt of its digitizer)
+"""
+class Station():
+    def __init__(self, name, port, workDir, waveDump=None, numberOfChannels=None):
+        self.name               = name
+        self.port               = port
+        self.workDir            = os.path.abspath(workDir)
+        self.waveDump           = waveDump
+        self.numberOfChannels   = numberOfChannels      # Limit of modules per run; None uses the preset
+        # Execution in progress
+        self.process            = None
+        self.jobs               = []
+        self.usageId            = None
+        self.consecutiveFailures = 0
+        self.enabled            = True
+
+
+    def isIdle(self):
+        return (self.enabled and (self.process is None))
+
+
+"""
+Dispatch queued jobs to idle stations; each run is the headless sequence in a separate process, in the folder of the station
+"""
+class StationScheduler():
+    def __init__(self, queue, stations, presetFolder=DEFAULT_PRESET_FOLDER, catalogFileName=DEFAULT_CATALOG_FILE,
+                 programsFolder=".", pollInterval=5.0, maximumConsecutiveFailures=3, stopTimeout=120.0):
+        self.queue                      = queue
+        self.stations                   = stations
+        self.presetFolder               = os.path.abspath(presetFolder)
+        self.catalogFileName            = os.path.abspath(catalogFileName)
+        self.programsFolder             = os.path.abspath(programsFolder)
+        self.pollInterval               = pollInterval
+        # A station failing every job probably has a hardware problem, stop giving jobs to it
+        self.maximumConsecutiveFailures = maximumConsecutiveFailures
+        # Longest wait for a stopped run to turn its voltages off and exit (seconds), then it is killed
+        self.stopTimeout                = stopTimeout
+        self.headlessProgram            = os.path.join(os.path.dirname(os.path.abspath(__file__)), "SPMT_Headless.py")
+
+
+    def prepareStation(self, station):
+        os.makedirs(station.workDir, exist_ok=True)
+
+        # Analysis programs are called as "./program" by the sequence
+        for program in ANALYSIS_PROGRAMS:
+            source = os.path.join(self.programsFolder, program)
+            target = os.path.join(station.workDir, program)
+
+            if (os.path.exists(source) and (not os.path.lexists(target))):
+                os.symlink(source, target)
+
+        if (not os.path.exists(os.path.join(station.workDir, "WaveDumpConfig.txt"))):
+            print("Station %s: no WaveDumpConfig.txt in %s..." % (station.name, station.workDir))
+
+
+    def loadPreset(self, preset):
+        for fileName in [preset, preset + ".json", preset + ".csv"]:
+            fileName = os.path.join(self.presetFolder, fileName)
+
+            if (os.path.isfile(fileName)):
+                return loadConfigurationFile(fileName)
+
+        raise FileNotFoundError("Preset %s not found in %s" % (preset, self.presetFolder))
+
+
+    def dispatch(self, station):
+        queued = self.queue.listJobs(status=JOB_QUEUED)
+
+        if (not queued):
+            return False
+
+        try:
+            preset = queued[0]["preset"]
+            configuration = self.loadPreset(preset)
+        except:
+            # The job could never run, count it as a failed attempt
+            print("Exception when loading preset %s..." % queued[0]["preset"])
+
+            for job in self.queue.claimJobs(station.name, maximumJobs=1):
+                self.queue.finishJob(job["id"], succeeded=False, message="invalid preset %s" % job["preset"])
+
+            return False
+
+        maximumJobs = int(configuration.get("numberOfChannels", 1))
+
+        if (station.numberOfChannels):
+            maximumJobs = min(maximumJobs, station.numberOfChannels)
+
+        jobs = self.queue.claimJobs(station.name, maximumJobs=maximumJobs)
+
+        if (not jobs):
+            return False
+
+        if (jobs[0]["preset"] != preset):
+            # Another scheduler took the jobs meanwhile
+            configuration = self.loadPreset(jobs[0]["preset"])
+
+        # --------------------------------------------
+        # One module per channel; a single module keeps the channel of the preset
+        # --------------------------------------------
+        configuration["highVoltageIDs"] = [[job["model"], job["serialNumber"], job["aFactor"], job["bFactor"]] for job in jobs]
+
+        if (len(jobs) > 1):
+            configuration["numberOfChannels"] = len(jobs)
+        else:
+            configuration["numberOfChannels"] = 1
+
+        jobIds = [job["id"] for job in jobs]
+        configurationFileName = os.path.join(station.workDir, "job_%s.json" % "_".join(str(jobId) for jobId in jobIds))
+
+        with open(configurationFileName, "w") as fileConfiguration:
+            json.dump(configuration, fileConfiguration, indent=4)
+
+        command = [sys.executable, self.headlessProgram, configurationFileName,
+                   "--port", station.port,
+                   "--catalog", self.catalogFileName,
+                   "--log", os.path.join(station.workDir, "logs", "job_%s.jsonl" % "_".join(str(jobId) for jobId in jobIds))]
+
+        if (station.waveDump):
+            command += ["--wavedump", station.waveDump]
+
+        try:
+            station.process = subprocess.Popen(command, cwd=station.workDir)
+        except:
+            print("Station %s: exception when starting the run..." % station.name)
+
+            for jobId in jobIds:
+                self.queue.finishJob(jobId, succeeded=False, message="run not started on station %s" % station.name)
+
+            return False
+
+        station.jobs = jobIds
+        station.usageId = self.queue.startUsage(station.name, jobIds)
+        print("Station %s: testing %s (jobs %s)..." % (station.name, ", ".join("SN%s" % job["serialNumber"] for job in jobs), jobIds))
+
+        return True
+
+
+    def collect(self, station):
+        # Returns True when the execution of the station has finished
+        result = station.process.poll()
+
+        if (result is None):
+            return False
+
+        succeeded = (result == 0)
+
+        for jobId in station.jobs:
+            status = self.queue.finishJob(jobId, succeeded=succeeded,
+                                          message=(None if succeeded else "exit code %d on station %s" % (result, station.name)))
+            print("Station %s: job %d %s..." % (station.name, jobId, status))
+
+        self.queue.finishUsage(station.usageId, result)
+
+        if (succeeded):
+            station.consecutiveFailures = 0
+        else:
+            station.consecutiveFailures += 1
+
+            if (station.consecutiveFailures >= self.maximumConsecutiveFailures):
+                station.enabled = False
+                print("Station %s disabled after %d consecutive failures..." % (station.name, station.consecutiveFailures))
+
+        station.process = None
+        station.jobs = []
+        station.usageId = None
+
+        return True
+
+
+    def run(self, untilEmpty=True):
+        # -----------------------------------------------------------------
+        # Loop: collect finished runs, give the next jobs to idle stations.
+        # With "untilEmpty", returns when the queue is empty and every
+        # station is idle; otherwise waits for new jobs forever.
+        # -----------------------------------------------------------------
+        recovered = self.queue.recoverInterruptedJobs()
+
+        if (recovered):
+            print("%d interrupted job(s) back to the queue..." % recovered)
+
+        for station in self.stations:
+            self.prepareStation(station)
+
+        try:
+            while (True):
+                for station in self.stations:
+                    if (station.process):
+                        self.collect(station)
+
+                    if (station.isIdle()):
+                        self.dispatch(station)
+
+                busy = [station for station in self.stations if (station.process)]
+
+                if (not busy):
+                    if (not [station for station in self.stations if (station.enabled)]):
+                        print("No station available...")
+                        return 1
+
+                    if (untilEmpty and (not self.queue.listJobs(status=JOB_QUEUED))):
+                        return 0
+
+                time.sleep(self.pollInterval)
+        except KeyboardInterrupt:
+            # -----------------------------------------------------------------
+            # Stop the runs in progress (each one cancels itself and turns its
+            # voltages off); their jobs go back to the queue once the run has
+            # exited, killed only when it does not exit in time.
+            # -----------------------------------------------------------------
+            stopping = [station for station in self.stations if (station.process)]
+
+            for station in stopping:
+                try:
+                    station.process.terminate()
+                except:
+                    pass
+
+            deadline = time.time() + self.stopTimeout
+
+            for station in stopping:
+                try:
+                    station.process.wait(timeout=max(0.0, deadline - time.time()))
+                except subprocess.TimeoutExpired:
+                    print("Station %s: run did not stop in %.0f s, killing it..." % (station.name, self.stopTimeout))
+                    station.process.kill()
+                    station.process.wait()
+
+                for jobId in station.jobs:
+                    self.queue.requeueJob(jobId, resetAttempts=False)
+
+                self.queue.finishUsage(station.usageId, -1)
+                station.process = None
+
+            return 130
+
+
+def loadStations(fileName):
+    # -----------------------------------------------------------------
+    # JSON list of stations, like:
+    #     [{"name": "A", "port": "/dev/ttyUSB0", "workDir": "./stations/A", "waveDump": "/path/to/wavedump"}, ...]
+    # -----------------------------------------------------------------
+    with open(fileName, "r") as fileStations:
+        return [Station(name=station["name"], port=station["port"], workDir=station.get("workDir", os.path.join("stations", station["name"])),
+                        waveDump=station.get("waveDump"), numberOfChannels=station.get("numberOfChannels"))
+                for station in json.load(fileStations)]
+
+
+"""
+Main()
+"""
+def main():
+    parser = argparse.ArgumentParser(description="Queue of SPMT modules to test and scheduler of test stations.")
+    parser.add_argument("--queue", default=DEFAULT_QUEUE_FILE, help="SQLite file of the queue")
+    commands = parser.add_subparsers(dest="command")
+
+    add = commands.add_parser("add", help="queue one module")
+    add.add_argument("--model", required=True, help="HV model")
+    add.add_argument("--sn", required=True, help="serial number")
+    add.add_argument("--a", type=float, required=True, help="calibration f(x) = a.x + b (a)")
+    add.add_argument("--b", type=float, required=True, help="calibration f(x) = a.x + b (b)")
+    add.add_argument("--preset", required=True, help="configuration preset (.json or .csv saved by the UI) in the preset folder")
+    add.add_argument("--attempts", type=int, default=3, help="maximum number of attempts")
+
+    listing = commands.add_parser("list", help="list the jobs")
+    listing.add_argument("--status", choices=[JOB_QUEUED, JOB_RUNNING, JOB_DONE, JOB_FAILED])
+
+    requeue = commands.add_parser("requeue", help="put jobs back in the queue")
+    requeue.add_argument("ids", type=int, nargs="+")
+
+    commands.add_parser("utilisation", help="utilisation of each station")
+
+    run = commands.add_parser("run", help="dispatch the queued jobs to the stations")
+    run.add_argument("--stations", default=DEFAULT_STATIONS_FILE, help="JSON file with the stations")
+    run.add_argument("--presets", default=DEFAULT_PRESET_FOLDER, help="folder of configuration presets")
+    run.add_argument("--catalog", default=DEFAULT_CATALOG_FILE, help="SQLite catalog of runs, shared by all stations")
+    run.add_argument("--programs", default=".", help="folder of the analysis programs")
+    run.add_argument("--poll", type=float, default=5.0, help="seconds between checks of the stations")
+    run.add_argument("--forever", action="store_true", help="keep waiting for new jobs when the queue is empty")
+
+    arguments = parser.parse_args()
+    queue = JobQueue(arguments.queue)
+
+    if (arguments.command == "add"):
+        print(queue.addJob(arguments.model, arguments.sn, arguments.a, arguments.b, arguments.preset, maximumAttempts=arguments.attempts))
+    elif (arguments.command == "list"):
+        for job in queue.listJobs(status=arguments.status):
+            print(json.dumps(job))
+    elif (arguments.command == "requeue"):
+        for jobId in arguments.ids:
+            queue.requeueJob(jobId)
+    elif (arguments.command == "utilisation"):
+        print(json.dumps(queue.getUtilisation(), indent=4))
+    elif (arguments.command == "run"):
+        scheduler = StationScheduler(queue, loadStations(arguments.stations), presetFolder=arguments.presets, catalogFileName=arguments.catalog,
+                                     programsFolder=arguments.programs, pollInterval=arguments.poll)
+        result = scheduler.run(untilEmpty=(not arguments.forever))
+        print(json.dumps(queue.getUtilisation(), indent=4))
+        return result
+    else:
+        parser.print_help()
+        return 1
+
+    return 0
+
+
+if __name__ == "__main__": sys.exit(main())
@@ -0,0 +1,202 @@
+#!/usr/bin/env python3.4
+"""
+Search of LED voltage based on a model of the LED response (fraction of events above threshold versus voltage), seeded by a calibration curve cached from previous runs.
+"""
+import os
+import json
+import numpy
+
+DEFAULT_LED_CALIBRATION_FILE = "./LED_calibration.json"
+
+# Results of Ricerca.exe (and 10Percento.exe)
+DIRECTION_OK        = 0
+DIRECTION_DECREASE  = 1
+DIRECTION_INCREASE  = 2
+
+"""
+Response curve of each LED, (voltage, fraction of events above threshold), and the point accepted by the analysis in last run
+"""
+class LEDCalibration():
+    def __init__(self, fileName=DEFAULT_LED_CALIBRATION_FILE, maximumPoints=50):
+        self.fileName       = fileName
+        self.maximumPoints  = maximumPoints
+        self.leds           = {}
+        self.load()
+
+
+    def load(self):
+        if (not os.path.exists(self.fileName)):
+            return
+
+        try:
+            with open(self.fileName, "r") as fileCalibration:
+                self.leds = json.load(fileCalibration)
+        except:
+            self.leds = {}
+            print("Exception when loading LED calibration %s..." % self.fileName)
+
+
+    def save(self):
+        try:
+            with open(self.fileName + ".tmp", "w") as fileCalibration:
+                json.dump(self.leds, fileCalibration, indent=4)
+
+            os.replace(self.fileName + ".tmp", self.fileName)
+        except:
+            print("Exception when saving LED calibration %s..." % self.fileName)
+
+
+    def __getLED(self, led):
+        return self.leds.setdefault(str(led), {"points": [], "accepted": None})
+
+
+    def addPoint(self, led, voltage, fraction):
+        points = self.__getLED(led)["points"]
+        points.append([float(voltage), float(fraction)])
+        # Keep only the most recent points, LED could age
+        del points[:-self.maximumPoints]
+
+
+    def setAccepted(self, led, voltage, fraction):
+        self.__getLED(led)["accepted"] = [float(voltage), float(fraction)]
+
+
+    def getAccepted(self, led):
+        return self.leds.get(str(led), {}).get("accepted")
+
+
+    def fit(self, led):
+        # Linear fit (slope, intercept) of the points out of saturation, or None
+        points = numpy.array(self.leds.get(str(led), {}).get("points", []), dtype=float).reshape(-1, 2)
+        points = points[(points[:, 1] > 0.02) & (points[:, 1] < 0.98)]
+
+        if ((len(points) < 2) or (numpy.ptp(points[:, 0]) == 0.0)):
+            return None
+
+        slope, intercept = numpy.polyfit(points[:, 0], points[:, 1], 1)
+
+        if (slope <= 0.0):
+            return None
+
+        return slope, intercept
+
+
+    def predictVoltage(self, led, fraction):
+        model = self.fit(led)
+
+        if (model is None):
+            return None
+
+        slope, intercept = model
+
+        return (fraction - intercept) / slope
+
+
+"""
+Propose the next LED voltage from the measurements of current search (secant/regression), the direction informed by the analysis program and the calibration
+"""
+class LEDIntensitySearch():
+    def __init__(self, led, initialVoltage, calibration=None, targetFraction=None, minimumVoltage=0.0, maximumVoltage=10.0, defaultStep=0.5, maximumStep=1.0):
+        self.led            = led
+        self.initialVoltage = initialVoltage
+        self.calibration    = calibration
+        self.minimumVoltage = minimumVoltage
+        self.maximumVoltage = maximumVoltage
+        self.defaultStep    = defaultStep
+        self.maximumStep    = maximumStep
+        self.measurements   = []            # (voltage, fraction, direction)
+
+        # Without an explicit target, use the fraction accepted by the analysis in a previous run
+        self.targetFraction = targetFraction
+        self.targetLearned  = False
+
+        if ((not self.targetFraction) and calibration and calibration.getAccepted(led)):
+            self.targetFraction = calibration.getAccepted(led)[1]
+            self.targetLearned  = True
+
+
+    def getInitialVoltage(self):
+        if (self.calibration and self.calibration.getAccepted(self.led)):
+            # The voltage accepted last time is the best guess, corrected by the curve when the target is different
+            voltage = self.calibration.getAccepted(self.led)[0]
+            predicted = self.calibration.predictVoltage(self.led, self.targetFraction) if (not self.targetLearned) else None
+
+            return self.__clamp(predicted if (predicted is not None) else voltage)
+
+        if (self.calibration and self.targetFraction):
+            predicted = self.calibration.predictVoltage(self.led, self.targetFraction)
+
+            if (predicted is not None):
+                return self.__clamp(predicted)
+
+        return self.initialVoltage
+
+
+    def addMeasurement(self, voltage, fraction, direction):
+        self.measurements.append((voltage, fraction, direction))
+
+        if (self.calibration and (fraction is not None)):
+            self.calibration.addPoint(self.led, voltage, fraction)
+
+            if (direction == DIRECTION_OK):
+                self.calibration.setAccepted(self.led, voltage, fraction)
+
+
+    def proposeNextVoltage(self):
+        voltage, fraction, direction = self.measurements[-1]
+
+        # -----------------------------------------------------------------
+        # Voltages already known as too low (increase) and too high (decrease)
+        # bracket the solution; the proposal must stay inside the bracket.
+        # -----------------------------------------------------------------
+        lower = max([m[0] for m in self.measurements if (m[2] == DIRECTION_INCREASE)], default=None)
+        upper = min([m[0] for m in self.measurements if (m[2] == DIRECTION_DECREASE)], default=None)
+
+        proposal = None
+
+        if (self.targetFraction and (fraction is not None)):
+            slope = self.__getSlope()
+
+            if (slope):
+                # Secant (or regression) step to reach the target fraction
+                proposal = voltage + (self.targetFraction - fraction) / slope
+
+        if ((proposal is not None) and (((lower is not None) and (proposal <= lower)) or ((upper is not None) and (proposal >= upper)))):
+            # Model disagrees with the analysis program
+            proposal = None
+
+        if (proposal is None):
+            if ((lower is not None) and (upper is not None)):
+                proposal = (lower + upper) / 2.0
+            elif (direction == DIRECTION_INCREASE):
+                proposal = voltage + self.defaultStep
+            else:
+                proposal = voltage - self.defaultStep
+
+        # Limit the step
+        proposal = min(max(proposal, voltage - self.maximumStep), voltage + self.maximumStep)
+
+        return self.__clamp(proposal)
+
+
+    def __getSlope(self):
+        # Regression on the (up to 3) last measurements of this search, otherwise the calibration curve
+        points = [(m[0], m[1]) for m in self.measurements[-3:] if ((m[1] is not None) and (0.0 < m[1] < 1.0))]
+
+        if ((len(points) >= 2) and (len(set(p[0] for p in points)) >= 2)):
+            slope = numpy.polyfit([p[0] for p in points], [p[1] for p in points], 1)[0]
+
+            if (slope > 0.0):
+                return slope
+
+        if (self.calibration):
+            model = self.calibration.fit(self.led)
+
+            if (model):
+                return model[0]
+
+        return None
+
+
+    def __clamp(self, voltage):
+        return round(min(max(voltage, self.minimumVoltage), self.maximumVoltage), 3)
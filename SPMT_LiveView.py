@@ -0,0 +1,224 @@
+#!/usr/bin/env python3.4
+"""
+Live view of the acquisition: a background reader tails the wave files written by WaveDump and keeps the latest waveform and the charge spectrum of each channel; the panel redraws them on a timer with min/max decimation.
+"""
+import os
+import time
+import numpy
+import threading
+
+from PyQt5.QtCore import Qt, QPointF, QTimer
+from PyQt5.QtGui import QColor, QPainter, QPen, QPolygonF
+from PyQt5.QtWidgets import QWidget, QLabel, QVBoxLayout
+
+from SPMT_Waveform import WaveFileTail, extractFeatures, decimateMinMax
+from SPMT_Histogram import OnlineHistogram
+
+DEFAULT_READ_INTERVAL       = 0.5           # Seconds between two reads of the wave files
+DEFAULT_REFRESH_INTERVAL    = 250           # Milliseconds between two redraws of the panel
+
+CHANNEL_COLORS = [Qt.blue, Qt.red, Qt.darkGreen, Qt.magenta, Qt.darkCyan, Qt.darkYellow, Qt.black, Qt.darkRed,
+                  Qt.darkBlue, Qt.green, Qt.cyan, Qt.darkMagenta, Qt.gray, Qt.darkGray, Qt.yellow, Qt.lightGray]
+
+"""
+Reader of the wave files in a background thread; the UI takes a copy of the last state with "getSnapshot"
+"""
+class LiveReader():
+    def __init__(self, waveFileName="./wave_%d.txt", readInterval=DEFAULT_READ_INTERVAL, **histogramParameters):
+        self.waveFileName       = waveFileName
+        self.readInterval       = readInterval
+        self.histogramParameters = histogramParameters
+        self.lock               = threading.Lock()
+        self.thread             = None
+        self.running            = False
+        self.configure(1, 0)
+
+
+    def configure(self, numberOfChannels=1, channelNumber=0):
+        # Same naming of files as the orchestrator: in single channel mode the file is named by the channel number
+        if (numberOfChannels > 1):
+            self.channels = list(range(numberOfChannels))
+        else:
+            self.channels = [channelNumber]
+
+        with self.lock:
+            self.tails      = [WaveFileTail(self.waveFileName % channel) for channel in self.channels]
+            self.histogram  = OnlineHistogram(numberOfChannels=len(self.channels), **self.histogramParameters)
+            self.waveforms  = [None] * len(self.channels)
+            self.generation = 0
+
+
+    def start(self):
+        if (self.running):
+            return
+
+        self.running = True
+        self.thread = threading.Thread(target=self.__run, name="LiveReader")
+        self.thread.setDaemon(True)
+        self.thread.start()
+
+
+    def stop(self):
+        self.running = False
+
+        if (self.thread):
+            self.thread.join(2 * self.readInterval)
+            self.thread = None
+
+
+    def __run(self):
+        while (self.running):
+            try:
+                self.read()
+            except:
+                print("Exception when reading wave files for live view...")
+
+            time.sleep(self.readInterval)
+
+
+    def read(self):
+        # -----------------------------------------------------------------
+        # Read the events written since last call; a truncated file means
+        # WaveDump started a new acquisition, so the spectrum starts again.
+        # -----------------------------------------------------------------
+        newEvents = 0
+
+        for index, tail in enumerate(self.tails):
+            try:
+                truncated = os.path.exists(tail.fileName) and (os.path.getsize(tail.fileName) < tail.position)
+            except OSError:
+                truncated = False
+
+            if (truncated):
+                with self.lock:
+                    self.histogram.reset()
+                    self.waveforms = [None] * len(self.channels)
+
+            waves = tail.readEvents()
+
+            if (waves.shape[0] == 0):
+                continue
+
+            features = extractFeatures(waves)
+
+            with self.lock:
+                self.histogram.fill(index, features)
+                self.waveforms[index] = waves[-1]
+
+            newEvents += waves.shape[0]
+
+        if (newEvents):
+            with self.lock:
+                self.generation += 1
+
+        return newEvents
+
+
+    def getSnapshot(self):
+        with self.lock:
+            return {"generation":   self.generation,
+                    "channels":     list(self.channels),
+                    "waveforms":    list(self.waveforms),
+                    "charge":       self.histogram.chargeHistograms.copy(),
+                    "chargeEdges":  self.histogram.chargeEdges,
+                    "events":       self.histogram.numberOfEvents.copy()}
+
+
+"""
+Plot of curves (one per channel) drawn with QPainter; waveforms are drawn as min/max envelopes, one pair of points per pixel column
+"""
+class CurvePlot(QWidget):
+    def __init__(self, title="", parent=None):
+        super(CurvePlot, self).__init__(parent)
+        self.title  = title
+        self.curves = []            # (index of channel, y values)
+        self.setMinimumSize(300, 150)
+
+
+    def setCurves(self, curves):
+        self.curves = curves
+        self.update()
+
+
+    def paintEvent(self, event):
+        painter = QPainter(self)
+        painter.fillRect(self.rect(), Qt.white)
+        painter.setPen(Qt.black)
+        painter.drawRect(self.rect().adjusted(0, 0, -1, -1))
+        painter.drawText(6, 14, self.title)
+
+        curves = [(index, values) for index, values in self.curves if ((values is not None) and (len(values) > 0))]
+
+        if (not curves):
+            painter.end()
+            return
+
+        width = max(self.width() - 4, 1)
+        height = max(self.height() - 24, 1)
+        minimum = min(float(numpy.min(values)) for index, values in curves)
+        maximum = max(float(numpy.max(values)) for index, values in curves)
+        scale = height / ((maximum - minimum) or 1.0)
+
+        for index, values in curves:
+            lower, upper = decimateMinMax(values, width)
+            xStep = width / max(len(lower) - 1, 1)
+            points = []
+
+            # Zigzag between maximum and minimum of each column covers the whole envelope in one polyline
+            for column in range(len(lower)):
+                x = 2 + column * xStep
+                points.append(QPointF(x, 20 + (maximum - upper[column]) * scale))
+                points.append(QPointF(x, 20 + (maximum - lower[column]) * scale))
+
+            painter.setPen(QPen(QColor(CHANNEL_COLORS[index % len(CHANNEL_COLORS)]), 1))
+            painter.drawPolyline(QPolygonF(points))
+
+        painter.end()
+
+
+"""
+Panel with the latest waveform and the charge spectrum of each channel, refreshed on a timer from a LiveReader
+"""
+class LivePanel(QWidget):
+    def __init__(self, reader=None, refreshInterval=DEFAULT_REFRESH_INTERVAL, parent=None):
+        super(LivePanel, self).__init__(parent)
+        self.reader         = reader or LiveReader()
+        self.generation     = -1
+
+        self.waveformPlot   = CurvePlot("Latest waveform")
+        self.spectrumPlot   = CurvePlot("Charge spectrum")
+        self.label          = QLabel("No events")
+
+        layout = QVBoxLayout(self)
+        layout.addWidget(self.waveformPlot)
+        layout.addWidget(self.spectrumPlot)
+        layout.addWidget(self.label)
+
+        self.timer = QTimer(self)
+        self.timer.timeout.connect(self.refresh)
+        self.timer.start(refreshInterval)
+
+
+    def start(self, numberOfChannels=1, channelNumber=0):
+        self.reader.stop()
+        self.reader.configure(numberOfChannels, channelNumber)
+        self.generation = -1
+        self.reader.start()
+
+
+    def stop(self):
+        self.reader.stop()
+
+
+    def refresh(self):
+        snapshot = self.reader.getSnapshot()
+
+        # Nothing new since last redraw
+        if (snapshot["generation"] == self.generation):
+            return
+
+        self.generation = snapshot["generation"]
+
+        self.waveformPlot.setCurves([(index, waveform) for index, waveform in enumerate(snapshot["waveforms"])])
+        self.spectrumPlot.setCurves([(index, histogram) for index, histogram in enumerate(snapshot["charge"])])
+        self.label.setText("  ".join("Ch %d: %d events" % (channel, events) for channel, events in zip(snapshot["channels"], snapshot["events"])))
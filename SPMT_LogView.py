@@ -0,0 +1,136 @@
+#!/usr/bin/env python3.4
+"""
+Log of execution for the UI: messages from any thread go to a pending list, a timer flushes them in batches to a fixed-capacity ring buffer shown by a QListView, and the full history is spilled to disk.
+"""
+import os
+import time
+import threading
+
+from collections import deque
+from datetime import datetime
+
+from PyQt5.QtCore import Qt, QAbstractListModel, QModelIndex, QTimer
+
+DEFAULT_LOG_CAPACITY        = 2000          # Lines kept (and shown) in the UI
+DEFAULT_FLUSH_INTERVAL      = 200           # Milliseconds between two updates of the view
+DEFAULT_SPILL_FILE_FORMAT   = "./logs/SPMT_UI_%Y-%b-%d_%Hh%Mm%Ss.log"
+
+"""
+List model backed by a ring buffer; "append" is cheap and thread-safe, the view is only updated by "flush"
+"""
+class LogListModel(QAbstractListModel):
+    def __init__(self, capacity=DEFAULT_LOG_CAPACITY, flushInterval=DEFAULT_FLUSH_INTERVAL, spillFileName=None, parent=None):
+        super(LogListModel, self).__init__(parent)
+        self.capacity       = capacity
+        self.lines          = deque()
+        self.pending        = []
+        self.lock           = threading.Lock()
+        # Consecutive repetitions of the last message are coalesced in one line, "(xN)"
+        self.lastMessage    = None
+        self.repetitions    = 0
+        # Full history on disk
+        self.spillFileName  = spillFileName or time.strftime(DEFAULT_SPILL_FILE_FORMAT)
+        self.spillFile      = None
+        # Periodic flush in the UI thread
+        self.timer          = QTimer(self)
+        self.timer.timeout.connect(self.flush)
+        self.timer.start(flushInterval)
+
+
+    def rowCount(self, parent=QModelIndex()):
+        if (parent.isValid()):
+            return 0
+
+        return len(self.lines)
+
+
+    def data(self, index, role=Qt.DisplayRole):
+        if ((role == Qt.DisplayRole) and index.isValid() and (index.row() < len(self.lines))):
+            return self.lines[index.row()]
+
+        return None
+
+
+    def append(self, message=""):
+        # Could be called by any thread; formatting is left to "flush"
+        with self.lock:
+            self.pending.append((time.time(), message))
+
+
+    def clear(self):
+        with self.lock:
+            self.pending = []
+
+        self.beginResetModel()
+        self.lines.clear()
+        self.lastMessage = None
+        self.repetitions = 0
+        self.endResetModel()
+
+
+    def flush(self):
+        with self.lock:
+            pending, self.pending = self.pending, []
+
+        if (not pending):
+            return
+
+        newLines = []
+
+        for timestamp, message in pending:
+            line = datetime.fromtimestamp(timestamp).strftime('%d/%m/%Y %H:%M:%S') + " - " + message
+
+            if ((message == self.lastMessage) and (newLines or self.lines)):
+                # Replace the last line (already in view or in this batch) by the coalesced one
+                self.repetitions += 1
+                line = line + " (x%d)" % self.repetitions
+
+                if (newLines):
+                    newLines[-1] = line
+                else:
+                    self.lines[-1] = line
+                    self.dataChanged.emit(self.index(len(self.lines) - 1), self.index(len(self.lines) - 1))
+            else:
+                self.lastMessage = message
+                self.repetitions = 1
+                newLines.append(line)
+
+        self.spill(["%s - %s" % (datetime.fromtimestamp(timestamp).strftime('%d/%m/%Y %H:%M:%S'), message) for timestamp, message in pending])
+
+        # Only the last "capacity" lines are kept
+        newLines = newLines[-self.capacity:]
+        overflow = len(self.lines) + len(newLines) - self.capacity
+
+        if (overflow > 0):
+            self.beginRemoveRows(QModelIndex(), 0, overflow - 1)
+
+            for index in range(overflow):
+                self.lines.popleft()
+
+            self.endRemoveRows()
+
+        if (newLines):
+            self.beginInsertRows(QModelIndex(), len(self.lines), len(self.lines) + len(newLines) - 1)
+            self.lines.extend(newLines)
+            self.endInsertRows()
+
+
+    def spill(self, lines):
+        try:
+            if (self.spillFile is None):
+                os.makedirs(os.path.dirname(os.path.abspath(self.spillFileName)), exist_ok=True)
+                self.spillFile = open(self.spillFileName, "a")
+
+            self.spillFile.write("\n".join(lines) + "\n")
+            self.spillFile.flush()
+        except:
+            print("Exception when writing log file %s..." % self.spillFileName)
+
+
+    def close(self):
+        self.timer.stop()
+        self.flush()
+
+        if (self.spillFile):
+            self.spillFile.close()
+            self.spillFile = None
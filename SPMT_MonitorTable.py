@@ -0,0 +1,76 @@
+#!/usr/bin/env python3.4
+"""
+Table model of the monitoring values (Vset, Vmon and Imon of each DAC); a whole snapshot is applied at once and only the cells that changed are signalled to the view.
+"""
+from PyQt5.QtCore import Qt, QAbstractTableModel, QModelIndex, QVariant
+
+from SPMT_Project import MAXIMUM_CHANNELS, TABLE_COLUMNS
+
+"""
+One row per channel ("DACn"), one column per quantity; values are kept as floats and formatted only when displayed
+"""
+class MonitorTableModel(QAbstractTableModel):
+    def __init__(self, numberOfRows=MAXIMUM_CHANNELS, parent=None):
+        super(MonitorTableModel, self).__init__(parent)
+        self.values = [[None] * len(TABLE_COLUMNS) for row in range(numberOfRows)]
+
+
+    def rowCount(self, parent=QModelIndex()):
+        if (parent.isValid()):
+            return 0
+
+        return len(self.values)
+
+
+    def columnCount(self, parent=QModelIndex()):
+        if (parent.isValid()):
+            return 0
+
+        return len(TABLE_COLUMNS)
+
+
+    def data(self, index, role=Qt.DisplayRole):
+        if ((not index.isValid()) or (role not in (Qt.DisplayRole, Qt.TextAlignmentRole))):
+            return QVariant()
+
+        if (role == Qt.TextAlignmentRole):
+            return int(Qt.AlignRight | Qt.AlignVCenter)
+
+        value = self.values[index.row()][index.column()]
+
+        return "" if (value is None) else str(value)
+
+
+    def headerData(self, section, orientation, role=Qt.DisplayRole):
+        if (role != Qt.DisplayRole):
+            return QVariant()
+
+        if (orientation == Qt.Horizontal):
+            return TABLE_COLUMNS[section]
+
+        return "DAC%d" % section
+
+
+    def setSnapshot(self, snapshot):
+        # -----------------------------------------------------------------
+        # Replace the values in place; a single dataChanged covers the
+        # rectangle of changed cells, so the view repaints only that.
+        # -----------------------------------------------------------------
+        changed = []
+
+        for row, rowValues in enumerate(snapshot[:len(self.values)]):
+            for column, value in enumerate(rowValues[:len(TABLE_COLUMNS)]):
+                if (self.values[row][column] != value):
+                    self.values[row][column] = value
+                    changed.append((row, column))
+
+        if (changed):
+            rows = [row for row, column in changed]
+            columns = [column for row, column in changed]
+            self.dataChanged.emit(self.index(min(rows), min(columns)), self.index(max(rows), max(columns)))
+
+        return len(changed)
+
+
+    def clear(self):
+        self.setSnapshot([[None] * len(TABLE_COLUMNS) for row in range(len(self.values))])
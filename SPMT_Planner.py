@@ -0,0 +1,205 @@
+#!/usr/bin/env python3.4
+"""
+Estimate the duration of each phase (and of the whole run) for a configuration, with a cost model calibrated by the phase durations of past runs kept in the catalog.
+"""
+import sys
+import json
+import argparse
+import numpy
+
+from SPMT_Catalog import RunCatalog, DEFAULT_CATALOG_FILE
+from SPMT_Headless import loadConfigurationFile
+
+# Fixed costs (seconds) of the sequence, used while there is no history in catalog
+ACQUISITION_OVERHEAD    = 3.0       # Start WaveDump, trigger command, stop WaveDump
+ANALYSIS_OVERHEAD       = 5.0       # Wait for the result file of an analysis program
+LINEARITY_STEP_OVERHEAD = 5.0       # Host loop: four DAC commands (0.5 s) and three trigger round-trips by step
+DEFAULT_SEARCH_ITERATIONS = 3.0     # Acquisitions to tune the intense LED
+
+# A term with this fraction of the total duration (or more) is reported as dominating the run
+DOMINANT_FRACTION = 0.25
+
+PHASES = ["initialVoltages", "monitors", "darkCount", "intenseLED", "lowLED", "linearity", "shutdown"]
+
+"""
+Cost model: each phase is a fixed time plus terms derived from parameters; the calibration scales them to the durations really measured
+"""
+class RunPlanner():
+    def __init__(self, catalogFileName=DEFAULT_CATALOG_FILE):
+        self.catalogFileName    = catalogFileName
+        # Per phase, duration = overhead + scale x (sum of terms)
+        self.calibration        = {phase: (0.0, 1.0) for phase in PHASES}
+        self.calibrationRuns    = {phase: 0 for phase in PHASES}
+        self.searchIterations   = DEFAULT_SEARCH_ITERATIONS
+
+
+    def getTerms(self, phase, configuration):
+        # -----------------------------------------------------------------
+        # List of (description, seconds) of one phase; the description
+        # names the parameters an operator could change.
+        # -----------------------------------------------------------------
+        numberOfChannels = int(configuration["numberOfChannels"])
+
+        if (phase == "initialVoltages"):
+            return [("fixed", 1.0), ("numberOfChannels (MUX read)", 1.5 * numberOfChannels)]
+
+        if (phase == "monitors"):
+            return [("fixed", 3.5), ("numberOfChannels (monitor read)", 0.5 * numberOfChannels)]
+
+        if (phase == "darkCount"):
+            return [("fixed", ACQUISITION_OVERHEAD + ANALYSIS_OVERHEAD),
+                    ("darkCountPulses/darkCountFreq", float(configuration["darkCountPulses"]) / float(configuration["darkCountFreq"]))]
+
+        if (phase == "intenseLED"):
+            return [("fixed", ACQUISITION_OVERHEAD),
+                    ("highIntensOptPulses/highIntensOptFreq x %.1f iterations" % self.searchIterations,
+                     self.searchIterations * (float(configuration["highIntensOptPulses"]) / float(configuration["highIntensOptFreq"]) + ACQUISITION_OVERHEAD + ANALYSIS_OVERHEAD)),
+                    ("highIntensAcqPulses/highIntensAcqFreq", float(configuration["highIntensAcqPulses"]) / float(configuration["highIntensAcqFreq"]))]
+
+        if (phase == "lowLED"):
+            return [("fixed", ACQUISITION_OVERHEAD + 0.5 * numberOfChannels),
+                    ("lowIntensAcqPulses/lowIntensAcqFreq", float(configuration["lowIntensAcqPulses"]) / float(configuration["lowIntensAcqFreq"]))]
+
+        if (phase == "linearity"):
+            terms = [("fixed", ACQUISITION_OVERHEAD + ANALYSIS_OVERHEAD + 1.5 * numberOfChannels),
+                     ("numberOfSteps x 3 x numberOfColpi/linearityAcqFreq",
+                      3.0 * float(configuration["numberOfSteps"]) * float(configuration["numberOfColpi"]) / float(configuration["linearityAcqFreq"]))]
+
+            if (not configuration.get("firmwareLinearitySweep", False)):
+                terms.append(("numberOfSteps (host round-trips)", LINEARITY_STEP_OVERHEAD * float(configuration["numberOfSteps"])))
+
+            return terms
+
+        if (phase == "shutdown"):
+            return [("fixed", 1.0)]
+
+        return []
+
+
+    def getNominalDuration(self, phase, configuration):
+        return sum(seconds for description, seconds in self.getTerms(phase, configuration))
+
+
+    def calibrate(self, maximumRuns=200):
+        # -----------------------------------------------------------------
+        # Per phase, least squares of measured duration versus nominal
+        # duration of past runs; with few runs (or always the same
+        # configuration) only the overhead is corrected.
+        # -----------------------------------------------------------------
+        try:
+            catalog = RunCatalog(self.catalogFileName)
+            rows = catalog.getPhaseDurations(maximumRuns=maximumRuns)
+            iterations = catalog.countResults("searchIteration", maximumRuns=maximumRuns)
+        except:
+            print("Exception when reading durations from catalog %s..." % self.catalogFileName)
+            return False
+
+        if (iterations):
+            self.searchIterations = float(numpy.mean(iterations))
+
+        for phase in PHASES:
+            samples = []
+
+            for row in rows:
+                if (row["name"] != phase):
+                    continue
+
+                try:
+                    samples.append((self.getNominalDuration(phase, row["configuration"]), row["duration"]))
+                except (KeyError, ValueError, ZeroDivisionError):
+                    continue
+
+            if (not samples):
+                continue
+
+            nominal, measured = numpy.array(samples, dtype=float).T
+
+            if ((len(samples) >= 3) and (numpy.ptp(nominal) > 0.1 * numpy.mean(nominal))):
+                scale, overhead = numpy.polyfit(nominal, measured, 1)
+
+                if (scale <= 0.0):
+                    scale, overhead = 1.0, float(numpy.median(measured - nominal))
+            else:
+                scale, overhead = 1.0, float(numpy.median(measured - nominal))
+
+            self.calibration[phase] = (float(overhead), float(scale))
+            self.calibrationRuns[phase] = len(samples)
+
+        return True
+
+
+    def estimate(self, configuration, phases=PHASES):
+        # Returns {"phases": [(phase, seconds)], "total": seconds, "dominant": [(description, seconds, fraction)], "upperBound": bool}
+        estimatedPhases = []
+        terms = []
+
+        for phase in phases:
+            overhead, scale = self.calibration[phase]
+            phaseTerms = self.getTerms(phase, configuration)
+            nominal = sum(seconds for description, seconds in phaseTerms)
+            duration = max(overhead + scale * nominal, 0.0)
+            estimatedPhases.append((phase, duration))
+
+            # Each term takes its share of the (calibrated) duration of the phase
+            if (nominal > 0.0):
+                terms += [(description, duration * seconds / nominal) for description, seconds in phaseTerms if (description != "fixed")]
+
+        total = sum(seconds for phase, seconds in estimatedPhases)
+        dominant = sorted([(description, seconds, seconds / total) for description, seconds in terms if ((total > 0.0) and (seconds / total >= DOMINANT_FRACTION))],
+                          key=lambda term: -term[1])
+
+        return {"phases": estimatedPhases,
+                "total": total,
+                "dominant": dominant,
+                # Adaptive acquisition stops early, the number of pulses is only the maximum
+                "upperBound": bool(configuration.get("adaptiveAcquisition", False))}
+
+
+def formatDuration(seconds):
+    hours, seconds = divmod(int(round(seconds)), 3600)
+    minutes, seconds = divmod(seconds, 60)
+
+    if (hours):
+        return "%dh %02dm" % (hours, minutes)
+
+    return "%dm %02ds" % (minutes, seconds)
+
+
+def formatEstimate(estimate):
+    lines = ["Estimated duration: %s%s" % ("up to " if estimate["upperBound"] else "", formatDuration(estimate["total"]))]
+    lines += ["    %-16s %s" % (phase, formatDuration(seconds)) for phase, seconds in estimate["phases"]]
+
+    for description, seconds, fraction in estimate["dominant"]:
+        lines.append("Dominated by %s: %s (%d%%)" % (description, formatDuration(seconds), round(fraction * 100)))
+
+    return "\n".join(lines)
+
+
+"""
+Main()
+"""
+def main():
+    parser = argparse.ArgumentParser(description="Estimate the duration of a SPMT run (dry run, no hardware is used).")
+    parser.add_argument("config", help="configuration file (.json, or .csv saved by the UI)")
+    parser.add_argument("--catalog", default=DEFAULT_CATALOG_FILE, help="SQLite catalog of runs, to calibrate the estimate")
+    parser.add_argument("--json", action="store_true", help="print the estimate as JSON")
+    arguments = parser.parse_args()
+
+    planner = RunPlanner(arguments.catalog)
+    planner.calibrate()
+
+    try:
+        estimate = planner.estimate(loadConfigurationFile(arguments.config))
+    except (KeyError, ValueError, ZeroDivisionError) as error:
+        print("Invalid configuration %s: %s..." % (arguments.config, error))
+        return 2
+
+    if (arguments.json):
+        print(json.dumps(estimate, indent=4))
+    else:
+        print(formatEstimate(estimate))
+
+    return 0
+
+
+if __name__ == "__main__": sys.exit(main())
@@ -7,38 +7,154 @@ import subprocess
 import os
 import time
 import shutil
+import threading
+import json
+import functools
+import numpy
+
+from SPMT_Trace import tracer, traced, sleep
+from SPMT_Cancel import CancellationToken, RunCancelled, setCurrentToken, checkCancelled, shielded
+from SPMT_HVMonitor import HVMonitor
+from SPMT_DACTrim import DACCorrectionCache, DEFAULT_DAC_CORRECTION_FILE
+from SPMT_HVCalibration import HVCalibrationStore, DEFAULT_HV_CALIBRATION_FILE
+from SPMT_ChannelState import ChannelState, toLinduinoUnits, toFloatArray, parseMonitors, validateVoltages, validateMonitors
+from SPMT_Histogram import OnlineAccumulator
+from SPMT_FeatureCache import FeatureCache
+from SPMT_Waveform import readWaveFile, extractFeatures
+from SPMT_Catalog import RunCatalog, DEFAULT_CATALOG_FILE
+from SPMT_Scheduler import AnalysisScheduler
+from SPMT_LEDSearch import LEDCalibration, LEDIntensitySearch, DEFAULT_LED_CALIBRATION_FILE
 
-from time import sleep
-
-from PyQt5.QtCore import pyqtSignal, QObject
 
 MAXIMUM_CHANNELS    = 8
+
+# Columns of the monitoring table (one row per channel)
+TABLE_COLUMNS       = ["Vset", "Vmon", "Imon"]
+TABLE_VSET          = 0
+TABLE_VMON          = 1
+TABLE_IMON          = 2
 FORMAT_FOLDER       = "%Y-%b-%d"
 FORMAT_SUBFOLDER    = "%Hh%Mm%Ss"
+CHECKPOINT_FILE_NAME = "checkpoint.json"
+TRACE_FILE_FORMAT   = "trace_%Hh%Mm%Ss.json"    # Chrome trace of one execution, saved in the folder of the run
+ANALYSIS_FOLDER     = "./analysis"          # Working folders of analyses running in background
+ANALYSIS_PHASES     = {"darkCount": "darkCount", "singlePhotoelectron": "lowLED"}   # Phase that acquires the data of each analysis in background
+# Hardware of one test station (a Linduino and a digitizer read by WaveDump); several stations could run in the same computer
+DEFAULT_LINDUINO_PORT       = "/dev/ttyUSB0"
+DEFAULT_WAVEDUMP_PROGRAM    = "/home/spmt/Documents/TorinoGroup/Wavedump/src/wavedump"
+LINDUINO_POLL_INTERVAL      = 0.02          # Seconds between checks of the serial input buffer
+LINEARITY_SWEEP_COMMAND     = "18"          # Linduino program: linearity sweep executed by the board
+
+# Orchestrator attributes that make up the configuration of one run (the same fields informed in the UI)
+CONFIGURATION_PARAMETERS = ["initialVoltage", "maxVoltageError", "voltageFactor", "currentFactor", "maxVMonError", "maxIMonError",
+                            "numberOfChannels", "channelNumber",
+                            "darkCountFreq", "darkCountPulses",
+                            "channelOfLED_1", "singlePhVoltageLED_1", "singlePhOptFreq", "singlePhOptPulses", "singlePhAcqFreq", "singlePhAcqPulses",
+                            "highIntensVoltageLED_1", "highIntensOptFreq", "highIntensOptPulses", "highIntensAcqFreq", "highIntensAcqPulses",
+                            "channelOfLED_2", "channelOfLED_3", "lowIntensVoltageLEDs", "lowIntensVoltageFactor", "lowIntensAcqFreq", "lowIntensAcqPulses",
+                            "linearityVoltageFactor", "numberOfColpi", "numberOfSteps", "incrementLED_2", "incrementLED_3",
+                            "initialVoltageLED_2", "initialVoltageLED_3", "linearityAcqFreq",
+                            "darkCountPeakPrecision", "onlineBlockPulses", "onlineChargeThreshold",
+                            "adaptiveAcquisition", "darkCountRatePrecision", "darkCountAmplitudeThreshold",
+                            "highIntensPeakPrecision", "lowIntensPeakPrecision",
+                            "overlapAnalyses", "hvSettlingTimeout", "firmwareLinearitySweep", "traceRun",
+                            "hvMonitorInterval", "hvMonitorAlarmSamples", "dacTrimIterations", "vMonOutputFactor",
+                            "applyHVRefit", "vMonScaleVerified",
+                            "modelBasedLEDSearch", "highIntensTargetFraction", "highIntensAmplitudeThreshold"]
+
+
+def toConfigurationType(value, default):
+    # -----------------------------------------------------------------
+    # Value of a configuration file (JSON, or text of the UI CSV) with
+    # the type of the default one: "False", "0" or "no" are False (not
+    # a non-empty string), and "5000.0" or 5000.0 is a valid int.
+    # -----------------------------------------------------------------
+    if (isinstance(default, bool)):
+        if (isinstance(value, str)):
+            return (value.strip().lower() in ("true", "1", "yes"))
+
+        return bool(value)
+
+    if (isinstance(default, int)):
+        return int(float(value))
+
+    return type(default)(value)
+
+"""
+Minimal signal (same "connect"/"emit" interface of pyqtSignal), so the orchestrator does not depend on Qt;
+the UI forwards it to Qt signals to update the widgets in its own thread
+"""
+class Signal():
+    def __init__(self):
+        self.slots = []
+        self.lock = threading.Lock()
+
+    def connect(self, slot):
+        with self.lock:
+            self.slots.append(slot)
+
+    def disconnect(self, slot=None):
+        with self.lock:
+            if (slot is None):
+                self.slots = []
+            elif (slot in self.slots):
+                self.slots.remove(slot)
+
+    def emit(self, *args):
+        with self.lock:
+            slots = list(self.slots)
+
+        for slot in slots:
+            try:
+                slot(*args)
+            except:
+                print("Exception in slot %s..." % str(slot))
+                pass
+
+
+# One run at a time on each serial port (runs started by threads of the same process)
+serialPortLocks = {}
+serialPortLocksGuard = threading.Lock()
+
+def getSerialPortLock(port):
+    with serialPortLocksGuard:
+        return serialPortLocks.setdefault(port, threading.Lock())
+
+
+def exclusiveBus(function):
+    # -----------------------------------------------------------------
+    # Decorator of controller methods: the whole exchange with Linduino
+    # (commands, waits and returns) is done holding its bus, so the HV
+    # monitor never sends commands in the middle of it.
+    # -----------------------------------------------------------------
+    @functools.wraps(function)
+    def wrapper(self, *args, **kwargs):
+        with self.linduinoObj.busLock:
+            return function(self, *args, **kwargs)
+
+    return wrapper
+
 
 """
 Abstraction of Linduino board
 """
 class Linduino():
-    def __init__(self):
+    def __init__(self, port=DEFAULT_LINDUINO_PORT):
         # Set default parameters configuration
-        self.port = "/dev/ttyUSB0"
+        self.port = port
         self.rate = 115200
-        # Initiate USB connection to Linduino
-        try:
-            self.connection = serial.Serial(self.port, self.rate)
-            # Wait a while for Linduino initialization...
-            sleep(2)
-        except:
-            self.connection = None
-            print("Error connecting to Linduino!")
-            pass
+        # USB connection is opened on first use (or in background by "connectInBackground"), not here
+        self.connection = None
+        self.connectionLock = threading.Lock()
+        # Held during each exchange of commands and returns (sequence or HV monitor)
+        self.busLock = threading.RLock()
 
+    @traced("serial", arguments=("command",))
     def sendCommand(self, command=""):
         command = str(command)
         listOfCommands = command.split(";")
 
-        if (self.connection):
+        if (self.connect()):
             for cmd in listOfCommands:
                 try:
                     # Encode the command to bytes and send it
@@ -53,7 +169,7 @@ class Linduino():
 
 
     def readReturn(self):
-        if (self.connection):
+        if (self.connect()):
             # Read everything in the input buffer
             returnedMessage = self.connection.read(self.connection.inWaiting())
             # Decode received bytes
@@ -65,25 +181,81 @@ class Linduino():
         return returnedMessage
 
 
+    @traced("serial")
+    def readReturnUntil(self, predicate=None, timeout=1.0, quietTime=0.1):
+        # -----------------------------------------------------------------
+        # Read the returns until "predicate(message)" is True or, without a
+        # predicate, until nothing more arrives during "quietTime"; never
+        # longer than "timeout" seconds (the old fixed waits).
+        # -----------------------------------------------------------------
+        if (not self.connect()):
+            print("No connection stablished! Impossible to read buffer...")
+            return None
+
+        returnedMessage = ""
+        startTime = lastDataTime = time.time()
+
+        while (True):
+            waiting = self.connection.inWaiting()
+
+            if (waiting):
+                returnedMessage += self.connection.read(waiting).decode('utf-8')
+                lastDataTime = time.time()
+
+                if (predicate and predicate(returnedMessage)):
+                    break
+            elif ((predicate is None) and returnedMessage and ((time.time() - lastDataTime) >= quietTime)):
+                break
+
+            if ((time.time() - startTime) >= timeout):
+                break
+
+            sleep(LINDUINO_POLL_INTERVAL)
+
+        return returnedMessage
+
+
     def getConnection(self):
         return self.connection
 
 
+    def connect(self):
+        # Open the connection, unless it is already open (or being opened by another thread); returns it, None on error
+        with self.connectionLock:
+            if (self.connection is None):
+                try:
+                    self.connection = serial.Serial(self.port, self.rate)
+                    # Wait a while for Linduino initialization...
+                    sleep(2)
+                except RunCancelled:
+                    raise
+                except:
+                    self.connection = None
+                    print("Error connecting to Linduino!")
+                    pass
+
+            return self.connection
+
+
+    def connectInBackground(self):
+        # The 2 s of Linduino initialization elapse while the operator fills the configuration
+        thread = threading.Thread(target=self.connect, name="LinduinoConnect")
+        thread.setDaemon(True)
+        thread.start()
+
+
     def reconnect(self):
-        # Try to connect to Linduino
-        try:
-            self.connection = serial.Serial(self.port, self.rate)
-            # Wait a while for Linduino initialization...
-            sleep(2)
-        except:
-            self.connection = None
-            print("Error connecting to Linduino!")
-            pass
+        # Close connection, if any, and open it again
+        self.closeConnection()
+
+        return self.connect()
 
 
     def closeConnection(self):
-        if (self.connection):
-            self.connection.close()
+        with self.connectionLock:
+            if (self.connection):
+                self.connection.close()
+                self.connection = None
 
 
     def __del__(self):
@@ -95,12 +267,14 @@ class Linduino():
 Abstraction of Small Photo Multiplier Tube (SPMT) to controll all the process
 """
 class SmallPhotoMultiplierTubeController():
-    def __init__(self):
+    def __init__(self, linduinoPort=DEFAULT_LINDUINO_PORT, waveDumpProgram=DEFAULT_WAVEDUMP_PROGRAM):
         # Initialize attributes
         self.numberOfChannels = 8               # Default 8 channels, from 0 to 7
         self.channelNumber    = 0               # Default channel 0
         self.highVoltageIDs   = []              # Information of all High Voltage sources (CAEN)
         self.debug = False                      # Default is NO debug, False
+        self.pulsesTriggered  = 0               # Pulses really triggered in the last acquisition (it could stop early)
+        self.commandInterval  = 0.05            # Pause between DAC commands sent together, to not overflow the input buffer of Linduino
         # Managed files
         # .log
         self.errorDacFileName                   = "./logs/ERROR_DAC_UNICAMP.log"            # File name of error log when DAC presents problem
@@ -120,9 +294,17 @@ class SmallPhotoMultiplierTubeController():
         self.waveSinglePhotoelectronFileName    = "./wave_%d_ph.txt"
         self.waveIntenseLEDFileName             = "./wave_%d_LED_high.txt"
         self.waveLowLEDFileName                 = "./wave_%d_LED_low.txt"
+        # WaveDump (reads "WaveDumpConfig.txt" of the current folder, so each station has its own)
+        self.waveDumpProgram                    = waveDumpProgram
+        self.waveDumpProcess                    = None
 
         # Instantiate all objects needed to controll SPMT
-        self.linduinoObj = Linduino()
+        self.linduinoObj = Linduino(port=linduinoPort)
+        # Per-event features of wave files, extracted once and reused by every analysis
+        self.featureCache = FeatureCache()
+        # While the HV is monitored, triggers go in blocks of "monitorInterval" seconds at most, and "betweenBlocks" is called after each one
+        self.monitorInterval = None
+        self.betweenBlocks = None
 
 
     def getNumberOfChannels(self):
@@ -152,6 +334,7 @@ class SmallPhotoMultiplierTubeController():
         self.debug = debug
 
 
+    @exclusiveBus
     def setVoltageToAllChannels(self, voltage=0):
         try:
             if (voltage == 0):
@@ -162,10 +345,13 @@ class SmallPhotoMultiplierTubeController():
                     self.setVoltageToOneChannel(channel, voltage)
             else:
                 self.setVoltageToOneChannel(self.getChannelNumber(), voltage)
+        except RunCancelled:
+            raise
         except:
             print("Error setting voltage!")
 
 
+    @exclusiveBus
     def setVoltageToAllChannelsByArray(self, voltagesArray=[]):
         status = True
 
@@ -179,6 +365,8 @@ class SmallPhotoMultiplierTubeController():
             else:
                 status = False
                 print("Inconsistent number of voltage values for all selected channels...")
+        except RunCancelled:
+            raise
         except:
             status = False
             print("Exception when trying to set new voltages....")
@@ -186,6 +374,30 @@ class SmallPhotoMultiplierTubeController():
 
         return status
 
+    def getChannelsInUse(self):
+        if (self.getNumberOfChannels() > 1):
+            return list(range(self.getNumberOfChannels()))
+
+        return [self.getChannelNumber()]
+
+
+    @traced("dac", arguments=("channels", "voltagesArray"))
+    @exclusiveBus
+    def setVoltagesOfChannels(self, channels, voltagesArray):
+        # All channels together: the commands are sent one after the other and the returns read once at the end
+        for channel, voltage in zip(channels, voltagesArray):
+            self.linduinoObj.sendCommand("1;" + str(channel) + ";3;1;" + str(voltage))
+            sleep(self.commandInterval)
+
+        returnedMessage = self.linduinoObj.readReturnUntil(timeout=0.5)
+
+        if (self.isDebug()):
+            # Print just for debug pourposes...
+            print(returnedMessage)
+
+
+    @traced("dac", arguments=("channel", "voltage"))
+    @exclusiveBus
     def setVoltageToOneChannel(self, channel, voltage=0):
         # -----------------------------------------------------------------
         # This depends on Linduino program;
@@ -215,6 +427,7 @@ class SmallPhotoMultiplierTubeController():
             print(returnedMessage)
 
 
+    @exclusiveBus
     def setMuxToAllChannels(self, enable=False):
         listOfVoltagesRead = []
 
@@ -231,6 +444,8 @@ class SmallPhotoMultiplierTubeController():
         return listOfVoltagesRead
 
 
+    @traced("mux", arguments=("channel", "enable"))
+    @exclusiveBus
     def setMuxToOneChannel(self, channel=None, enable=False):
         # -----------------------------------------------------------------
         # This depends on Linduino program;
@@ -252,11 +467,11 @@ class SmallPhotoMultiplierTubeController():
             self.linduinoObj.sendCommand("9;" + str(int(enable)))
 
         # Wait for the command to be executed and response has been sent
-        # During tests, the lowest time to get info was 0.9 sec.
-        sleep(1.0)
-
-        # Read the return
-        returnedMessage = self.linduinoObj.readReturn()
+        # During tests, the lowest time to get info was 0.9 sec; when enabling, the voltage (5th line) ends the wait
+        if (enable):
+            returnedMessage = self.linduinoObj.readReturnUntil(predicate=lambda message: (len(message.split('\r\n')) > 5), timeout=1.0)
+        else:
+            returnedMessage = self.linduinoObj.readReturnUntil(timeout=1.0)
 
         if (self.isDebug()):
             # Print just for debug pourposes...
@@ -284,29 +499,30 @@ class SmallPhotoMultiplierTubeController():
 
 
     def validateDACVoltages(self, voltagesArray, reference, maxError=0.02):
-        errorFile = open(self.errorDacFileName, "w")
-        validVoltages = True
+        # Mask of valid channels (all at once); the channels out of range are written to the error file
+        validVoltages = numpy.zeros(len(voltagesArray), dtype=bool)
+        voltages = toFloatArray(voltagesArray)
 
         try:
-            for index, voltage in enumerate(voltagesArray):
-                if (abs(voltage - reference) > maxError):
-                    errorMessage = ("Channel %d with error margin for VSet grater than %.3f.  Expected voltage: %.3f, but read: %.3f.\n" % (index, maxError, reference, voltage))
-                    # Save information into file
-                    errorFile.write(errorMessage)
-                    validVoltages = False
-
-                    if (self.isDebug()):
-                        print(errorMessage)
+            validVoltages = validateVoltages(voltagesArray, reference, maxError=maxError)
+            references = numpy.broadcast_to(numpy.atleast_1d(numpy.asarray(reference, dtype=numpy.float64)), validVoltages.shape)
         except:
-            validVoltages = False
             print("Exception when validating voltages!")
-            pass
+            references = [float("nan")] * len(voltagesArray)
+
+        with open(self.errorDacFileName, "w") as errorFile:
+            for index in numpy.flatnonzero(~validVoltages):
+                errorMessage = ("Channel %d with error margin for VSet grater than %.3f.  Expected voltage: %.3f, but read: %.3f.\n" % (index, maxError, references[index], voltages[index]))
+                # Save information into file
+                errorFile.write(errorMessage)
 
-        errorFile.close()
+                if (self.isDebug()):
+                    print(errorMessage)
 
         return validVoltages
 
 
+    @exclusiveBus
     def readMonitorsOfAllChannels(self):
         listOfMonitorsRead = []
 
@@ -326,6 +542,27 @@ class SmallPhotoMultiplierTubeController():
         return listOfMonitorsRead
 
 
+    @traced("monitor", arguments=("channels",))
+    def readMonitorsIfIdle(self, channels):
+        # Monitors (IMon, VMon) of "channels", or None, without waiting, when Linduino is busy with the sequence
+        if (not self.linduinoObj.busLock.acquire(blocking=False)):
+            return None
+
+        try:
+            self.startMonitorFunction()
+
+            try:
+                return [self.readMonitorsOfOneChannel(channel) for channel in channels]
+            finally:
+                # Even when the run is cancelled, Linduino must leave the monitor mode before other commands
+                with shielded():
+                    self.stopMonitorFunction()
+        finally:
+            self.linduinoObj.busLock.release()
+
+
+    @traced("monitor")
+    @exclusiveBus
     def startMonitorFunction(self):
         # -----------------------------------------------------------------
         # Start the function of IMon and VMon monitoring.
@@ -352,6 +589,8 @@ class SmallPhotoMultiplierTubeController():
             # Print just for debug pourposes...
             print(returnedMessage)
 
+    @traced("monitor")
+    @exclusiveBus
     def stopMonitorFunction(self):
         # -----------------------------------------------------------------
         # Start the function of IMon and VMon monitoring.
@@ -379,15 +618,14 @@ class SmallPhotoMultiplierTubeController():
             print(returnedMessage)
 
 
+    @traced("monitor", arguments=("channel",))
+    @exclusiveBus
     def readMonitorsOfOneChannel(self, channel):
         # Send command to get information of one channel
         self.linduinoObj.sendCommand(str(channel))
 
-        # Wait for the command to be executed and response has been sent
-        sleep(0.5)
-
-        # Read the return
-        returnedMessage = self.linduinoObj.readReturn()
+        # Wait for the command to be executed and response has been sent (the pair of monitors ends with a new line)
+        returnedMessage = self.linduinoObj.readReturnUntil(predicate=lambda message: ('\n' in message), timeout=0.5)
 
         if (self.isDebug()):
             # Print just for debug pourposes...
@@ -407,60 +645,205 @@ class SmallPhotoMultiplierTubeController():
         return monitorRead
 
 
-    def validateModuleMonitor(self, voltagesArray, monitorArray, vFactor=2.0, iFactor=1.2541993281, maxVMonError=0.03, maxIMonError=0.03):
-        errorModFile = open(self.errorModuleFileName, "w")
-        errorPmtFile = open(self.errorPmtFileName, "w")
+    @traced("mux", arguments=("channels",))
+    @exclusiveBus
+    def waitVoltagesSettling(self, channels, referencesArray, maxError=0.02, timeout=30.0, pollInterval=0.2, stableError=None):
+        # -----------------------------------------------------------------
+        # Read by MUX, in one loop, only the channels not yet within
+        # "maxError" of their reference; returns as soon as all of them
+        # have settled, or after "timeout" seconds. With "stableError", a
+        # channel whose reading changes less than it between two loops has
+        # stopped moving (out of the reference) and is not waited anymore.
+        # Returns the voltages read and the flags of settled channels.
+        # -----------------------------------------------------------------
+        listOfVoltagesRead = [-1.0] * len(channels)
+        settled = [False] * len(channels)
+        stable = [False] * len(channels)
+        startTime = time.time()
+
+        while (True):
+            for index, channel in enumerate(channels):
+                if (not (settled[index] or stable[index])):
+                    previousVoltage = listOfVoltagesRead[index]
+                    listOfVoltagesRead[index] = self.setMuxToOneChannel(channel, enable=True)
+                    settled[index] = (abs(listOfVoltagesRead[index] - referencesArray[index]) <= maxError)
+                    stable[index] = ((stableError is not None) and (previousVoltage >= 0.0) and (abs(listOfVoltagesRead[index] - previousVoltage) <= stableError))
+
+            if (all(settled) or all(s or t for s, t in zip(settled, stable)) or ((time.time() - startTime) >= timeout)):
+                break
 
-        validMonitors = True
+            sleep(pollInterval)
+
+        if (self.isDebug()):
+            print("---------")
+            print("Voltages read after %.1f s (settled: %s): " % (time.time() - startTime, settled), listOfVoltagesRead)
+
+        return listOfVoltagesRead, settled
+
+
+    @traced("monitor", arguments=("channels",))
+    @exclusiveBus
+    def waitMonitorsSettling(self, channels, voltagesArray, vFactor=2.0, maxVMonError=0.03, timeout=30.0, pollInterval=0.2):
+        # -----------------------------------------------------------------
+        # Same for VMon (HV module output), relative to "voltage x vFactor"
+        # as in validateModuleMonitor; the monitor function stays active
+        # during the whole loop.
+        # Returns the monitors read (IMon, VMon) and the flags of settled channels.
+        # -----------------------------------------------------------------
+        listOfMonitorsRead = [None] * len(channels)
+        settled = [False] * len(channels)
+        startTime = time.time()
+
+        self.startMonitorFunction()
 
         try:
-            if (len(voltagesArray) == len(monitorArray)):
-                for index, (monitor, voltage) in enumerate(zip(monitorArray, voltagesArray)):
-                    # Each cell of 'monitorArray' is an array with IMon at index '0' and VMon at index '1'
-                    # ----------------------------------------------------------------------------
-                    # Validate IMon...
-                    iMon = round(float(monitor[0]), 3)
-                    # 
-                    iReference = round(float(voltage) * iFactor, 3)
-
-                    if (abs(iMon - iReference)/iReference > maxIMonError):
-                        errorMessage = ("Channel %d with error margin for IMon (PMT) grater than %.3f.  Expected iMon: %.3f, but read: %.3f.\n" % (index, maxIMonError, iReference, iMon))
-                        # Save information into file
-                        errorPmtFile.write(errorMessage)
-                        validMonitors = False
+            while (True):
+                for index, channel in enumerate(channels):
+                    if (not settled[index]):
+                        try:
+                            listOfMonitorsRead[index] = self.readMonitorsOfOneChannel(channel)
+                            vReference = float(voltagesArray[index]) * vFactor
+                            settled[index] = (abs(float(listOfMonitorsRead[index][1]) - vReference) / vReference <= maxVMonError)
+                        except:
+                            print("Exception when reading monitors of channel %s..." % str(channel))
+
+                if (all(settled) or ((time.time() - startTime) >= timeout)):
+                    break
 
-                        if (self.isDebug()):
-                            print(errorMessage)
+                sleep(pollInterval)
+        finally:
+            # Even when the run is cancelled, Linduino must leave the monitor mode before other commands
+            with shielded():
+                self.stopMonitorFunction()
 
-                    # ----------------------------------------------------------------------------
-                    # Validate VMon...
-                    vMon = round(float(monitor[1]), 3)
-                    # 
-                    vReference = round(float(voltage) * vFactor, 3)
+        if (self.isDebug()):
+            print("---------")
+            print("Monitors read after %.1f s (settled: %s): " % (time.time() - startTime, settled), listOfMonitorsRead)
 
-                    if (abs(vMon - vReference)/vReference > maxVMonError):
-                        errorMessage = ("Channel %d with error margin for VMon (HV module) grater than %.3f.  Expected vMon: %.3f, but read: %.3f.\n" % (index, maxVMonError, vReference, vMon))
-                        # Save information into file
-                        errorModFile.write(errorMessage)
-                        validMonitors = False
+        return listOfMonitorsRead, settled
 
-                        if (self.isDebug()):
-                            print(errorMessage)
 
-            else:
-                validMonitors = False
-                print("Error when validating monitors, number of informed values does not match!")
-        except:
-            validMonitors = False
-            print("Exception when validating monitors!")
-            pass
+    @traced("dac", arguments=("voltagesArray",))
+    @exclusiveBus
+    def rampVoltages(self, voltagesArray, maxError=0.02, timeout=30.0):
+        # -----------------------------------------------------------------
+        # Set all channels together and wait (MUX) until they have settled;
+        # "voltagesArray" has the voltages expected by MUX, Linduino
+        # receives half of them (it multiplies the input by 2).
+        # -----------------------------------------------------------------
+        channels = self.getChannelsInUse()
+
+        if (len(voltagesArray) != len(channels)):
+            print("Inconsistent number of voltage values for all selected channels...")
+            return None, [False] * len(channels)
+
+        self.setVoltagesOfChannels(channels, toLinduinoUnits(voltagesArray))
+
+        return self.waitVoltagesSettling(channels, voltagesArray, maxError=maxError, timeout=timeout)
+
+
+    @traced("dac", arguments=("voltagesArray",))
+    @exclusiveBus
+    def trimVoltages(self, voltagesArray, corrections=None, maxError=0.02, timeout=30.0, maximumIterations=3, maximumCorrection=0.5):
+        # -----------------------------------------------------------------
+        # Closed loop of rampVoltages: Linduino receives the voltages plus
+        # a correction by channel; the channels read by MUX out of
+        # "maxError" (once their reading is stable) have the measured error
+        # added to their correction and are set again, up to
+        # "maximumIterations" times.
+        # Each step and the whole correction are limited to
+        # "maximumCorrection" (V): a channel reaching the limit is set once
+        # with it and not trimmed anymore (a reading that far is a problem
+        # of the channel, not of the DAC).
+        # Returns the voltages read, the flags of settled channels and the
+        # corrections of the last setting.
+        # -----------------------------------------------------------------
+        channels = self.getChannelsInUse()
+
+        if (len(voltagesArray) != len(channels)):
+            print("Inconsistent number of voltage values for all selected channels...")
+            return None, [False] * len(channels), corrections
+
+        references = toFloatArray(voltagesArray)
+        corrections = numpy.zeros(len(channels)) if (corrections is None) else numpy.clip(toFloatArray(corrections), -maximumCorrection, maximumCorrection)
+        listOfVoltagesRead = numpy.full(len(channels), -1.0)
+        settled = numpy.zeros(len(channels), dtype=bool)
+        atLimit = numpy.zeros(len(channels), dtype=bool)
+        stopped = numpy.zeros(len(channels), dtype=bool)
+
+        for iteration in range(maximumIterations + 1):
+            pending = numpy.flatnonzero(~settled & ~stopped)
+            self.setVoltagesOfChannels([channels[index] for index in pending], toLinduinoUnits(references[pending] + corrections[pending]))
+
+            voltagesRead, settledRead = self.waitVoltagesSettling([channels[index] for index in pending], references[pending].tolist(),
+                                                                  maxError=maxError, timeout=timeout, stableError=(maxError / 4))
+            listOfVoltagesRead[pending] = voltagesRead
+            settled[pending] = settledRead
+            stopped |= (atLimit & ~settled)
+
+            if ((settled | stopped).all() or (iteration == maximumIterations)):
+                break
+
+            # DAC (and MUX) are linear around the setpoint: the error read is the missing correction
+            unsettled = numpy.flatnonzero(~settled & ~stopped)
+            steps = references[unsettled] - listOfVoltagesRead[unsettled]
+            clampedSteps = numpy.clip(steps, -maximumCorrection, maximumCorrection)
+            clampedCorrections = numpy.clip(corrections[unsettled] + clampedSteps, -maximumCorrection, maximumCorrection)
+            atLimit[unsettled] = ((clampedSteps != steps) | (clampedCorrections != (corrections[unsettled] + clampedSteps)))
+            corrections[unsettled] = clampedCorrections
+
+            if (self.isDebug()):
+                print("---------")
+                print("Trimming DAC (iteration %d), corrections: " % (iteration + 1), corrections.tolist())
+
+        if (stopped.any()):
+            print("DAC correction of channels %s limited to %.3f V, not trimmed anymore..." % ([channels[index] for index in numpy.flatnonzero(stopped)], maximumCorrection))
+
+        return listOfVoltagesRead.tolist(), settled.tolist(), corrections.tolist()
+
+
+    def validateModuleMonitor(self, voltagesArray, monitorArray, vFactor=2.0, iFactor=1.2541993281, maxVMonError=0.03, maxIMonError=0.03):
+        # -----------------------------------------------------------------
+        # Each cell of 'monitorArray' is an array with IMon at index '0'
+        # and VMon at index '1'; returns the masks of valid IMon (PMT) and
+        # VMon (HV module), the channels out of range are written to the
+        # error files.
+        # -----------------------------------------------------------------
+        validIMon = numpy.zeros(len(voltagesArray), dtype=bool)
+        validVMon = numpy.zeros(len(voltagesArray), dtype=bool)
+        iMon = vMon = iReference = vReference = numpy.full(len(voltagesArray), numpy.nan)
+
+        if (len(voltagesArray) == len(monitorArray)):
+            try:
+                iMon, vMon = parseMonitors(monitorArray)
+                validIMon, validVMon, iReference, vReference = validateMonitors(voltagesArray, iMon, vMon, vFactor=vFactor, iFactor=iFactor,
+                                                                                maxVMonError=maxVMonError, maxIMonError=maxIMonError)
+            except:
+                print("Exception when validating monitors!")
+        else:
+            print("Error when validating monitors, number of informed values does not match!")
+
+        with open(self.errorModuleFileName, "w") as errorModFile, open(self.errorPmtFileName, "w") as errorPmtFile:
+            for index in numpy.flatnonzero(~validIMon):
+                errorMessage = ("Channel %d with error margin for IMon (PMT) grater than %.3f.  Expected iMon: %.3f, but read: %.3f.\n" % (index, maxIMonError, iReference[index], iMon[index]))
+                # Save information into file
+                errorPmtFile.write(errorMessage)
+
+                if (self.isDebug()):
+                    print(errorMessage)
+
+            for index in numpy.flatnonzero(~validVMon):
+                errorMessage = ("Channel %d with error margin for VMon (HV module) grater than %.3f.  Expected vMon: %.3f, but read: %.3f.\n" % (index, maxVMonError, vReference[index], vMon[index]))
+                # Save information into file
+                errorModFile.write(errorMessage)
 
-        errorModFile.close()
-        errorPmtFile.close()
+                if (self.isDebug()):
+                    print(errorMessage)
 
-        return validMonitors
+        return validIMon, validVMon
 
 
+    @traced("files")
     def storeLinearityConfiguration(self, numberOfColpi=30, numberOfSteps=50):
         status = True
 
@@ -483,6 +866,7 @@ class SmallPhotoMultiplierTubeController():
         return status
 
 
+    @traced("files")
     def storeVoltagesForSinglePhotoelectron(self, voltagesArray, voltageLowLED, voltageFactor=840.0):
         status = True
 
@@ -522,6 +906,7 @@ class SmallPhotoMultiplierTubeController():
         return status
 
 
+    @traced("wavedump")
     def callWaveDump(self):
         status = True
 
@@ -530,8 +915,10 @@ class SmallPhotoMultiplierTubeController():
             print("Calling WaveDump...")
 
         try:
-            subprocess.Popen(["/home/spmt/Documents/TorinoGroup/Wavedump/src/wavedump", "WaveDumpConfig.txt"])
+            self.waveDumpProcess = subprocess.Popen([self.waveDumpProgram, "WaveDumpConfig.txt"])
             sleep(1)
+        except RunCancelled:
+            raise
         except:
             print("Error when trying to call WaveDump...")
             status = False
@@ -539,15 +926,23 @@ class SmallPhotoMultiplierTubeController():
 
         return status
 
+    @traced("wavedump")
     def killWaveDump(self):
         if (self.isDebug()):
             print("---------")
             print("Killing WaveDump...")
 
         try:
-            os.system("/bin/ps -ef | grep wavedump | grep -v grep | awk \'{print $2}\' | xargs kill -9")
-            sleep(1)
-            os.system("/bin/ps -ef | grep wavedump | grep -v grep | awk \'{print $2}\' | xargs kill -9")
+            if (self.waveDumpProcess):
+                # Only the WaveDump of this station, others could be running in the same computer
+                self.waveDumpProcess.kill()
+                self.waveDumpProcess = None
+            else:
+                os.system("/bin/ps -ef | grep wavedump | grep -v grep | awk \'{print $2}\' | xargs kill -9")
+                sleep(1)
+                os.system("/bin/ps -ef | grep wavedump | grep -v grep | awk \'{print $2}\' | xargs kill -9")
+        except RunCancelled:
+            raise
         except:
             #print("Error when trying to kill WaveDump...")
             pass
@@ -555,17 +950,27 @@ class SmallPhotoMultiplierTubeController():
         return
 
 
-    def callWaveDumpAndTriggerDigitizer(self, frequency, numberOfPulses):
+    @traced("acquisition", arguments=("frequency", "numberOfPulses", "blockPulses"))
+    def callWaveDumpAndTriggerDigitizer(self, frequency, numberOfPulses, blockPulses=None, stopCondition=None):
         status = True
 
         # Inform WaveDump to acquire using comunication file
         status = status and self.startWaveDumpAcquisition()
-        
+
         # Call WaveDump program
         status = status and self.callWaveDump()
 
+        # The HV monitor can only sample between two triggers (Linduino is busy while triggering)
+        if (self.monitorInterval):
+            monitorBlockPulses = max(int(frequency * self.monitorInterval), 1)
+            blockPulses = min(blockPulses or monitorBlockPulses, monitorBlockPulses)
+
         # Call Trigger
-        status = status and self.triggerDigitizer(frequency=frequency, numberOfPulses=numberOfPulses)
+        if (blockPulses and (stopCondition or (blockPulses < numberOfPulses))):
+            status = status and self.triggerDigitizerInBlocks(frequency=frequency, numberOfPulses=numberOfPulses, blockPulses=blockPulses, stopCondition=stopCondition)
+        else:
+            status = status and self.triggerDigitizer(frequency=frequency, numberOfPulses=numberOfPulses)
+            self.pulsesTriggered = numberOfPulses
 
         # Inform WaveDump to stop acquisition and close
         status = status and self.stopWaveDumpAcquisition()
@@ -573,6 +978,42 @@ class SmallPhotoMultiplierTubeController():
         return status
 
 
+    @traced("trigger", arguments=("frequency", "numberOfPulses", "blockPulses"))
+    def triggerDigitizerInBlocks(self, frequency, numberOfPulses, blockPulses, stopCondition=None):
+        # -----------------------------------------------------------------
+        # Trigger "numberOfPulses" at most, in blocks of "blockPulses"; after
+        # each block the HV monitor can sample ("betweenBlocks") and
+        # "stopCondition()", if any, is evaluated and, when it returns True,
+        # the remaining blocks are not fired (early stop).
+        # -----------------------------------------------------------------
+        status = True
+        self.pulsesTriggered = 0
+
+        while (status and (self.pulsesTriggered < numberOfPulses)):
+            checkCancelled()
+            pulses = min(blockPulses, numberOfPulses - self.pulsesTriggered)
+
+            status = self.triggerDigitizer(frequency=frequency, numberOfPulses=pulses)
+            self.pulsesTriggered += pulses
+
+            if (status and self.betweenBlocks):
+                self.betweenBlocks()
+
+            try:
+                if (status and stopCondition and stopCondition()):
+                    if (self.isDebug()):
+                        print("---------")
+                        print("Early stop after %d of %d pulses..." % (self.pulsesTriggered, numberOfPulses))
+                    break
+            except:
+                print("Exception when evaluating stop condition, continue triggering...")
+                pass
+
+        return status
+
+
+    @traced("trigger", arguments=("frequency", "numberOfPulses"))
+    @exclusiveBus
     def triggerDigitizer(self, frequency, numberOfPulses):
         status = True
 
@@ -624,6 +1065,8 @@ class SmallPhotoMultiplierTubeController():
                         break
 
                 sleep(0.5)
+        except RunCancelled:
+            raise
         except:
             print("Error when trying to trigger digitizer...")
             status = False
@@ -631,8 +1074,103 @@ class SmallPhotoMultiplierTubeController():
 
         return status
 
+    @traced("trigger", arguments=("numberOfSteps", "numberOfColpi", "frequency"))
+    @exclusiveBus
+    def runLinearitySweep(self, ledChannels, initialVoltages, increments, numberOfSteps, numberOfColpi, frequency, progress=None):
+        # -----------------------------------------------------------------
+        # This depends on Linduino program;
+        # -----------------------------------------------------------------
+        #     '18'-Linearity sweep:
+        #         -> answers "Sweep ready" and waits the parameters:
+        #            channel of LED 2, channel of LED 3,
+        #            initial voltage and increment of LED 2,
+        #            initial voltage and increment of LED 3,
+        #            number of steps, pulses per state (colpi), interval (ms);
+        #         -> for each step, the same three states of the host loop
+        #            (A ON/B OFF, A ON/B ON, A OFF/B ON), "numberOfColpi"
+        #            pulses each, then "Step <n>";
+        #         -> "Fine sweep" at the end.
+        # -----------------------------------------------------------------
+        # Voltages are halved, as in every DAC command. Returns None when
+        # the program does not know the command (the host must execute the
+        # steps), otherwise True/False.
+        # -----------------------------------------------------------------
+        self.linduinoObj.sendCommand(LINEARITY_SWEEP_COMMAND)
+        returnedMessage = self.linduinoObj.readReturnUntil(predicate=lambda message: ("Sweep ready" in message), timeout=1.0)
+
+        if ((not returnedMessage) or ("Sweep ready" not in returnedMessage)):
+            if (self.isDebug()):
+                print("---------")
+                print("Linduino program without linearity sweep, steps executed by host...")
+            return None
+
+        interval = 1000.0/frequency
+        parameters = [ledChannels[0], ledChannels[1],
+                      toLinduinoUnits(initialVoltages[0]), toLinduinoUnits(increments[0]),
+                      toLinduinoUnits(initialVoltages[1]), toLinduinoUnits(increments[1]),
+                      numberOfSteps, numberOfColpi, interval]
+        self.linduinoObj.sendCommand(";".join(str(parameter) for parameter in parameters))
+
+        # Longest time expected: three states of "numberOfColpi" pulses by step, plus a margin
+        timeout = (3 * numberOfSteps * numberOfColpi / frequency) * 1.5 + 10.0
+        startTime = time.time()
+        received = ""
+        lastStep = 0
+
+        while ((time.time() - startTime) < timeout):
+            returnedMessage = self.linduinoObj.readReturnUntil(predicate=lambda message: ('\n' in message), timeout=1.0)
+
+            if (not returnedMessage):
+                continue
+
+            received += returnedMessage
+            lines = received.split('\n')
+            # Keep the incomplete line for the next read
+            received = lines.pop()
+
+            for line in lines:
+                line = line.strip()
+
+                if (line.startswith("Step")):
+                    try:
+                        lastStep = int(line.split()[1])
+                    except (IndexError, ValueError):
+                        continue
+
+                    if (progress):
+                        progress(lastStep)
+                elif (line == "Fine sweep"):
+                    if (self.isDebug()):
+                        print("---------")
+                        print("Linearity sweep finished in %.1f s..." % (time.time() - startTime))
+                    return (lastStep == numberOfSteps)
+
+        print("Linearity sweep not finished after %.1f s (last step: %d)..." % (timeout, lastStep))
+
+        return False
+
+
+    def waitWaveDumpExit(self, timeout=5.0):
+        if ((self.waveDumpProcess is None) or (self.waveDumpProcess.poll() is not None)):
+            return
+
+        deadline = time.time() + timeout
+
+        while ((self.waveDumpProcess.poll() is None) and (time.time() < deadline)):
+            sleep(0.05)
+
+        if (self.waveDumpProcess.poll() is None):
+            print("WaveDump did not quit in %.0f s..." % timeout)
+            self.killWaveDump()
+
+
+    @traced("wavedump")
     def startWaveDumpAcquisition(self):
         status = True
+
+        # The previous WaveDump must read its "q" before "a" overwrites it (otherwise it never quits and writes the new wave files too)
+        self.waitWaveDumpExit()
+
         try:
             fileComunica = open(self.comunicaWaveDumpFileName, "w")
             fileComunica.write("a")
@@ -653,6 +1191,7 @@ class SmallPhotoMultiplierTubeController():
         return status
 
 
+    @traced("wavedump")
     def stopWaveDumpAcquisition(self):
         status = True
 
@@ -670,6 +1209,8 @@ class SmallPhotoMultiplierTubeController():
             if (self.isDebug()):
                 print("---------")
                 print("Inform WaveDump to stop acquisition and close...")
+        except RunCancelled:
+            raise
         except:
             status = False
 
@@ -685,6 +1226,7 @@ class SmallPhotoMultiplierTubeController():
     """
     Run Fondo.exe
     """
+    @traced("analysis")
     def callDarkCountProcess(self):
         status = True
 
@@ -705,6 +1247,8 @@ class SmallPhotoMultiplierTubeController():
                 if (os.path.exists(self.darkCountGaussFileName)):
                     break
 
+                sleep(0.1)
+
             # Just wait while more
             sleep(1)
 
@@ -713,6 +1257,8 @@ class SmallPhotoMultiplierTubeController():
                 print("End of processing files by Fondo.exe")
                 print("---------")
 
+        except RunCancelled:
+            raise
         except:
             print("Error calling Fondo.exe...")
             status = False
@@ -724,8 +1270,15 @@ class SmallPhotoMultiplierTubeController():
     """
     Run DarkCountFauth
     """
-    def callDarkCountFauthProcess(self):
+    @traced("analysis", arguments=("workDir",))
+    def callDarkCountFauthProcess(self, workDir=None):
+        # -----------------------------------------------------------------
+        # When "workDir" is informed, the program runs inside that folder
+        # (where the wave files were moved to), so WaveDump can already
+        # write new wave files in the current folder.
+        # -----------------------------------------------------------------
         status = True
+        resultFileName = os.path.join(workDir, self.darkCountFauthFileName) if (workDir) else self.darkCountFauthFileName
 
         if (self.isDebug()):
             print("---------")
@@ -734,17 +1287,19 @@ class SmallPhotoMultiplierTubeController():
 
         try:
             # Remove previous configuration file for dark count
-            if (os.path.exists(self.darkCountGaussFileName)):
-                os.remove(self.darkCountFauthFileName)
+            if (os.path.exists(resultFileName)):
+                os.remove(resultFileName)
 
             #subprocess.Popen("./DarkCountFauth")
-            subprocess.Popen("./10percFauth_v1")
+            subprocess.Popen(os.path.abspath("./10percFauth_v1"), cwd=workDir)
 
             # Wait until a new dark count gaussian configuration file is created
             while (True):
-                if (os.path.exists(self.darkCountFauthFileName)):
+                if (os.path.exists(resultFileName)):
                     break
 
+                sleep(0.1)
+
             # Just wait while more
             sleep(1)
 
@@ -753,6 +1308,8 @@ class SmallPhotoMultiplierTubeController():
                 print("End of processing files by DarkCountFauth")
                 print("---------")
 
+        except RunCancelled:
+            raise
         except:
             print("Error calling DarkCountFauth...")
             status = False
@@ -764,6 +1321,7 @@ class SmallPhotoMultiplierTubeController():
     """
     Run 10Percento.exe
     """
+    @traced("analysis")
     def call10PercentProcess(self):
         status = True
 
@@ -784,6 +1342,8 @@ class SmallPhotoMultiplierTubeController():
                 if (os.path.exists(self._10PercentFileName)):
                     break
 
+                sleep(0.1)
+
             # Just wait while more
             sleep(1)
 
@@ -792,6 +1352,8 @@ class SmallPhotoMultiplierTubeController():
                 print("End of processing files by 10Percento.exe")
                 print("---------")
 
+        except RunCancelled:
+            raise
         except:
             print("Error calling 10Percento.exe...")
             status = False
@@ -803,6 +1365,7 @@ class SmallPhotoMultiplierTubeController():
     """
     Run Ricerca.exe
     """
+    @traced("analysis")
     def callSearchProcess(self):
         status = True
 
@@ -823,6 +1386,8 @@ class SmallPhotoMultiplierTubeController():
                 if (os.path.exists(self.searchFileName)):
                     break
 
+                sleep(0.1)
+
             # Just wait while more
             sleep(1)
 
@@ -831,6 +1396,8 @@ class SmallPhotoMultiplierTubeController():
                 print("End of processing files by Ricerca.exe")
                 print("---------")
 
+        except RunCancelled:
+            raise
         except:
             print("Error calling Ricerca.exe...")
             status = False
@@ -842,6 +1409,7 @@ class SmallPhotoMultiplierTubeController():
     """
     Run Single_ph.exe
     """
+    @traced("analysis")
     def callSinglePhotoelectronProcess(self):
         status = True
 
@@ -862,6 +1430,8 @@ class SmallPhotoMultiplierTubeController():
                 if (os.path.exists(self.voltagesGainTableFileName)):
                     break
 
+                sleep(0.1)
+
             # Just wait while more
             sleep(1)
 
@@ -870,6 +1440,8 @@ class SmallPhotoMultiplierTubeController():
                 print("End of processing files by Single_ph.exe")
                 print("---------")
 
+        except RunCancelled:
+            raise
         except:
             print("Error calling Single_ph.exe...")
             status = False
@@ -881,6 +1453,7 @@ class SmallPhotoMultiplierTubeController():
     """
     Run Linearity.exe
     """
+    @traced("analysis")
     def callLinearityProcess(self):
         status = True
 
@@ -901,6 +1474,8 @@ class SmallPhotoMultiplierTubeController():
                 print("Linearity.exe was started and could be still runnning... if so, wait a while!")
                 print("---------")
 
+        except RunCancelled:
+            raise
         except:
             print("Error calling Linearity.exe...")
             status = False
@@ -979,6 +1554,7 @@ class SmallPhotoMultiplierTubeController():
         return voltagesArray, status
 
 
+    @traced("files")
     def renameWaveFilesForSinglePhotoelectron(self):
         for channel in range(self.getNumberOfChannels()):
             try:
@@ -991,6 +1567,7 @@ class SmallPhotoMultiplierTubeController():
                 pass
 
 
+    @traced("files")
     def renameWaveFilesForIntenseLED(self):
         for channel in range(self.getNumberOfChannels()):
             try:
@@ -1003,6 +1580,7 @@ class SmallPhotoMultiplierTubeController():
                 pass
 
 
+    @traced("files")
     def renameWaveFilesForLowLED(self):
         for channel in range(self.getNumberOfChannels()):
             try:
@@ -1015,6 +1593,42 @@ class SmallPhotoMultiplierTubeController():
                 pass
 
 
+    @traced("features", arguments=("fileName",))
+    def getWaveFeatures(self, fileName, integrationWindow=None, cached=True):
+        # Baseline, amplitude, charge and peak time of every event in the file (cached by content, unless the file is read only once)
+        if (not os.path.exists(fileName)):
+            print("Error, file not found: %s..." % fileName)
+            return None
+
+        if (not cached):
+            return extractFeatures(readWaveFile(fileName), integrationWindow=integrationWindow)
+
+        return self.featureCache.getFeatures(fileName, integrationWindow=integrationWindow)
+
+
+    @traced("files", arguments=("folder",))
+    def moveWaveFilesToFolder(self, folder):
+        # Moving (not copying) is immediate, and WaveDump creates new files for the next acquisition
+        status = True
+
+        try:
+            if (os.path.exists(folder)):
+                shutil.rmtree(folder)
+
+            os.makedirs(folder)
+
+            for channel in range(MAXIMUM_CHANNELS):
+                if (os.path.exists(self.waveOriginFileName % channel)):
+                    os.rename(self.waveOriginFileName % channel, os.path.join(folder, os.path.basename(self.waveOriginFileName % channel)))
+        except:
+            status = False
+            print("Exception when moving wave files to %s..." % folder)
+            pass
+
+        return status
+
+
+    @traced("files", arguments=("subFolder",))
     def backupWaveFiles(self, subFolder="0001"):
         curDateFolder = "./" + time.strftime(FOLDER_FORMAT)
         curExpFolder  = curDateFolder + "/" + subFolder
@@ -1028,6 +1642,14 @@ class SmallPhotoMultiplierTubeController():
         
 
 
+    def connect(self):
+        if (self.linduinoObj):
+            self.linduinoObj.connect()
+
+    def connectInBackground(self):
+        if (self.linduinoObj):
+            self.linduinoObj.connectInBackground()
+
     def reconnect(self):
         if (self.linduinoObj):
             self.linduinoObj.reconnect()
@@ -1042,26 +1664,118 @@ class SmallPhotoMultiplierTubeController():
 
 
 """
-Orchestrator()
+Checkpoint of a run, stored in its folder: configuration, completed phases and values derived by them (voltages read,
+tuned LED voltage...), so an interrupted run can be resumed at the phase that failed
 """
-class Orchestrator(QObject):
-    # ----------------------------------------------
-    # Signals to communicate with UI
-    informExecution = pyqtSignal(str)
-    fillTable = pyqtSignal(int, int, str)
-    resetButtons = pyqtSignal()
+class RunCheckpoint():
+    def __init__(self, fileName):
+        self.fileName           = fileName
+        self.configuration      = {}
+        self.folderName         = None
+        self.subFolderName      = None
+        self.completedPhases    = []
+        self.failedPhase        = None
+        self.state              = {}
 
-    def __init__(self):
-        QObject.__init__(self)
+
+    def start(self, configuration, folderName, subFolderName):
+        self.configuration      = configuration
+        self.folderName         = folderName
+        self.subFolderName      = subFolderName
+        self.completedPhases    = []
+        self.failedPhase        = None
+        self.state              = {}
+
+        return self.save()
+
+
+    def complete(self, phase, state):
+        if (phase not in self.completedPhases):
+            self.completedPhases.append(phase)
+
+        self.failedPhase = None
+        self.state = dict(state)
+
+        return self.save()
+
+
+    def fail(self, phase):
+        self.failedPhase = phase
+
+        return self.save()
+
+
+    def reopen(self, phase):
+        # A phase considered completed must be executed again (e.g. its analysis in background failed)
+        if (phase in self.completedPhases):
+            self.completedPhases.remove(phase)
+
+        return self.save()
+
+
+    def load(self):
+        try:
+            with open(self.fileName, "r") as fileCheckpoint:
+                content = json.load(fileCheckpoint)
+
+            self.configuration      = content["configuration"]
+            self.folderName         = content["folderName"]
+            self.subFolderName      = content["subFolderName"]
+            self.completedPhases    = content["completedPhases"]
+            self.failedPhase        = content["failedPhase"]
+            self.state              = content["state"]
+        except:
+            print("Exception when loading checkpoint %s..." % self.fileName)
+            return False
+
+        return True
+
+
+    def save(self):
+        content = {"configuration":     self.configuration,
+                   "folderName":        self.folderName,
+                   "subFolderName":     self.subFolderName,
+                   "completedPhases":   self.completedPhases,
+                   "failedPhase":       self.failedPhase,
+                   "state":             self.state,
+                   "time":              time.strftime("%Y-%m-%d %H:%M:%S")}
+
+        try:
+            # Write a temporary file and replace, so a crash never leaves a broken checkpoint
+            with open(self.fileName + ".tmp", "w") as fileCheckpoint:
+                json.dump(content, fileCheckpoint, indent=4)
+
+            os.replace(self.fileName + ".tmp", self.fileName)
+        except:
+            print("Exception when saving checkpoint %s..." % self.fileName)
+            return False
+
+        return True
+
+
+"""
+Orchestrator()
+"""
+class Orchestrator():
+    def __init__(self, linduinoPort=DEFAULT_LINDUINO_PORT, waveDumpProgram=DEFAULT_WAVEDUMP_PROGRAM):
+        # ----------------------------------------------
+        # Signals to communicate with UI (or headless runner)
+        self.informExecution = Signal()         # (message)
+        self.updateTable = Signal()             # (snapshot: one [Vset, Vmon, Imon] row per channel, None when not read)
+        self.resetButtons = Signal()            # ()
+        self.phaseChanged = Signal()            # (phase name, status)
+        self.tableValues = [[None] * len(TABLE_COLUMNS) for channel in range(MAXIMUM_CHANNELS)]
 
         self.activeDebugging = True
+        # When False, never wait for the operator (<Enter>) between phases
+        self.interactive = True
 
         # -------------------------------------------
         # Local attributes - Values for production
         self.numberOfChannels       = 1
         self.channelNumber          = 0
         self.voltageToSet           = -1
-        self.initialVoltage         = 1200
+        self.initialVoltage         = 1200.0
         self.maxVoltageError        = 0.02
         self.voltageFactor          = 2.0       # 5.1
         self.currentFactor          = ((2100/2.5)*(100/66975))
@@ -1096,39 +1810,278 @@ class Orchestrator(QObject):
         self.initialVoltageLED_2    = 4.0
         self.initialVoltageLED_3    = 4.0
         self.linearityAcqFreq       = 10
+        self.firmwareLinearitySweep = False     # Upload the sweep to Linduino (command "18"); only for a Linduino program that supports it
         self.highVoltageIDs         = []        # Matrix with max 8 vectors of 4 cells each (HV model, S/N, f(x) a, f(x) b)
+        self.channelState           = None      # ChannelState of the channels in use during a run
+        # Online histogramming (early stop of dark count when the SPE peak is precise enough)
+        self.darkCountPeakPrecision = 0.0       # Relative uncertainty of the charge peak; 0.0 disables the early stop
+        self.onlineBlockPulses      = 5000      # Pulses triggered between two checks of the histograms
+        self.onlineChargeThreshold  = 100.0     # Charge (ADC counts x samples) above the pedestal to look for the peak
+        # Adaptive acquisition: trigger in blocks until the precision target of the phase is met,
+        # the number of pulses informed in UI being the upper bound; a target 0.0 disables it
+        self.adaptiveAcquisition            = False
+        self.darkCountRatePrecision         = 0.02      # Dark count rate +-2%
+        self.darkCountAmplitudeThreshold    = 5.0       # ADC counts above baseline to count a dark pulse
+        self.highIntensPeakPrecision        = 0.01      # Charge peak of intense LED +-1%
+        self.lowIntensPeakPrecision         = 0.01      # Single photoelectron peak +-1%
 
         # Attributes of folder and sub-folder names to save wave files...
         self.folderName     = None
         self.subFolderName  = None
 
+        # Catalog of runs (SQLite), and the phase being executed to measure its duration
+        self.catalogFileName    = DEFAULT_CATALOG_FILE
+        self.catalog            = None
+        self.runId              = None
+        self.currentPhase       = None
+        self.phaseStartTime     = None
+
+        # Search of intense LED voltage by a model of the LED response (otherwise, steps of calcNewVoltageLED)
+        self.modelBasedLEDSearch            = True
+        self.highIntensTargetFraction       = 0.0       # Fraction of events above threshold; 0.0 learns it from Ricerca.exe
+        self.highIntensAmplitudeThreshold   = 50.0      # ADC counts above baseline
+        self.ledCalibrationFileName         = DEFAULT_LED_CALIBRATION_FILE
+
+        # Longest wait for the HV (MUX voltages and VMon) to settle after setting new voltages
+        self.hvSettlingTimeout  = 30.0
+        # Closed-loop corrections of DAC voltages out of maxVoltageError (0 disables, as well as the corrections kept by S/N)
+        self.dacTrimIterations      = 3
+        self.dacCorrectionFileName  = DEFAULT_DAC_CORRECTION_FILE
+        # Calibration of HV modules refitted from the points (MUX input, VMon output) of every run
+        self.hvCalibrationFileName  = DEFAULT_HV_CALIBRATION_FILE
+        self.vMonOutputFactor       = (2100.0/5.0)      # Output of HV module (V) by volt of VMon
+        # The refit is only recorded; runs use it when the operator opts in and has checked vMonOutputFactor against the datasheet of the modules
+        self.applyHVRefit           = False
+        self.vMonScaleVerified      = False
+
+        # Analyses that do not gate the next acquisition run in background, joined only where needed
+        self.overlapAnalyses    = True
+        self.analysisScheduler  = None
+
+        # Timeline of each execution (Chrome trace JSON)
+        self.traceRun           = True
+        # IMon and VMon sampled in background after the monitors phase (seconds between samples; 0 disables)
+        self.hvMonitorInterval  = 60.0
+        self.hvMonitorAlarmSamples = 2
+        self.hvMonitor          = None
+        self.hvAlarm            = None
+
+        # Values derived by the phases and needed by the next ones, saved in the checkpoint after each phase
+        self.runState           = {}
+        self.checkpoint         = None
+
         # Instantiate an object of SMPT Controller
-        self.spmtControllerObj = SmallPhotoMultiplierTubeController()
+        self.spmtControllerObj = SmallPhotoMultiplierTubeController(linduinoPort=linduinoPort, waveDumpProgram=waveDumpProgram)
+        self.linduinoPort = linduinoPort
+
+        # Token of the run in progress (None when idle), cancelled by "cancel"
+        self.cancellationToken = None
+        self.aborted = False
 
     # 
     def __calcHighVoltageOutput(self, aFactor=840.0, bFactor=0.0, input=1.0):
         return (aFactor*input + bFactor)
 
-    def __calcHighVoltageInput(self, aFactor=840.0, bFactor=0.0, output=840.0):
-        return ((output - bFactor)/aFactor)
-
     # ----------------------------------------------------------------
     def setDebug(self, debug=True):
         self.activeDebugging = debug
 
     # ----------------------------------------------------------------
-    def calcNewVoltageLED(self, voltageLED, a, b, c, factor1, factor2):
-        if ((a == 2) and (c != 1)):
-            voltageLED = voltageLED + ((factor1) / (factor2**b))
+    def getConfiguration(self):
+        configuration = {name: getattr(self, name) for name in CONFIGURATION_PARAMETERS}
+        configuration["highVoltageIDs"] = self.highVoltageIDs
+
+        return configuration
+
+    def setConfiguration(self, configuration):
+        for name, value in configuration.items():
+            if (name in CONFIGURATION_PARAMETERS):
+                # Keep the type of the default value (bool, int, float...)
+                setattr(self, name, toConfigurationType(value, getattr(self, name)))
+            elif (name == "highVoltageIDs"):
+                self.highVoltageIDs = [[str(hvDevice[0]), str(hvDevice[1]), float(hvDevice[2]), float(hvDevice[3])] for hvDevice in value]
+            elif (name == "debug"):
+                self.setDebug(debug=toConfigurationType(value, False))
+            else:
+                print("Unknown configuration parameter: %s..." % name)
 
-        if ((a == 2) and (c == 1)):
-            b += 1
+    # ----------------------------------------------------------------
+    def waitOperator(self, message="Press <Enter> to continue..."):
+        if (self.interactive):
+            input(message)
+            checkCancelled()
+        else:
+            self.informExecution.emit(message.replace("Press <Enter> to", "Going to"))
+
+    # ----------------------------------------------------------------
+    # Catalog of runs; problems with the catalog must never stop a run
+    # ----------------------------------------------------------------
+    def startCatalogRun(self):
+        try:
+            self.catalog = RunCatalog(self.catalogFileName)
+            self.runId = self.catalog.startRun(configuration=self.getConfiguration(),
+                                               highVoltageIDs=self.highVoltageIDs,
+                                               folder="./%s/%s" % (self.folderName, self.subFolderName))
+        except:
+            self.catalog = None
+            self.runId = None
+            print("Exception when registering the run in catalog %s..." % self.catalogFileName)
+
+    def finishCatalogRun(self, status="done", message=None):
+        if (self.currentPhase):
+            self.endPhase(status=status)
+
+        try:
+            if (self.catalog):
+                self.catalog.finishRun(self.runId, status=status, message=message)
+        except:
+            print("Exception when finishing the run in catalog...")
+
+        self.catalog = None
+
+    def beginPhase(self, name):
+        if (self.currentPhase):
+            self.endPhase()
+
+        self.currentPhase = name
+        self.phaseStartTime = time.time()
+        tracer.begin(name, "phase")
+        self.phaseChanged.emit(name, "started")
+
+    def endPhase(self, status="done"):
+        try:
+            if (self.catalog and self.currentPhase):
+                self.catalog.addPhase(self.runId, self.currentPhase, self.phaseStartTime, time.time() - self.phaseStartTime, status=status)
+        except:
+            print("Exception when storing phase %s in catalog..." % self.currentPhase)
+
+        if (self.currentPhase):
+            tracer.end(self.currentPhase, "phase", status=status)
+            self.phaseChanged.emit(self.currentPhase, status)
+
+        self.currentPhase = None
+
+    def recordMeasurements(self, quantity, values, channels=None):
+        try:
+            if (self.catalog):
+                self.catalog.addMeasurements(self.runId, quantity, values, channels=channels)
+        except:
+            print("Exception when storing %s measurements in catalog..." % quantity)
+
+    def recordResult(self, key, value, channel=None, phase=None):
+        # Analyses in background inform their phase, because the current one could be another
+        try:
+            if (self.catalog):
+                self.catalog.addResult(self.runId, phase or self.currentPhase, key, value, channel=channel)
+        except:
+            print("Exception when storing result %s in catalog..." % key)
+
+    def recordFileContent(self, key, fileName, phase=None):
+        # Log and result files are overwritten by every run, so keep their content in the catalog
+        try:
+            if (os.path.exists(fileName)):
+                with open(fileName, "r") as resultFile:
+                    self.recordResult(key, resultFile.read(), phase=phase)
+        except:
+            print("Exception when storing content of %s in catalog..." % fileName)
+
+    @traced("features", arguments=("threshold",))
+    def measureFractionAboveThreshold(self, threshold):
+        # -----------------------------------------------------------------
+        # Fraction of events of last acquisition with amplitude above
+        # threshold (mean of the channels in use); the wave files are
+        # written again by every try of the search, so caching them would
+        # only add the hash and the table of a file never read again.
+        # -----------------------------------------------------------------
+        fractions = []
+
+        for channel in self.getChannelsInUse():
+            features = self.spmtControllerObj.getWaveFeatures(self.spmtControllerObj.waveOriginFileName % channel, cached=False)
+
+            if ((features is not None) and (len(features["amplitude"]) > 0)):
+                fractions.append(float((features["amplitude"] > threshold).mean()))
+
+        if (not fractions):
+            return None
+
+        return sum(fractions) / len(fractions)
+
+    def getChannelsInUse(self):
+        if (self.numberOfChannels > 1):
+            return list(range(self.numberOfChannels))
+
+        return [self.channelNumber]
+
+    # ----------------------------------------------------------------
+    def publishTable(self, columns, channels):
+        # -----------------------------------------------------------------
+        # "columns" is {column: values}, values in the order of "channels";
+        # the whole table goes to the UI in one signal, however many cells
+        # changed.
+        # -----------------------------------------------------------------
+        for column, values in columns.items():
+            for channel, value in zip(channels, values):
+                try:
+                    self.tableValues[channel][column] = round(float(value), 3)
+                except (TypeError, ValueError):
+                    self.tableValues[channel][column] = None
+
+        self.updateTable.emit([list(row) for row in self.tableValues])
+
+    def clearTable(self):
+        self.tableValues = [[None] * len(TABLE_COLUMNS) for channel in range(MAXIMUM_CHANNELS)]
+        self.updateTable.emit([list(row) for row in self.tableValues])
+
+    # ----------------------------------------------------------------
+    @traced("acquisition", arguments=("frequency", "numberOfPulses"))
+    def acquireToPrecision(self, frequency, numberOfPulses, targets=[], **histogramParameters):
+        # -----------------------------------------------------------------
+        # Each target is (statistic, quantity, threshold, precision), as in
+        # OnlineHistogram.isConverged; targets with precision 0.0 are
+        # ignored. Without targets, the fixed number of pulses is triggered.
+        # -----------------------------------------------------------------
+        targets = [target for target in targets if (target[3] > 0.0)]
+
+        if (not targets):
+            triggered = self.spmtControllerObj.callWaveDumpAndTriggerDigitizer(frequency=frequency, numberOfPulses=numberOfPulses)
+            self.recordResult("pulsesTriggered", self.spmtControllerObj.pulsesTriggered)
+            return triggered
+
+        accumulator = OnlineAccumulator(waveFileName=self.spmtControllerObj.waveOriginFileName, numberOfChannels=self.numberOfChannels, channelNumber=self.channelNumber, **histogramParameters)
+
+        def stopCondition():
+            accumulator.update()
+
+            for statistic, quantity, threshold, precision in targets:
+                if (not accumulator.isConverged(precision, quantity=quantity, threshold=threshold, statistic=statistic)):
+                    return False
+
+            return True
+
+        # At least ~10 checks in the whole acquisition
+        blockPulses = max(min(self.onlineBlockPulses, numberOfPulses // 10), 1)
+
+        triggered = self.spmtControllerObj.callWaveDumpAndTriggerDigitizer(frequency=frequency, numberOfPulses=numberOfPulses, blockPulses=blockPulses, stopCondition=stopCondition)
+
+        self.informExecution.emit("Acquisition stopped after %d of %d pulses..." % (self.spmtControllerObj.pulsesTriggered, numberOfPulses))
+        self.recordResult("pulsesTriggered", self.spmtControllerObj.pulsesTriggered)
+
+        return triggered
+
+
+    def calcNewVoltageLED(self, voltageLED, a, b, c, factor1, factor2):
+        if ((a == 2) and (c != 1)):
+            voltageLED = voltageLED + ((factor1) / (factor2**b))
+
+        if ((a == 2) and (c == 1)):
+            b += 1
             voltageLED = voltageLED + ((factor1) / (factor2**b))
 
         if ((a == 1) and (c != 2)):
             voltageLED = voltageLED - ((factor1) / (factor2**b))
 
-        if ((a == 1) and (c != 2)):
+        if ((a == 1) and (c == 2)):
+            b += 1
             voltageLED = voltageLED - ((factor1) / (factor2**b))
 
         return voltageLED, a, b, c
@@ -1136,36 +2089,297 @@ class Orchestrator(QObject):
 
     # ----------------------------------------------------------------
     def abortProgram(self, executionStep="unknow"):
+        # Waits of the cleanup are not cancellable, the voltages must really be turned off
+        with shielded():
+            self.aborted = True
+            self.stopHVMonitor()
+            cancelled = ((self.cancellationToken is not None) and self.cancellationToken.isCancelled())
+
+            # Waits of the run and of its analyses in background stop (an analysis could be waiting forever for a result)
+            if ((self.cancellationToken is not None) and (not cancelled)):
+                self.cancellationToken.cancel("aborted")
+
+            if (self.analysisScheduler):
+                self.analysisScheduler.shutdown()
+
+            if (cancelled and self.hvAlarm):
+                message = "HV alarm when %s: %s." % (executionStep, self.hvAlarm)
+            elif (cancelled):
+                message = "Run %s when %s." % (self.cancellationToken.reason, executionStep)
+            else:
+                message = "Error when %s." % executionStep
+
             print("----------------------------------------------------------------")
-            print("Error when %s.  Aborting the program..." % (executionStep))
+            print("%s  Aborting the program..." % message)
             print("----------------------------------------------------------------")
             self.informExecution.emit("----------------------------------------------------------------")
-            self.informExecution.emit("Error when %s.  Aborting the program..." % (executionStep))
+            self.informExecution.emit("%s  Aborting the program..." % message)
             # Reset buttons status
             self.resetButtons.emit()
+            # Register the failure (and the failed phase) in catalog
+            self.finishCatalogRun(status=("cancelled" if (cancelled and (not self.hvAlarm)) else "aborted"), message=message)
 
             if (self.spmtControllerObj):
+                if (self.spmtControllerObj.waveDumpProcess and (self.spmtControllerObj.waveDumpProcess.poll() is None)):
+                    # Acquisition could be in progress
+                    self.spmtControllerObj.killWaveDump()
+
                 # Turn the voltages off...
                 self.spmtControllerObj.setVoltageToAllChannels(voltage=0)
                 # Close connection, if any
                 self.spmtControllerObj.closeConnection()
 
 
+    # ----------------------------------------------------------------
+    def getPhases(self):
+        # -----------------------------------------------------------------
+        # Sequence of phases: (name, method, repeat on resume).
+        # Phases that turn on and check the HV are always executed, even
+        # when resuming, because voltages are turned off on abort.
+        # -----------------------------------------------------------------
+        return [("initialVoltages", self.runPhaseInitialVoltages, True),
+                ("monitors",        self.runPhaseMonitors,        True),
+                ("darkCount",       self.runPhaseDarkCount,       False),
+                ("intenseLED",      self.runPhaseIntenseLED,      False),
+                ("lowLED",          self.runPhaseLowLED,          False),
+                ("linearity",       self.runPhaseLinearity,       False),
+                ("shutdown",        self.runPhaseShutdown,        True)]
+
+
     """
     Execute()
     """
-    def executeProgram(self):
+    def executeProgram(self, resumeFrom=None):
+        # Two runs must never send commands to the same Linduino
+        portLock = getSerialPortLock(self.linduinoPort)
+
+        if (not portLock.acquire(blocking=False)):
+            print("Port %s is in use by another run..." % self.linduinoPort)
+            self.informExecution.emit("Port %s is in use by another run..." % self.linduinoPort)
+            self.resetButtons.emit()
+            return -1
+
+        # Every wait of this thread (and of the analyses it submits) stops when the token is cancelled
+        self.cancellationToken = CancellationToken()
+        self.aborted = False
+        self.hvAlarm = None
+        setCurrentToken(self.cancellationToken)
+
+        if (self.traceRun):
+            tracer.start()
+
+        try:
+            with tracer.span("executeProgram", "run", resumeFrom=resumeFrom):
+                return self.__executeProgram(resumeFrom=resumeFrom)
+        except RunCancelled:
+            if (not self.aborted):
+                self.abortProgram(executionStep=(self.currentPhase or "starting"))
+
+            if (self.analysisScheduler):
+                self.analysisScheduler.shutdown()
+
+            return -1
+        finally:
+            self.stopHVMonitor()
+
+            if (self.traceRun):
+                self.saveTrace()
+
+            setCurrentToken(None)
+            self.cancellationToken = None
+            portLock.release()
+
+
+    def cancel(self, reason="cancelled by operator"):
+        # Called from any thread; the run stops at its next wait and turns the voltages off itself
+        token = self.cancellationToken
+
+        if (token is None):
+            return False
+
+        token.cancel(reason)
+
+        return True
+
+
+    def isRunning(self):
+        return (self.cancellationToken is not None)
+
+
+    def rampVoltagesOfModules(self, voltagesArray):
+        # -----------------------------------------------------------------
+        # Set the voltages of all channels in use, starting from the DAC
+        # corrections learned in previous runs of each HV module (S/N)
+        # and trimming them in closed loop; the corrections of the
+        # channels that reached "maxVoltageError" are kept for next runs.
+        # -----------------------------------------------------------------
+        if (self.dacTrimIterations <= 0):
+            return self.spmtControllerObj.rampVoltages(voltagesArray=voltagesArray, maxError=self.maxVoltageError, timeout=self.hvSettlingTimeout)
+
+        correctionCache = DACCorrectionCache(self.dacCorrectionFileName)
+        serialNumbers = self.channelState.state["serialNumber"].tolist()
+
+        if (not self.channelState.state["dacCorrection"].any()):
+            self.channelState.state["dacCorrection"] = correctionCache.getCorrections(serialNumbers)
+
+        listOfVoltagesRead, settled, corrections = self.spmtControllerObj.trimVoltages(voltagesArray=voltagesArray, corrections=self.channelState.state["dacCorrection"],
+                                                                                       maxError=self.maxVoltageError, timeout=self.hvSettlingTimeout,
+                                                                                       maximumIterations=self.dacTrimIterations,
+                                                                                       maximumCorrection=correctionCache.maximumCorrection)
+
+        if (listOfVoltagesRead is None):
+            return None, settled
+
+        self.channelState.state["dacCorrection"] = corrections
+
+        for serialNumber, correction, settledChannel in zip(serialNumbers, corrections, settled):
+            if (settledChannel):
+                correctionCache.setCorrection(serialNumber, correction)
+
+        correctionCache.save()
+        self.informExecution.emit("DAC corrections: %s..." % ", ".join("%.3f" % correction for correction in corrections))
+
+        return listOfVoltagesRead, settled
+
+
+    def registerHVCalibration(self):
+        # Coefficients of this run in the store of calibrations (new modules, or new coefficients typed by the operator)
+        calibrationStore = HVCalibrationStore(self.hvCalibrationFileName)
+
+        for index in range(len(self.channelState)):
+            model, serialNumber = self.channelState.getLabel(index)
+            calibrationStore.register(model, serialNumber, self.channelState.state["a"][index], self.channelState.state["b"][index])
+
+        calibrationStore.save()
+
+
+    def useRefittedHVCalibration(self):
+        # Refitted coefficients of the HV modules only by choice of the operator, with the scale of VMon verified
+        return (self.applyHVRefit and self.vMonScaleVerified)
+
+
+    def updateHVCalibration(self, voltagesArray, monitorArray):
+        # -----------------------------------------------------------------
+        # Refit the calibration of each HV module with the input read by
+        # MUX and its output (VMon); a module drifting since its first fit
+        # is informed, the run goes on (monitors have been validated).
+        # -----------------------------------------------------------------
+        try:
+            calibrationStore = HVCalibrationStore(self.hvCalibrationFileName)
+            iMon, vMon = parseMonitors(monitorArray)
+
+            for index in range(len(self.channelState)):
+                model, serialNumber = self.channelState.getLabel(index)
+                calibrationStore.addPoints(model, serialNumber, [voltagesArray[index]], [vMon[index] * self.vMonOutputFactor])
+
+                if (calibrationStore.isDrifting(model, serialNumber)):
+                    self.informExecution.emit("HV module %s S/N %s is drifting from its calibration (now a = %.4f, b = %.4f)..." %
+                                              ((model, serialNumber) + calibrationStore.getFit(model, serialNumber)))
+
+            calibrationStore.save()
+        except:
+            print("Exception when updating HV calibration...")
+
+
+    def startHVMonitor(self, voltagesArray):
+        if (self.hvMonitorInterval <= 0):
+            return
+
+        self.hvAlarm = None
+        self.hvMonitor = HVMonitor(self.spmtControllerObj, channels=self.getChannelsInUse(), voltagesArray=voltagesArray,
+                                   vFactor=self.voltageFactor, iFactor=self.currentFactor, maxVMonError=self.maxVMonError, maxIMonError=self.maxIMonError,
+                                   interval=self.hvMonitorInterval, alarmSamples=self.hvMonitorAlarmSamples,
+                                   onSample=lambda channels, iMon, vMon: self.publishTable({TABLE_VMON: vMon, TABLE_IMON: iMon}, channels=channels),
+                                   onAlarm=self.alarmHVMonitor)
+        self.hvMonitor.start(self.cancellationToken)
+        # Linduino is busy during a trigger: while monitoring, trigger in blocks and sample between them when a sample is due
+        self.spmtControllerObj.monitorInterval = self.hvMonitorInterval
+        self.spmtControllerObj.betweenBlocks = self.hvMonitor.sampleIfDue
+        self.informExecution.emit("Monitoring IMon and VMon every %.0f s..." % self.hvMonitorInterval)
+
+
+    def alarmHVMonitor(self, message):
+        # Called by the thread of the monitor: the run stops at its next wait, as when cancelled
+        self.hvAlarm = message
+        print("HV alarm: %s" % message)
+        self.informExecution.emit("HV alarm: %s" % message)
+        self.cancel(reason="stopped by HV alarm")
+
+
+    def stopHVMonitor(self):
+        # Stop sampling and keep the time series with the run
+        if (self.hvMonitor is None):
+            return
+
+        hvMonitor, self.hvMonitor = self.hvMonitor, None
+        self.spmtControllerObj.monitorInterval = None
+        self.spmtControllerObj.betweenBlocks = None
+        hvMonitor.stop()
+
+        if (self.folderName and self.subFolderName and os.path.isdir("./%s/%s" % (self.folderName, self.subFolderName)) and hvMonitor.buffer.count):
+            fileName = "./%s/%s/HV_monitor_%s.txt" % (self.folderName, self.subFolderName, time.strftime("%Hh%Mm%Ss"))
+
+            if (hvMonitor.buffer.save(fileName, hvMonitor.channels)):
+                self.informExecution.emit("%d samples of IMon and VMon saved in %s..." % (hvMonitor.buffer.count, fileName))
+
+
+    def saveTrace(self):
+        # Analyses still running in background are not in the file
+        tracer.stop()
+
+        if (self.folderName and self.subFolderName and os.path.isdir("./%s/%s" % (self.folderName, self.subFolderName))):
+            fileName = "./%s/%s/%s" % (self.folderName, self.subFolderName, time.strftime(TRACE_FILE_FORMAT))
+
+            if (tracer.save(fileName)):
+                self.informExecution.emit("Timeline of execution saved in %s..." % fileName)
+
+
+    def __executeProgram(self, resumeFrom=None):
         print("----------------------------------------------------------------")
         print("-:- Start of program -:-")
         print("----------------------------------------------------------------")
-        # Update names of folder and sub-folder, and create them if doesn't exist
-        self.folderName = time.strftime(FORMAT_FOLDER)
-        self.subFolderName = time.strftime(FORMAT_SUBFOLDER)
+        completedPhases = []
+        self.clearTable()
+
+        if (resumeFrom):
+            # Restore configuration, derived values and folders of the interrupted run
+            self.checkpoint = RunCheckpoint(resumeFrom)
+
+            if (not self.checkpoint.load()):
+                self.abortProgram(executionStep="loading checkpoint %s" % resumeFrom)
+                return -1
+
+            self.setConfiguration(self.checkpoint.configuration)
+            self.runState = dict(self.checkpoint.state)
+            self.folderName = self.checkpoint.folderName
+            self.subFolderName = self.checkpoint.subFolderName
+            completedPhases = list(self.checkpoint.completedPhases)
+
+            if ("highIntensVoltageLED_1" in self.runState):
+                self.highIntensVoltageLED_1 = self.runState["highIntensVoltageLED_1"]
+
+            print("Resuming run of %s/%s after phases: %s" % (self.folderName, self.subFolderName, ", ".join(completedPhases)))
+            self.informExecution.emit("Resuming run of %s/%s..." % (self.folderName, self.subFolderName))
+        else:
+            # Update names of folder and sub-folder, and create them if doesn't exist
+            self.folderName = time.strftime(FORMAT_FOLDER)
+            self.subFolderName = time.strftime(FORMAT_SUBFOLDER)
+            self.runState = {}
+
+        # Analyses of this run in background
+        self.analysisScheduler = AnalysisScheduler()
 
         os.makedirs("./%s/%s" % (self.folderName, self.subFolderName), exist_ok=True)
 
-        # Try to reconnect... Close connection, if any
-        self.spmtControllerObj.reconnect()
+        if (not resumeFrom):
+            self.checkpoint = RunCheckpoint("./%s/%s/%s" % (self.folderName, self.subFolderName, CHECKPOINT_FILE_NAME))
+            self.checkpoint.start(self.getConfiguration(), self.folderName, self.subFolderName)
+
+        # Register the run in catalog
+        self.startCatalogRun()
+
+        # Connect to Linduino, or wait for the connection opened in background (UI)
+        self.spmtControllerObj.connect()
 
         # Only for commissioning
         self.spmtControllerObj.setDebug(self.activeDebugging)
@@ -1176,6 +2390,57 @@ class Orchestrator(QObject):
         self.spmtControllerObj.setChannelNumber(self.channelNumber)
         print("Setting the channel %d as default." % (self.channelNumber))
 
+        for name, runPhase, repeatOnResume in self.getPhases():
+            if ((name in completedPhases) and (not repeatOnResume)):
+                print("Skipping phase %s, already completed..." % name)
+                self.informExecution.emit("Skipping phase %s (checkpoint)..." % name)
+                continue
+
+            checkCancelled()
+            self.beginPhase(name)
+
+            if (not runPhase()):
+                # Program was already aborted by the phase; keep where it stopped
+                self.checkpoint.fail(name)
+                return -1
+
+            self.endPhase()
+            self.checkpoint.complete(name, self.runState)
+
+        # --------------------------------------------------------------------
+        # Wait for the analyses still running in background
+        failedAnalyses = [name for name, processed in self.analysisScheduler.joinAll().items() if (not processed)]
+
+        for name in failedAnalyses:
+            print("Analysis %s has failed!" % name)
+            self.informExecution.emit("Analysis %s has failed!" % name)
+            # Its data must be acquired again when resuming
+            self.checkpoint.reopen(ANALYSIS_PHASES.get(name, name))
+
+        if (failedAnalyses):
+            self.abortProgram(executionStep="processing %s in background" % ", ".join(failedAnalyses))
+            self.checkpoint.fail(ANALYSIS_PHASES.get(failedAnalyses[0], failedAnalyses[0]))
+            return -1
+
+        self.analysisScheduler.shutdown()
+
+        print("----------------------------------------------------------------")
+        print("-:- End of program -:-")
+        print("----------------------------------------------------------------")
+        # --------------------------------------------------------------------
+        # End
+        self.informExecution.emit("----------------------------------------------------------------")
+        self.informExecution.emit("End of program!")
+        self.finishCatalogRun(status="done")
+        self.spmtControllerObj.closeConnection()
+
+        return 0
+
+
+    # ----------------------------------------------------------------
+    # Phase: set initial voltages, read them by MUX and validate
+    # ----------------------------------------------------------------
+    def runPhaseInitialVoltages(self):
         print("----------------------------------------------------------------")
         print("-:- Set initial voltages -:-")
         print("----------------------------------------------------------------")
@@ -1189,39 +2454,33 @@ class Orchestrator(QObject):
         #### self.voltageToSet = float(self.initialVoltage) / 840.0
         #### setNewVoltages = self.spmtControllerObj.setVoltageToAllChannelsByArray(voltagesArray=[i / 2 for i in listOfNewVoltages])
 
-        listOfVoltages = []
-
-        for hvDevice in self.highVoltageIDs:
-            # --------------------------------------------
-            # Each cell of the array has:
-            # 0. HV model
-            # 1. S/N
-            # 2. f(x) = a.x + b (a)
-            # 3. f(x) = a.x + b (b)
-            # --------------------------------------------
-            listOfVoltages.append(self.__calcHighVoltageInput(aFactor=hvDevice[2], bFactor=hvDevice[3], output=float(self.initialVoltage)))
+        # Calibration (f(x) = a.x + b) of each HV module, then the input of all of them at once
+        self.channelState = ChannelState(self.getChannelsInUse(), self.highVoltageIDs)
+        listOfVoltages = self.channelState.calculateSetpoints(self.initialVoltage)
+        self.registerHVCalibration()
 
         # We send half of desired voltage to Linduino (because between 0.0V and 10.0V it automatically multiply
         # the input by 2
         #### self.voltageToSet /= 2
         #self.spmtControllerObj.setVoltageToAllChannels(voltage=self.voltageToSet)
-        self.spmtControllerObj.setVoltageToAllChannelsByArray(voltagesArray=[i / 2 for i in listOfVoltages])
-        self.informExecution.emit("Setting initial voltages to: %.3f..." % float(self.voltageToSet))
+        self.informExecution.emit("Setting initial voltages to: %s..." % ", ".join("%.3f" % voltage for voltage in listOfVoltages))
 
         print("----------------------------------------------------------------")
         print("-:- Enable MUX and get current Voltages -:-")
         print("----------------------------------------------------------------")
         # --------------------------------------------------------------------
-        # Enable MUX and check voltages...
-        listOfVoltagesRead = self.spmtControllerObj.setMuxToAllChannels(enable=True)
+        # Set all channels together, then read them by MUX until they have settled...
         self.informExecution.emit("Getting voltages from MUX...")
+        listOfVoltagesRead, settled = self.rampVoltagesOfModules(listOfVoltages)
+
+        if (listOfVoltagesRead is None):
+            self.abortProgram(executionStep="setting initial voltages")
+            return False
+
+        self.recordMeasurements("voltage", listOfVoltagesRead, channels=self.getChannelsInUse())
 
         # Emit signal to inform UI table...
-        if (self.numberOfChannels > 1):
-            for index, voltage in enumerate(listOfVoltagesRead):
-                self.fillTable.emit(index, 0, str(round(float(voltage), 3)))
-        else:
-            self.fillTable.emit(self.channelNumber, 0, str(round(float(listOfVoltagesRead[0]), 3)))
+        self.publishTable({TABLE_VSET: listOfVoltagesRead}, channels=self.getChannelsInUse())
 
         print("----------------------------------------------------------------")
         print("-:- Disble MUX -:-")
@@ -1237,35 +2496,49 @@ class Orchestrator(QObject):
         # --------------------------------------------------------------------
         # Validate read voltages
         self.informExecution.emit("Validating voltages...")
-        validVoltages = self.spmtControllerObj.validateDACVoltages(voltagesArray=listOfVoltagesRead, reference=self.voltageToSet*2, maxError=self.maxVoltageError)
+        validVoltages = self.spmtControllerObj.validateDACVoltages(voltagesArray=listOfVoltagesRead, reference=listOfVoltages, maxError=self.maxVoltageError)
+        self.channelState.setReadback(listOfVoltagesRead, validVoltages)
 
-        if (not validVoltages):
+        if (not validVoltages.all()):
+            self.recordFileContent("errorDAC", self.spmtControllerObj.errorDacFileName)
             self.abortProgram(executionStep="validating DAC voltages")
-            return -1
+            return False
         else:
             print("Voltages OK!")
             self.informExecution.emit("Voltages OK!")
 
+        # Keep the voltages for next phases (and checkpoint)
+        self.runState["listOfVoltages"] = listOfVoltages
+        self.runState["listOfVoltagesRead"] = listOfVoltagesRead
+
+        return True
+
+
+    # ----------------------------------------------------------------
+    # Phase: read and validate IMon and VMon
+    # ----------------------------------------------------------------
+    def runPhaseMonitors(self):
         print("----------------------------------------------------------------")
         print("-:- Read IMon and VMon -:-")
         print("----------------------------------------------------------------")
         # --------------------------------------------------------------------
         # Read IMon and VMon...
+        listOfVoltagesRead = self.runState["listOfVoltagesRead"]
         self.informExecution.emit("Reading monitors (IMon and VMon)...")
-        listOfMonitorsRead = self.spmtControllerObj.readMonitorsOfAllChannels()
+        # Poll until VMon of every channel has settled (or timeout), then validate the last values read
+        listOfMonitorsRead, settled = self.spmtControllerObj.waitMonitorsSettling(channels=self.getChannelsInUse(), voltagesArray=listOfVoltagesRead,
+                                                                                  vFactor=self.voltageFactor, maxVMonError=self.maxVMonError,
+                                                                                  timeout=self.hvSettlingTimeout)
 
-        # Emit signal to inform UI table...
-        if (self.numberOfChannels > 1):
-            for index, (monitor, voltage) in enumerate(zip(listOfMonitorsRead, listOfVoltagesRead)):
-                # VMon
-                self.fillTable.emit(index, 1, str(round(float(monitor[1]), 3)))
-                # IMon
-                self.fillTable.emit(index, 2, str(round(float(monitor[0]), 3)))
-        else:
-            # VMon
-            self.fillTable.emit(self.channelNumber, 1, str(round(float(listOfMonitorsRead[0][1]), 3)))
-            # IMon
-            self.fillTable.emit(self.channelNumber, 2, str(round(float(listOfMonitorsRead[0][0]), 3)))            
+        try:
+            self.recordMeasurements("iMon", [monitor[0] for monitor in listOfMonitorsRead], channels=self.getChannelsInUse())
+            self.recordMeasurements("vMon", [monitor[1] for monitor in listOfMonitorsRead], channels=self.getChannelsInUse())
+        except:
+            print("Exception when storing monitors in catalog...")
+
+        # Emit signal to inform UI table (VMon and IMon in one update)...
+        self.publishTable({TABLE_VMON: [monitor[1] for monitor in listOfMonitorsRead],
+                           TABLE_IMON: [monitor[0] for monitor in listOfMonitorsRead]}, channels=self.getChannelsInUse())
 
         print("----------------------------------------------------------------")
         print("-:- Validate IMon and VMon -:-")
@@ -1273,15 +2546,31 @@ class Orchestrator(QObject):
         # --------------------------------------------------------------------
         # Validate IMon and VMon...
         self.informExecution.emit("Validating monitors (IMon and VMon)...")
-        validMonitor = self.spmtControllerObj.validateModuleMonitor(voltagesArray=listOfVoltagesRead, monitorArray=listOfMonitorsRead, vFactor=self.voltageFactor, iFactor=self.currentFactor, maxVMonError=self.maxVMonError, maxIMonError=self.maxIMonError)
+        validIMon, validVMon = self.spmtControllerObj.validateModuleMonitor(voltagesArray=listOfVoltagesRead, monitorArray=listOfMonitorsRead, vFactor=self.voltageFactor, iFactor=self.currentFactor, maxVMonError=self.maxVMonError, maxIMonError=self.maxIMonError)
+        self.channelState.setMonitors(listOfMonitorsRead, validIMon, validVMon)
 
-        if (not validMonitor):
+        if (not (validIMon & validVMon).all()):
+            self.recordFileContent("errorModule", self.spmtControllerObj.errorModuleFileName)
+            self.recordFileContent("errorPMT", self.spmtControllerObj.errorPmtFileName)
             self.abortProgram(executionStep="validating IMon (PMT) and VMon (module HV)")
-            return -1
+            return False
         else:
             print("IMon and VMon OK!")
             self.informExecution.emit("IMon and VMon OK!")
 
+        self.runState["listOfMonitorsRead"] = listOfMonitorsRead
+        self.updateHVCalibration(listOfVoltagesRead, listOfMonitorsRead)
+
+        # From now on, keep watching the HV during the whole run
+        self.startHVMonitor(listOfVoltagesRead)
+
+        return True
+
+
+    # ----------------------------------------------------------------
+    # Phase: dark count
+    # ----------------------------------------------------------------
+    def runPhaseDarkCount(self):
         print("----------------------------------------------------------------")
         print("-:- Dark count -:-")
         print("----------------------------------------------------------------")
@@ -1289,38 +2578,77 @@ class Orchestrator(QObject):
         # Dark count...
         # LED_1 is connected to channel 8, so, simply set voltage output to that channel
         print("LED", self.singlePhVoltageLED_1)
-        self.spmtControllerObj.setVoltageToOneChannel(channel=self.channelOfLED_1, voltage=(self.singlePhVoltageLED_1/2))        
+        self.spmtControllerObj.setVoltageToOneChannel(channel=self.channelOfLED_1, voltage=toLinduinoUnits(self.singlePhVoltageLED_1))        
         self.informExecution.emit("Acquiring and processing dark count...")
-        triggered = self.spmtControllerObj.callWaveDumpAndTriggerDigitizer(frequency=self.darkCountFreq, numberOfPulses=self.darkCountPulses)
+
+        # Histogram while acquiring and stop triggering once the dark count rate (and charge peak) are precise enough
+        targets = [("peak", "charge", self.onlineChargeThreshold, self.darkCountPeakPrecision)]
+
+        if (self.adaptiveAcquisition):
+            targets.append(("rate", "amplitude", self.darkCountAmplitudeThreshold, self.darkCountRatePrecision))
+
+        triggered = self.acquireToPrecision(frequency=self.darkCountFreq, numberOfPulses=self.darkCountPulses, targets=targets)
 
         if (triggered):
             # Perform a backup of wave files...
-            for index in range(self.numberOfChannels):
-                if (os.path.exists("./wave_%s.txt" % str(index))):
-                    shutil.copyfile("./wave_%s.txt" % str(index),
-                                    "./%s/%s/%s_SN%s_wave_%s.txt" % (self.folderName, 
-                                                                     self.subFolderName, 
-                                                                     self.highVoltageIDs[index][0], 
-                                                                     self.highVoltageIDs[index][1], 
-                                                                     str(index)))
+            with tracer.span("backupDarkCountWaveFiles", "files"):
+                for index in range(self.numberOfChannels):
+                    if (os.path.exists("./wave_%s.txt" % str(index))):
+                        shutil.copyfile("./wave_%s.txt" % str(index),
+                                        "./%s/%s/%s_SN%s_wave_%s.txt" % (self.folderName, 
+                                                                         self.subFolderName, 
+                                                                         self.channelState.state["model"][index], 
+                                                                         self.channelState.state["serialNumber"][index], 
+                                                                         str(index)))
+
             # Then process (Dark Count) output files of WaveDump
-            self.spmtControllerObj.callDarkCountFauthProcess()
-            for index in range(self.numberOfChannels):
-
-                if (os.path.exists("./10perc_wave_%s_full.pdf" % str(index))):
-                    shutil.copyfile("./10perc_wave_%s_full.pdf" % str(index),
-                                    "./%s/%s/%s_SN%s_10perc_wave_%s_full.pdf" % (self.folderName, 
-                                                                     self.subFolderName, 
-                                                                     self.highVoltageIDs[index][0], 
-                                                                     self.highVoltageIDs[index][1], 
-                                                                     str(index)))
-            # Perform a backup of PDF files...
+            if (self.overlapAnalyses):
+                # Nothing in next phases depends on the dark count analysis, so it runs in background
+                # with its own copy of the wave files, meanwhile the next acquisitions are performed
+                workDir = os.path.join(ANALYSIS_FOLDER, "darkCount")
+                self.spmtControllerObj.moveWaveFilesToFolder(workDir)
+                self.analysisScheduler.submit("darkCount", self.analyseDarkCount, workDir=workDir)
+                self.informExecution.emit("Processing dark count in background...")
+            else:
+                self.analyseDarkCount()
         else:
             self.abortProgram(executionStep="triggering digitizer and running WaveDump")
-            return -1
+            return False
+
+        self.waitOperator("Press <Enter> to continue...")
+
+        return True
+
+
+    @traced("analysis", arguments=("workDir",))
+    def analyseDarkCount(self, workDir=None):
+        processed = self.spmtControllerObj.callDarkCountFauthProcess(workDir=workDir)
+        folder = workDir or "."
+
+        if (workDir and os.path.exists(os.path.join(workDir, self.spmtControllerObj.darkCountFauthFileName))):
+            # Result file is expected in the current folder
+            shutil.copyfile(os.path.join(workDir, self.spmtControllerObj.darkCountFauthFileName), self.spmtControllerObj.darkCountFauthFileName)
+
+        self.recordFileContent("darkCountGaussParameters", os.path.join(folder, self.spmtControllerObj.darkCountFauthFileName), phase="darkCount")
+
+        # Perform a backup of PDF files...
+        for index in range(self.numberOfChannels):
+
+            if (os.path.exists("%s/10perc_wave_%s_full.pdf" % (folder, str(index)))):
+                shutil.copyfile("%s/10perc_wave_%s_full.pdf" % (folder, str(index)),
+                                "./%s/%s/%s_SN%s_10perc_wave_%s_full.pdf" % (self.folderName, 
+                                                                 self.subFolderName, 
+                                                                 self.channelState.state["model"][index], 
+                                                                 self.channelState.state["serialNumber"][index], 
+                                                                 str(index)))
 
-        input("Press <Enter> to continue...")
+        return processed
 
+
+    # ----------------------------------------------------------------
+    # Phase: search the voltage of intense LED and acquire
+    # ----------------------------------------------------------------
+    def runPhaseIntenseLED(self):
         # # --------------------------------------------------------------------
         # # Dark count...
         # self.informExecution.emit("Acquiring and processing dark count...")
@@ -1401,7 +2729,7 @@ class Orchestrator(QObject):
         #     self.abortProgram(executionStep="triggering digitizer and running WaveDump to acquire waves at 10 percent")
         #     return -1
 
-        input("Press <Enter> to collect Intense LED...")
+        self.waitOperator("Press <Enter> to collect Intense LED...")
 
         print("----------------------------------------------------------------")
         print("-:- Intense LED light -:-")
@@ -1419,15 +2747,23 @@ class Orchestrator(QObject):
         maximumTries = 10
         currentTry = 0
 
+        # Model of LED response, seeded by the calibration of previous runs
+        search = None
+
+        if (self.modelBasedLEDSearch):
+            calibration = LEDCalibration(self.ledCalibrationFileName)
+            search = LEDIntensitySearch(led=self.channelOfLED_1, initialVoltage=self.highIntensVoltageLED_1, calibration=calibration, targetFraction=self.highIntensTargetFraction)
+            self.highIntensVoltageLED_1 = search.getInitialVoltage()
+
         while (True):
             # Inform details if debugging
             #if (self.activeDebugging):
             print("---------")
-            print("Setting voltage %.3f to LED 1..." % (self.highIntensVoltageLED_1/2))
+            print("Setting voltage %.3f to LED 1..." % toLinduinoUnits(self.highIntensVoltageLED_1))
             print("---------")
 
             # LED_1 is connected to channel 8, so, simply set voltage output to that channel
-            self.spmtControllerObj.setVoltageToOneChannel(channel=self.channelOfLED_1, voltage=(self.highIntensVoltageLED_1/2))
+            self.spmtControllerObj.setVoltageToOneChannel(channel=self.channelOfLED_1, voltage=toLinduinoUnits(self.highIntensVoltageLED_1))
 
             # ----------------------------------------------------------------
             # Trigger CAEN digitizer running WaveDump
@@ -1438,18 +2774,28 @@ class Orchestrator(QObject):
                 self.spmtControllerObj.callSearchProcess()
             else:
                 self.abortProgram(executionStep="triggering digitizer and running WaveDump during intense LED measuring")
-                return -1
+                return False
 
             # ----------------------------------------------------------------
             # Logic to incread/decrease LED_1 intensity
             a = self.spmtControllerObj.readSearchResultContent()
 
+            if (search):
+                fraction = self.measureFractionAboveThreshold(self.highIntensAmplitudeThreshold)
+                search.addMeasurement(self.highIntensVoltageLED_1, fraction, a)
+                self.recordResult("searchIteration", [currentTry, self.highIntensVoltageLED_1, a, fraction])
+            else:
+                self.recordResult("searchIteration", [currentTry, self.highIntensVoltageLED_1, a])
+
             # ---------
             if ((a == 0) or (currentTry >= maximumTries)):
                 break
 
             # ---------
-            self.highIntensVoltageLED_1, a, b, c = self.calcNewVoltageLED(self.highIntensVoltageLED_1, a, b, c, 0.5, 5)
+            if (search and (a in (1, 2))):
+                self.highIntensVoltageLED_1 = search.proposeNextVoltage()
+            else:
+                self.highIntensVoltageLED_1, a, b, c = self.calcNewVoltageLED(self.highIntensVoltageLED_1, a, b, c, 0.5, 5)
 
             # ---------
             c = a
@@ -1457,18 +2803,39 @@ class Orchestrator(QObject):
             # This is for instrumentation only
             currentTry += 1
 
+        if (search):
+            # Keep the points measured (and the accepted one) for next runs
+            calibration.save()
+            self.informExecution.emit("LED 1 tuned to %.3f after %d acquisition(s)..." % (self.highIntensVoltageLED_1, currentTry + 1))
+
         # --------------------------------------------------------------------
         # Acquire new WaveDump files with LED configured with high intensity
-        triggered = self.spmtControllerObj.callWaveDumpAndTriggerDigitizer(frequency=self.highIntensAcqFreq, numberOfPulses=self.highIntensAcqPulses)
+        if (self.adaptiveAcquisition):
+            # Intense light: many photoelectrons per pulse, so a wider charge range
+            triggered = self.acquireToPrecision(frequency=self.highIntensAcqFreq, numberOfPulses=self.highIntensAcqPulses,
+                                                targets=[("peak", "charge", self.onlineChargeThreshold, self.highIntensPeakPrecision)],
+                                                chargeRange=(-500.0, 95500.0), amplitudeRange=(-20.0, 4980.0))
+        else:
+            triggered = self.acquireToPrecision(frequency=self.highIntensAcqFreq, numberOfPulses=self.highIntensAcqPulses)
 
         if (triggered):
+            self.recordResult("highIntensVoltageLED_1", self.highIntensVoltageLED_1)
             # Then rename files for intense LED
             self.spmtControllerObj.renameWaveFilesForIntenseLED()
+            # Tuned voltage of LED 1, to resume without searching again
+            self.runState["highIntensVoltageLED_1"] = self.highIntensVoltageLED_1
         else:
             self.abortProgram(executionStep="triggering digitizer and running WaveDump to acquire waves at intense LED")
-            return -1
+            return False
+
+        return True
 
-        input("Press <Enter> to collect Low LED...")
+
+    # ----------------------------------------------------------------
+    # Phase: low LED light and single photoelectron processing
+    # ----------------------------------------------------------------
+    def runPhaseLowLED(self):
+        self.waitOperator("Press <Enter> to collect Low LED...")
 
         print("----------------------------------------------------------------")
         print("-:- Low LED light -:-")
@@ -1478,36 +2845,53 @@ class Orchestrator(QObject):
         self.informExecution.emit("Acquiring and processing low LED light...")
         # --------------------------------------------------------------------
         # Reset all voltages of operational channels
-        self.spmtControllerObj.setVoltageToAllChannels(voltage=self.lowIntensVoltageLEDs/2)
+        self.spmtControllerObj.setVoltageToAllChannels(voltage=toLinduinoUnits(self.lowIntensVoltageLEDs))
 
         # --------------------------------------------------------------------
         # Store voltages for single photoelectron
-        storedVoltagesPh = self.spmtControllerObj.storeVoltagesForSinglePhotoelectron(voltagesArray=listOfVoltagesRead, voltageLowLED=self.lowIntensVoltageLEDs, voltageFactor=self.lowIntensVoltageFactor)
+        storedVoltagesPh = self.spmtControllerObj.storeVoltagesForSinglePhotoelectron(voltagesArray=self.runState["listOfVoltagesRead"], voltageLowLED=self.lowIntensVoltageLEDs, voltageFactor=self.lowIntensVoltageFactor)
 
         if (not storedVoltagesPh):
             self.abortProgram(executionStep="storing voltages for single photoelectron and low LED")
-            return -1
+            return False
 
         # --------------------------------------------------------------------
         # Acquire new WaveDump files with LED configured with low intensity
-        triggered = self.spmtControllerObj.callWaveDumpAndTriggerDigitizer(frequency=self.lowIntensAcqFreq, numberOfPulses=self.lowIntensAcqPulses)
+        if (self.adaptiveAcquisition):
+            # Single photoelectron peak (Single_ph.exe) is measured from these files
+            triggered = self.acquireToPrecision(frequency=self.lowIntensAcqFreq, numberOfPulses=self.lowIntensAcqPulses,
+                                                targets=[("peak", "charge", self.onlineChargeThreshold, self.lowIntensPeakPrecision)])
+        else:
+            triggered = self.acquireToPrecision(frequency=self.lowIntensAcqFreq, numberOfPulses=self.lowIntensAcqPulses)
 
         if (triggered):
             # Then rename files for low LED
             self.spmtControllerObj.renameWaveFilesForLowLED()
         else:
             self.abortProgram(executionStep="triggering digitizer and running WaveDump to acquire waves at low LED")
-            return -1
+            return False
 
         # --------------------------------------------------------------------
         # Finally, call Single Photoelectron processing
-        processedSingle = self.spmtControllerObj.callSinglePhotoelectronProcess()
+        if (self.overlapAnalyses):
+            # Only the voltages before linearity need its result (gain table), joined there
+            self.analysisScheduler.submit("singlePhotoelectron", self.spmtControllerObj.callSinglePhotoelectronProcess)
+            self.informExecution.emit("Processing single photoelectron in background...")
+        else:
+            processedSingle = self.spmtControllerObj.callSinglePhotoelectronProcess()
 
-        if (not processedSingle):
-            self.abortProgram(executionStep="processing single photoelectron from acquired data")
-            return -1
+            if (not processedSingle):
+                self.abortProgram(executionStep="processing single photoelectron from acquired data")
+                return False
+
+        return True
 
-        input("Press <Enter> to calculate Linearity...")
+
+    # ----------------------------------------------------------------
+    # Phase: linearity
+    # ----------------------------------------------------------------
+    def runPhaseLinearity(self):
+        self.waitOperator("Press <Enter> to calculate Linearity...")
 
         print("----------------------------------------------------------------")
         print("-:- Linearity -:-")
@@ -1519,40 +2903,116 @@ class Orchestrator(QObject):
         # Power off LED_1 (of single photoelectron) which is connected to channel 8, so, simply set "0" voltage output to that channel
         self.spmtControllerObj.setVoltageToOneChannel(channel=self.channelOfLED_1, voltage=0)
 
-        # --------------------------------------------------------------------
-        # Read voltages gain to calculate new voltages to set before linearity procedure...
-        listOfNewVoltages, readVoltagesGain = self.spmtControllerObj.readVoltagesCalculatedBySinglePhotoelectron(voltagesArray=listOfVoltagesRead, voltageFactor=self.linearityVoltageFactor)
-
-        if (not readVoltagesGain):
-            self.abortProgram(executionStep="reading voltages gain calculated by single photoelectron")
-            return -1
-
-        # --------------------------------------------------------------------
-        # Reset all voltages of operational channels (divide each element by 2 before to pass it)
-        setNewVoltages = self.spmtControllerObj.setVoltageToAllChannelsByArray(voltagesArray=[i / 2 for i in listOfNewVoltages])
-
-        if (not setNewVoltages):
-            self.abortProgram(executionStep="setting new voltages before linearity processing")
-            return -1
-
         # --------------------------------------------------------------------
         # Save configuration of linearity processing
         savedConfigLinearity = self.spmtControllerObj.storeLinearityConfiguration(numberOfColpi=self.numberOfColpi, numberOfSteps=self.numberOfSteps)
 
         if (not savedConfigLinearity):
             self.abortProgram(executionStep="saving configuration file with parameters for linearity processing")
-            return -1
+            return False
 
         # --------------------------------------------------------------------
-        # Acquire new WaveDump files meanwhile alternate LED 2 and 3 voltages during desired number of steps
+        # Acquire new WaveDump files meanwhile alternate LED 2 and 3 voltages during desired number of steps;
+        # WaveDump is started while single photoelectron is processed (the digitizer is triggered by the
+        # pulses of Linduino, so nothing is acquired before the first step, after the gain voltages are set)
         startedWaveDump = self.spmtControllerObj.startWaveDumpAcquisition()
         # Call WaveDump program
         startedWaveDump = startedWaveDump and self.spmtControllerObj.callWaveDump()
 
         if (not startedWaveDump):
             self.abortProgram(executionStep="starting WaveDump during linearity data acquisition")
-            return -1
+            return False
+
+        # --------------------------------------------------------------------
+        # Wait for single photoelectron processing (if in background), it calculates the gain table
+        if (self.analysisScheduler.isPending("singlePhotoelectron")):
+            self.informExecution.emit("Waiting for single photoelectron processing...")
+
+        if (self.analysisScheduler.join("singlePhotoelectron") is False):
+            # Acquisition of low LED must be repeated when resuming
+            self.checkpoint.reopen("lowLED")
+            self.abortProgram(executionStep="processing single photoelectron from acquired data")
+            return False
+
+        # --------------------------------------------------------------------
+        # Read voltages gain to calculate new voltages to set before linearity procedure...
+        listOfNewVoltages, readVoltagesGain = self.spmtControllerObj.readVoltagesCalculatedBySinglePhotoelectron(voltagesArray=list(self.runState["listOfVoltagesRead"]), voltageFactor=self.linearityVoltageFactor)
+
+        if (not readVoltagesGain):
+            self.abortProgram(executionStep="reading voltages gain calculated by single photoelectron")
+            return False
+
+        self.recordResult("gainVoltages", listOfNewVoltages)
+        self.runState["listOfNewVoltages"] = listOfNewVoltages
+
+        # --------------------------------------------------------------------
+        # Reset all voltages of operational channels and wait until the HV has settled (MUX and VMon)
+        self.informExecution.emit("Setting gain voltages and waiting the HV to settle...")
+
+        if (self.hvMonitor):
+            self.hvMonitor.setReferences(listOfNewVoltages)
+
+        listOfNewVoltagesRead, settled = self.rampVoltagesOfModules(listOfNewVoltages)
+
+        if ((listOfNewVoltagesRead is None) or (not all(settled))):
+            self.abortProgram(executionStep="setting new voltages before linearity processing")
+            return False
+
+        listOfMonitorsRead, settled = self.spmtControllerObj.waitMonitorsSettling(channels=self.getChannelsInUse(), voltagesArray=listOfNewVoltagesRead,
+                                                                                  vFactor=self.voltageFactor, maxVMonError=self.maxVMonError,
+                                                                                  timeout=self.hvSettlingTimeout)
+
+        if (not all(settled)):
+            self.abortProgram(executionStep="waiting HV to settle before linearity processing")
+            return False
+
+        self.updateHVCalibration(listOfNewVoltagesRead, listOfMonitorsRead)
+
+        if (self.hvMonitor):
+            self.hvMonitor.setReferences(listOfNewVoltagesRead)
+
+        self.recordMeasurements("gainVoltage", listOfNewVoltagesRead, channels=self.getChannelsInUse())
+
+        # --------------------------------------------------------------------
+        # The whole sweep is uploaded to Linduino, which executes it and informs each step;
+        # with a firmware without this command (None), the host executes every step
+        swept = None
+
+        if (self.firmwareLinearitySweep):
+            self.informExecution.emit("Uploading linearity sweep to Linduino...")
+            swept = self.spmtControllerObj.runLinearitySweep(ledChannels=(self.channelOfLED_2, self.channelOfLED_3),
+                                                             initialVoltages=(self.initialVoltageLED_2, self.initialVoltageLED_3),
+                                                             increments=(self.incrementLED_2, self.incrementLED_3),
+                                                             numberOfSteps=self.numberOfSteps, numberOfColpi=self.numberOfColpi,
+                                                             frequency=self.linearityAcqFreq,
+                                                             progress=lambda step: self.informExecution.emit("Linearity step %d of %d..." % (step, self.numberOfSteps)))
+
+        if (swept is None):
+            if (not self.runLinearityStepsOnHost()):
+                return False
+        elif (not swept):
+            self.abortProgram(executionStep="executing linearity sweep in Linduino")
+            return False
 
+        # --------------------------------------------------------------------
+        # Inform WaveDump to stop acquisition and close
+        stopedWaveDump = self.spmtControllerObj.stopWaveDumpAcquisition()
+
+        if (stopedWaveDump):
+            # Finally, call Linearity processing
+            processedLinearity = self.spmtControllerObj.callLinearityProcess()
+
+            if (not processedLinearity):
+                self.abortProgram(executionStep="processing linearity from acquired data")
+                return False
+        else:
+            self.abortProgram(executionStep="stopping WaveDump during linearity data acquisition")
+            return False
+
+        return True
+
+
+    def runLinearityStepsOnHost(self):
         # --------------------------------------------------------------------
         # Repeat acquisition for desired number of steps, recalculating voltages for LEDs 2 and 3
         for step in range(self.numberOfSteps):
@@ -1564,7 +3024,7 @@ class Orchestrator(QObject):
             # (1) Set voltages...
             # --------------------------------------------------------------------
             # LED_2 in channel "9"
-            self.spmtControllerObj.setVoltageToOneChannel(channel=self.channelOfLED_2, voltage=(self.voltageLED_2 / 2))
+            self.spmtControllerObj.setVoltageToOneChannel(channel=self.channelOfLED_2, voltage=toLinduinoUnits(self.voltageLED_2))
             # LED_3 in channel "10"
             self.spmtControllerObj.setVoltageToOneChannel(channel=self.channelOfLED_3, voltage=0)
 
@@ -1578,13 +3038,13 @@ class Orchestrator(QObject):
 
             if (not triggered):
                 self.abortProgram(executionStep="triggering digitizer and running WaveDump to acquire linearity data")
-                return -1
+                return False
 
             # --------------------------------------------------------------------
             # (2) Set voltages...
             # --------------------------------------------------------------------
             # LED_3 in channel "10"
-            self.spmtControllerObj.setVoltageToOneChannel(channel=self.channelOfLED_3, voltage=(self.voltageLED_3 / 2))
+            self.spmtControllerObj.setVoltageToOneChannel(channel=self.channelOfLED_3, voltage=toLinduinoUnits(self.voltageLED_3))
 
             if (self.activeDebugging):
                 print("---------")
@@ -1596,7 +3056,7 @@ class Orchestrator(QObject):
 
             if (not triggered):
                 self.abortProgram(executionStep="triggering digitizer and running WaveDump to acquire linearity data")
-                return -1
+                return False
 
             # --------------------------------------------------------------------
             # (3) Set voltages...
@@ -1614,44 +3074,32 @@ class Orchestrator(QObject):
 
             if (not triggered):
                 self.abortProgram(executionStep="triggering digitizer and running WaveDump to acquire linearity data")
-                return -1
+                return False
 
-        # --------------------------------------------------------------------
-        # Inform WaveDump to stop acquisition and close
-        stopedWaveDump = self.spmtControllerObj.stopWaveDumpAcquisition()
+        return True
 
-        if (stopedWaveDump):
-            # Finally, call Linearity processing
-            processedLinearity = self.spmtControllerObj.callLinearityProcess()
-
-            if (not processedLinearity):
-                self.abortProgram(executionStep="processing linearity from acquired data")
-                return -1
-        else:
-            self.abortProgram(executionStep="stopping WaveDump during linearity data acquisition")
-            return -1
 
+    # ----------------------------------------------------------------
+    # Phase: turn the voltages off
+    # ----------------------------------------------------------------
+    def runPhaseShutdown(self):
         print("----------------------------------------------------------------")
         print("-:- Turn the voltages off -:-")
         print("----------------------------------------------------------------")
         # --------------------------------------------------------------------
-        # Turn the voltages off...
+        # Turn the voltages off (no more monitoring, voltages will be far from references)...
+        self.stopHVMonitor()
         self.informExecution.emit("Turning off the voltages...")
         self.spmtControllerObj.setVoltageToAllChannels(voltage=0)
 
-        print("----------------------------------------------------------------")
-        print("-:- End of program -:-")
-        print("----------------------------------------------------------------")
-        # --------------------------------------------------------------------
-        # End
-        self.informExecution.emit("----------------------------------------------------------------")
-        self.informExecution.emit("End of program!")
-        self.spmtControllerObj.closeConnection()
-
-        return 0
+        return True
 
 
     def reset(self):
+        # A run in progress stops (and cleans up) in its own thread
+        if (self.cancel()):
+            return
+
         self.abortProgram(executionStep="operating...")
         self.spmtControllerObj.killWaveDump()
 
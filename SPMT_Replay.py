@@ -0,0 +1,735 @@
+#!/usr/bin/env python3.4
+"""
+Record and replay of complete runs: a recording keeps what the orchestrator saw in a real station (serial transcript with timestamps, files of WaveDump, results of the analysis programs); the replay feeds them back through the same interfaces, without waits, and compares the decisions and the times with the recorded run.
+"""
+import os
+import re
+import sys
+import json
+import time
+import shutil
+import argparse
+import collections
+import tempfile
+import threading
+import types
+
+import SPMT_Project
+
+from SPMT_Project import Orchestrator, MAXIMUM_CHANNELS
+from SPMT_Trace import tracer
+from SPMT_Cancel import checkCancelled
+from SPMT_HVMonitor import isSampling
+from SPMT_Benchmark import summarizeTrace, compareWithBaseline, COMMAND_CLASSES, DEFAULT_THRESHOLD
+
+RECORDING_FILE          = "recording.json"
+STATE_FOLDER            = "state"
+ACQUISITION_FOLDER      = "acquisition_%03d"
+RECORDING_FOLDER_FORMAT = "./recordings/%Y-%b-%d_%Hh%Mm%Ss"
+DEFAULT_RESULTS_FILE    = "./replay_results.json"
+REPLAY_PORT             = "replay"
+WAVEDUMP_EXIT_TIMEOUT   = 10.0          # Seconds WaveDump has to close its files after "q"
+LOOKAHEAD_EXCHANGES     = 20            # Recorded exchanges skipped, at most, to find the command sent again
+
+# Analysis programs and the controller attribute with the file of their result (None: the result is not read)
+PROGRAM_RESULTS = {"Fondo.exe":         "darkCountGaussFileName",
+                   "10percFauth_v1":    "darkCountFauthFileName",
+                   "10Percento.exe":    "_10PercentFileName",
+                   "Ricerca.exe":       "searchFileName",
+                   "Single_ph.exe":     "voltagesGainTableFileName",
+                   "Linearity.exe":     None}
+
+# Messages that depend only on timing (an analysis in background still running or not, samples of the HV monitor), not on decisions
+TIMING_MESSAGES = re.compile(r"^(Waiting for .* processing|\d+ samples of IMon and VMon)")
+
+# Orchestrator attributes of the files kept between runs, which change the decisions of the next run
+STATE_FILES = ["dacCorrectionFileName", "hvCalibrationFileName", "ledCalibrationFileName"]
+
+
+def getThreadKey():
+    # Exchanges of the HV monitor (in its thread or between two blocks of triggers) depend on the wall clock, they are matched apart from the ones of the sequence
+    return "monitor" if ((threading.current_thread().name == "HVMonitor") or isSampling()) else "sequence"
+
+
+def getProgramName(args):
+    return os.path.basename(args[0] if isinstance(args, (list, tuple)) else args)
+
+
+def formatCommand(data):
+    # "1\n0\n3\n1\n0.706\n" -> "1;0;3;1;0.706", as the commands are written in the code
+    return data.strip("\n").replace("\n", ";")
+
+
+def normalizeMessage(message):
+    # Folders and durations change from one run to another, the rest of the message must not
+    message = re.sub(r"\d{4}-\w{3}-\d{2}", "<date>", message)
+    message = re.sub(r"\d{2}h\d{2}m\d{2}s", "<time>", message)
+
+    return re.sub(r"\d+(\.\d+)? s\b", "<t> s", message)
+
+
+"""
+serial.Serial of the recording: everything goes to the real port, the writes and (not empty) reads go to the transcript
+"""
+class RecordingSerial():
+    def __init__(self, connection, recorder):
+        self.connection = connection
+        self.recorder   = recorder
+
+
+    def write(self, data):
+        self.recorder.addWrite(data)
+
+        return self.connection.write(data)
+
+
+    def inWaiting(self):
+        # The first look at the input after a command closes it (the replay does the same)
+        self.recorder.closeWrite()
+
+        return self.connection.inWaiting()
+
+
+    @property
+    def in_waiting(self):
+        return self.inWaiting()
+
+
+    def read(self, size=1):
+        self.recorder.closeWrite()
+        data = self.connection.read(size)
+
+        if (data):
+            self.recorder.addRead(data)
+
+        return data
+
+
+    def close(self):
+        self.connection.close()
+
+
+    def __getattr__(self, name):
+        return getattr(self.connection, name)
+
+
+"""
+Recorder of one run of the orchestrator, from "start" (before executeProgram) to "stop"
+"""
+class RunRecorder():
+    def __init__(self, orchestrator, folder=None):
+        self.orchestrator   = orchestrator
+        self.controller     = orchestrator.spmtControllerObj
+        self.folder         = os.path.abspath(folder or time.strftime(RECORDING_FOLDER_FORMAT))
+        self.lock           = threading.Lock()
+        self.transcript     = []
+        self.openWrites     = {}                # Thread key -> event of the command being written
+        self.programs       = {}                # Program -> results, in the order of the calls
+        self.messages       = []
+        self.phaseEvents    = []
+        self.acquisition    = 0
+        self.startTime      = None
+        self.originalSerial = None
+        self.originalSubprocess = None
+        self.originalStopWaveDump = None
+
+
+    def start(self):
+        os.makedirs(os.path.join(self.folder, STATE_FOLDER), exist_ok=True)
+
+        # Files kept between runs, as they were before this one
+        for attribute in STATE_FILES:
+            fileName = getattr(self.orchestrator, attribute)
+
+            if (os.path.exists(fileName)):
+                shutil.copyfile(fileName, os.path.join(self.folder, STATE_FOLDER, os.path.basename(fileName)))
+
+        # Phases are measured in the trace of the run
+        self.orchestrator.traceRun = True
+        self.orchestrator.informExecution.connect(self.__message)
+        self.orchestrator.phaseChanged.connect(self.__phase)
+
+        self.originalSerial = SPMT_Project.serial.Serial
+        self.originalSubprocess = SPMT_Project.subprocess
+        SPMT_Project.serial.Serial = self.openSerial
+        SPMT_Project.subprocess = types.SimpleNamespace(Popen=self.popen)
+        self.originalStopWaveDump = self.controller.stopWaveDumpAcquisition
+        self.controller.stopWaveDumpAcquisition = self.__stopWaveDumpAcquisition
+
+        self.startTime = time.time()
+
+
+    def stop(self, result=None):
+        SPMT_Project.serial.Serial = self.originalSerial
+        SPMT_Project.subprocess = self.originalSubprocess
+        del self.controller.stopWaveDumpAcquisition
+        self.orchestrator.informExecution.disconnect(self.__message)
+        self.orchestrator.phaseChanged.disconnect(self.__phase)
+
+        phases, categories = summarizeTrace(list(tracer.events))
+        recording = {"date": time.strftime("%Y-%m-%d %H:%M:%S"),
+                     "configuration": self.orchestrator.getConfiguration(),
+                     "waveDumpProgram": self.controller.waveDumpProgram,
+                     "stateFiles": {attribute: os.path.basename(getattr(self.orchestrator, attribute)) for attribute in STATE_FILES},
+                     "result": result,
+                     "duration": round(time.time() - self.startTime, 3),
+                     "phases": phases,
+                     "categories": categories,
+                     "messages": self.messages,
+                     "phaseEvents": self.phaseEvents,
+                     "acquisitions": self.acquisition,
+                     "programs": self.programs,
+                     "transcript": self.transcript}
+
+        with open(os.path.join(self.folder, RECORDING_FILE), "w") as fileRecording:
+            json.dump(recording, fileRecording, indent=1)
+
+        print("Run recorded in %s..." % self.folder)
+
+        return recording
+
+
+    def __message(self, message):
+        self.messages.append(message)
+
+
+    def __phase(self, phase, status):
+        self.phaseEvents.append([phase, status])
+
+
+    def __event(self, kind, **fields):
+        event = {"t": round(time.time() - self.startTime, 4), "thread": getThreadKey(), "kind": kind}
+        event.update(fields)
+        self.transcript.append(event)
+
+        return event
+
+
+    def openSerial(self, *args, **kwargs):
+        return RecordingSerial(self.originalSerial(*args, **kwargs), self)
+
+
+    def addWrite(self, data):
+        with self.lock:
+            key = getThreadKey()
+
+            if (self.openWrites.get(key) is not None):
+                self.openWrites[key]["data"] += data.decode("latin-1")
+            else:
+                self.openWrites[key] = self.__event("w", data=data.decode("latin-1"))
+
+
+    def closeWrite(self):
+        with self.lock:
+            self.openWrites[getThreadKey()] = None
+
+
+    def addRead(self, data):
+        with self.lock:
+            self.__event("r", data=data.decode("latin-1"))
+
+            if (b"Fine trigger" in data):
+                # Size of the wave files when the pulses ended, the replay writes them up to here
+                self.__event("wave", acquisition=self.acquisition, sizes=self.__waveFileSizes())
+
+
+    def __waveFileSizes(self):
+        sizes = {}
+
+        for channel in range(MAXIMUM_CHANNELS):
+            fileName = self.controller.waveOriginFileName % channel
+
+            if (os.path.exists(fileName)):
+                sizes[channel] = os.path.getsize(fileName)
+
+        return sizes
+
+
+    def popen(self, args, **kwargs):
+        process = self.originalSubprocess.Popen(args, **kwargs)
+        program = getProgramName(args)
+
+        if (program == os.path.basename(self.controller.waveDumpProgram)):
+            with self.lock:
+                self.acquisition += 1
+        elif (program in PROGRAM_RESULTS):
+            result = {"t": round(time.time() - self.startTime, 4), "duration": None, "file": None, "content": None}
+
+            with self.lock:
+                self.programs.setdefault(program, []).append(result)
+
+            thread = threading.Thread(target=self.__waitProgram, args=(program, process, kwargs.get("cwd"), result), name="Recorder")
+            thread.setDaemon(True)
+            thread.start()
+
+        return process
+
+
+    def __waitProgram(self, program, process, workDir, result):
+        process.wait()
+        result["duration"] = round(time.time() - self.startTime - result["t"], 4)
+
+        if (PROGRAM_RESULTS[program] is None):
+            return
+
+        result["file"] = getattr(self.controller, PROGRAM_RESULTS[program])
+        fileName = os.path.join(workDir, result["file"]) if (workDir) else result["file"]
+
+        try:
+            with open(fileName, "r") as fileResult:
+                result["content"] = fileResult.read()
+        except:
+            print("Exception when recording result of %s, %s..." % (program, fileName))
+            pass
+
+
+    def __stopWaveDumpAcquisition(self):
+        status = self.originalStopWaveDump()
+        process = self.controller.waveDumpProcess
+
+        # Files are complete only when WaveDump closes them
+        try:
+            if (process):
+                process.wait(timeout=WAVEDUMP_EXIT_TIMEOUT)
+        except:
+            print("WaveDump still running after %.0f s, recording its files as they are..." % WAVEDUMP_EXIT_TIMEOUT)
+            pass
+
+        folder = os.path.join(self.folder, ACQUISITION_FOLDER % self.acquisition)
+        os.makedirs(folder, exist_ok=True)
+
+        for channel in range(MAXIMUM_CHANNELS):
+            fileName = self.controller.waveOriginFileName % channel
+
+            if (not os.path.exists(fileName)):
+                continue
+
+            try:
+                # Hard link: no copy of the data, the file is only moved by the sequence and the next acquisition writes new ones
+                os.link(fileName, os.path.join(folder, os.path.basename(fileName)))
+            except:
+                shutil.copyfile(fileName, os.path.join(folder, os.path.basename(fileName)))
+
+        return status
+
+
+"""
+Process of the replay: the program "ran" when it was started
+"""
+class ReplayProcess():
+    def __init__(self):
+        self.pid        = 0
+        self.returncode = 0
+
+    def poll(self):
+        return self.returncode
+
+    def wait(self, timeout=None):
+        return self.returncode
+
+    def kill(self):
+        pass
+
+    def terminate(self):
+        pass
+
+
+"""
+serial.Serial of the replay: each command written is matched with the recorded ones and gets their returns, one read at a time and without waits
+"""
+class ReplaySerial():
+    def __init__(self, transcript, onWaveMark=None):
+        self.lock       = threading.Lock()
+        self.onWaveMark = onWaveMark
+        self.exchanges  = {"sequence": [], "monitor": []}
+        self.threads    = {}
+        self.commands   = []            # Commands of the sequence, as sent in the replay
+        self.differences = []
+
+        # A command with the returns read until the next command of the same thread
+        for event in transcript:
+            exchanges = self.exchanges.setdefault(event["thread"], [])
+
+            if (event["kind"] == "w"):
+                exchanges.append({"command": event["data"], "t": event["t"], "responses": []})
+            else:
+                if (not exchanges):
+                    # Returns before any command (messages of the board when the port opens)
+                    exchanges.append({"command": "", "t": event["t"], "responses": []})
+
+                exchanges[-1]["responses"].append(event)
+
+
+    def __state(self):
+        key = getThreadKey()
+
+        if (key not in self.threads):
+            self.threads[key] = {"pending": "", "cursor": 0, "responses": [], "buffer": b""}
+
+            # Returns before any command are available at once
+            exchanges = self.exchanges.get(key, [])
+
+            if (exchanges and (exchanges[0]["command"] == "")):
+                self.threads[key]["responses"] = list(exchanges[0]["responses"])
+                self.threads[key]["cursor"] = 1
+
+        return key, self.threads[key]
+
+
+    def write(self, data):
+        with self.lock:
+            key, state = self.__state()
+            state["pending"] += data.decode("latin-1")
+
+        return len(data)
+
+
+    def inWaiting(self):
+        with self.lock:
+            key, state = self.__state()
+            self.__next(key, state)
+
+            return len(state["buffer"])
+
+
+    @property
+    def in_waiting(self):
+        return self.inWaiting()
+
+
+    def read(self, size=1):
+        with self.lock:
+            key, state = self.__state()
+            self.__next(key, state)
+            data = state["buffer"][:size]
+            state["buffer"] = state["buffer"][size:]
+
+        return data
+
+
+    def close(self):
+        pass
+
+
+    def __next(self, key, state):
+        if (state["pending"]):
+            self.__resolve(key, state)
+
+        if (state["buffer"]):
+            return
+
+        # One recorded read at a time; the marks of wave files that follow it are applied at once
+        while (state["responses"]):
+            event = state["responses"].pop(0)
+
+            if (event["kind"] == "r"):
+                state["buffer"] += event["data"].encode("latin-1")
+
+                while (state["responses"] and (state["responses"][0]["kind"] == "wave")):
+                    self.__applyWaveMark(state["responses"].pop(0))
+                return
+
+            self.__applyWaveMark(event)
+
+
+    def __applyWaveMark(self, event):
+        if (self.onWaveMark):
+            self.onWaveMark(event["acquisition"], event["sizes"])
+
+
+    def __resolve(self, key, state):
+        command = state["pending"]
+        state["pending"] = ""
+        exchanges = self.exchanges.get(key, [])
+        cursor = state["cursor"]
+        exchange = None
+
+        if (key == "sequence"):
+            self.commands.append(command)
+
+        # Same command of the recording, or a few exchanges later (the ones skipped were not sent again)
+        for index in range(cursor, min(cursor + LOOKAHEAD_EXCHANGES, len(exchanges))):
+            if (exchanges[index]["command"] == command):
+                if ((key == "sequence") and (index > cursor)):
+                    for skipped in exchanges[cursor:index]:
+                        self.differences.append({"kind": "missing", "command": len(self.commands) - 1, "recorded": formatCommand(skipped["command"]), "replayed": None})
+
+                exchange = exchanges[index]
+                state["cursor"] = index + 1
+                break
+
+        if ((exchange is None) and (cursor < len(exchanges)) and (exchanges[cursor]["command"].split("\n")[0] == command.split("\n")[0])):
+            # Same command with other values (a decision changed): the recorded returns are the best guess
+            exchange = exchanges[cursor]
+            state["cursor"] = cursor + 1
+
+            if (key == "sequence"):
+                self.differences.append({"kind": "changed", "command": len(self.commands) - 1, "recorded": formatCommand(exchange["command"]), "replayed": formatCommand(command)})
+
+        if (exchange is None):
+            # Command not in the recording here: returns of the same command anywhere else, cursor kept
+            candidates = [candidate for candidate in exchanges if (candidate["command"] == command)]
+            exchange = candidates[-1] if (candidates) else None
+
+            if (key == "sequence"):
+                self.differences.append({"kind": "extra", "command": len(self.commands) - 1, "recorded": None, "replayed": formatCommand(command)})
+
+        if (exchange is not None):
+            state["responses"].extend(exchange["responses"])
+
+
+    def finish(self):
+        # Commands of the recording never sent by the replay
+        with self.lock:
+            for key, state in self.threads.items():
+                if (state["pending"]):
+                    self.__resolve(key, state)
+
+            cursor = self.threads.get("sequence", {"cursor": 0})["cursor"]
+
+            for skipped in self.exchanges["sequence"][cursor:]:
+                if (skipped["command"]):
+                    self.differences.append({"kind": "missing", "command": len(self.commands), "recorded": formatCommand(skipped["command"]), "replayed": None})
+
+        return self.differences
+
+
+"""
+Replay of a recording in a working folder of its own (the files of the station are never touched)
+"""
+class RunReplayer():
+    def __init__(self, folder, workDir=None):
+        self.folder     = os.path.abspath(folder)
+        self.workDir    = workDir
+
+        with open(os.path.join(self.folder, RECORDING_FILE), "r") as fileRecording:
+            self.recording = json.load(fileRecording)
+
+        self.serial         = ReplaySerial(self.recording["transcript"], onWaveMark=self.writeWaveFiles)
+        self.orchestrator   = None
+        self.controller     = None
+        self.originalStopWaveDump = None
+        self.acquisition    = 0
+        self.waveOffsets    = {}            # Channel -> bytes of the recorded file already written
+        self.programCalls   = {}
+        self.differences    = []
+        self.messages       = []
+        self.phaseEvents    = []
+
+
+    def popen(self, args, cwd=None, **kwargs):
+        program = getProgramName(args)
+
+        if (program == os.path.basename(self.controller.waveDumpProgram)):
+            self.startAcquisition()
+            return ReplayProcess()
+
+        results = self.recording["programs"].get(program, [])
+        index = self.programCalls.get(program, 0)
+        self.programCalls[program] = index + 1
+
+        if (index < len(results)):
+            result = results[index]
+        else:
+            self.differences.append({"kind": "program", "program": program, "call": index + 1, "recorded": len(results)})
+            result = results[-1] if (results) else None
+
+        if (PROGRAM_RESULTS.get(program) is None):
+            return ReplayProcess()
+
+        if ((result is None) or (result["content"] is None)):
+            # The sequence would wait for this result forever
+            self.orchestrator.cancel("no recorded result of %s" % program)
+            return ReplayProcess()
+
+        fileName = getattr(self.controller, PROGRAM_RESULTS[program])
+
+        with open(os.path.join(cwd, fileName) if (cwd) else fileName, "w") as fileResult:
+            fileResult.write(result["content"])
+
+        return ReplayProcess()
+
+
+    def __recordedWaveFile(self, acquisition, channel):
+        return os.path.join(self.folder, ACQUISITION_FOLDER % acquisition, os.path.basename(self.controller.waveOriginFileName % channel))
+
+
+    def startAcquisition(self):
+        # WaveDump creates (empty) files when the acquisition starts
+        self.acquisition += 1
+        self.waveOffsets = {}
+
+        for channel in range(MAXIMUM_CHANNELS):
+            if (os.path.exists(self.__recordedWaveFile(self.acquisition, channel))):
+                open(self.controller.waveOriginFileName % channel, "wb").close()
+                self.waveOffsets[channel] = 0
+
+
+    def writeWaveFiles(self, acquisition=None, sizes=None):
+        # Recorded wave files up to "sizes" (the ones at the end of a trigger), up to the end without sizes
+        if ((acquisition is not None) and (acquisition != self.acquisition)):
+            return
+
+        for channel, offset in self.waveOffsets.items():
+            size = None if (sizes is None) else sizes.get(str(channel), sizes.get(channel))
+
+            if ((size is not None) and (size <= offset)):
+                continue
+
+            with open(self.__recordedWaveFile(self.acquisition, channel), "rb") as fileRecorded:
+                fileRecorded.seek(offset)
+                data = fileRecorded.read() if (size is None) else fileRecorded.read(size - offset)
+
+            with open(self.controller.waveOriginFileName % channel, "ab") as fileWave:
+                fileWave.write(data)
+
+            self.waveOffsets[channel] = offset + len(data)
+
+
+    def __stopWaveDumpAcquisition(self):
+        status = self.originalStopWaveDump()
+        self.writeWaveFiles()
+
+        return status
+
+
+    def run(self):
+        # Executes the recorded run; returns the results (decisions compared with the recording, times)
+        temporaryWorkDir = (self.workDir is None)
+        workDir = os.path.abspath(self.workDir or tempfile.mkdtemp(prefix="SPMT_replay_"))
+        os.makedirs(os.path.join(workDir, "logs"), exist_ok=True)
+
+        originalSerial = SPMT_Project.serial.Serial
+        originalSubprocess = SPMT_Project.subprocess
+        originalSleep = SPMT_Project.sleep
+        originalFolder = os.getcwd()
+
+        SPMT_Project.serial.Serial = lambda *args, **kwargs: self.serial
+        SPMT_Project.subprocess = types.SimpleNamespace(Popen=self.popen)
+        # Unlimited speed: no waits, but a cancelled run still stops
+        SPMT_Project.sleep = lambda seconds: checkCancelled()
+
+        try:
+            os.chdir(workDir)
+
+            self.orchestrator = Orchestrator(linduinoPort=REPLAY_PORT, waveDumpProgram=self.recording["waveDumpProgram"])
+            self.controller = self.orchestrator.spmtControllerObj
+            self.orchestrator.interactive = False
+            self.orchestrator.setConfiguration(self.recording["configuration"])
+            self.orchestrator.traceRun = True
+            self.orchestrator.catalogFileName = os.path.join(workDir, "catalog.sqlite")
+            self.orchestrator.informExecution.connect(self.messages.append)
+            self.orchestrator.phaseChanged.connect(lambda phase, status: self.phaseEvents.append([phase, status]))
+            self.originalStopWaveDump = self.controller.stopWaveDumpAcquisition
+            self.controller.stopWaveDumpAcquisition = self.__stopWaveDumpAcquisition
+
+            # Files kept between runs, as they were before the recorded run
+            for attribute, baseName in self.recording["stateFiles"].items():
+                setattr(self.orchestrator, attribute, os.path.join(workDir, baseName))
+
+                if (os.path.exists(os.path.join(self.folder, STATE_FOLDER, baseName))):
+                    shutil.copyfile(os.path.join(self.folder, STATE_FOLDER, baseName), os.path.join(workDir, baseName))
+
+            startTime = time.time()
+            result = self.orchestrator.executeProgram()
+            wallTime = time.time() - startTime
+        finally:
+            os.chdir(originalFolder)
+            SPMT_Project.serial.Serial = originalSerial
+            SPMT_Project.subprocess = originalSubprocess
+            SPMT_Project.sleep = originalSleep
+
+            if (temporaryWorkDir):
+                shutil.rmtree(workDir, ignore_errors=True)
+
+        phases, categories = summarizeTrace(list(tracer.events))
+        commands = {}
+
+        for command in self.serial.commands:
+            name = COMMAND_CLASSES.get(command.split("\n")[0], command.split("\n")[0])
+            commands[name] = commands.get(name, 0) + 1
+
+        return {"date": time.strftime("%Y-%m-%d %H:%M:%S"),
+                "recording": self.folder,
+                "timeScale": 0.0,
+                "numberOfChannels": self.orchestrator.numberOfChannels,
+                "result": result,
+                "wallTime": round(wallTime, 3),
+                "phases": phases,
+                "categories": categories,
+                "commands": commands,
+                "recorded": {"result": self.recording["result"], "duration": self.recording["duration"], "phases": self.recording["phases"]},
+                "differences": self.compareDecisions(result)}
+
+
+    def compareDecisions(self, result):
+        # -----------------------------------------------------------------
+        # Decisions of the replay against the recorded ones: commands sent
+        # (voltages set, LED tuning, triggers), verdicts of the phases,
+        # messages to the operator and the result of the run.
+        # -----------------------------------------------------------------
+        differences = self.serial.finish() + self.differences
+
+        if (result != self.recording["result"]):
+            differences.append({"kind": "result", "recorded": self.recording["result"], "replayed": result})
+
+        if (self.phaseEvents != self.recording["phaseEvents"]):
+            differences.append({"kind": "phases", "recorded": self.recording["phaseEvents"], "replayed": self.phaseEvents})
+
+        # Analyses in background inform from their own threads, so only the messages (not their order) are compared
+        recordedMessages = collections.Counter(normalizeMessage(message) for message in self.recording["messages"] if (not TIMING_MESSAGES.match(message)))
+        replayedMessages = collections.Counter(normalizeMessage(message) for message in self.messages if (not TIMING_MESSAGES.match(message)))
+
+        for message in (recordedMessages - replayedMessages):
+            differences.append({"kind": "message", "recorded": message, "replayed": None})
+
+        for message in (replayedMessages - recordedMessages):
+            differences.append({"kind": "message", "recorded": None, "replayed": message})
+
+        return differences
+
+
+def formatDifference(difference):
+    if (difference["kind"] in ("changed", "missing", "extra")):
+        return "command %d %s: recorded %s, replayed %s" % (difference["command"], difference["kind"], difference["recorded"], difference["replayed"])
+    elif (difference["kind"] == "program"):
+        return "%s called %d times, recorded %d" % (difference["program"], difference["call"], difference["recorded"])
+
+    return "%s: recorded %s, replayed %s" % (difference["kind"], difference["recorded"], difference["replayed"])
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Replay a recorded SPMT run without hardware and compare its decisions and times.")
+    parser.add_argument("recording", help="folder of the recording (SPMT_Headless.py --record)")
+    parser.add_argument("--output", default=DEFAULT_RESULTS_FILE, help="JSON file of results")
+    parser.add_argument("--baseline", help="JSON file of results of a previous replay to compare the times with")
+    parser.add_argument("--threshold", type=float, default=DEFAULT_THRESHOLD, help="relative increase of a time considered a regression")
+    parser.add_argument("--workdir", help="folder of the replay (kept), instead of a temporary one")
+    arguments = parser.parse_args()
+
+    results = RunReplayer(arguments.recording, workDir=arguments.workdir).run()
+
+    with open(arguments.output, "w") as fileResults:
+        json.dump(results, fileResults, indent=4)
+
+    print("Replay result %d in %.3f s (recorded: result %s in %.3f s)" % (results["result"], results["wallTime"], results["recorded"]["result"], results["recorded"]["duration"]))
+
+    for name, seconds in results["phases"].items():
+        print("    %-20s %8.3f s (recorded %8.3f s)" % (name, seconds, results["recorded"]["phases"].get(name, 0.0)))
+
+    for difference in results["differences"]:
+        print("DIFFERENCE %s" % formatDifference(difference))
+
+    regressions = []
+
+    if (arguments.baseline):
+        with open(arguments.baseline, "r") as fileBaseline:
+            regressions = compareWithBaseline(results, json.load(fileBaseline), threshold=arguments.threshold)
+
+    for regression in regressions:
+        print("REGRESSION %s" % regression)
+
+    return (1 if (results["differences"] or regressions) else 0)
+
+
+if __name__ == "__main__": sys.exit(main())
@@ -0,0 +1,68 @@
+#!/usr/bin/env python3.4
+"""
+Run the analyses of acquired data in background, so the next acquisition can start meanwhile; a phase only waits (join) for the analyses whose result it really needs.
+"""
+from concurrent.futures import ThreadPoolExecutor
+
+from SPMT_Cancel import getCurrentToken, setCurrentToken
+
+"""
+Scheduler of named analysis tasks, with optional dependencies between them
+"""
+class AnalysisScheduler():
+    def __init__(self, maximumWorkers=2):
+        self.executor   = ThreadPoolExecutor(max_workers=maximumWorkers, thread_name_prefix="analysis")
+        self.tasks      = {}            # Name of task -> future
+
+
+    def submit(self, name, function, *args, dependsOn=(), **kwargs):
+        # -----------------------------------------------------------------
+        # Tasks in "dependsOn" must have been submitted before; the task
+        # only starts after all of them and is skipped (False) when one of
+        # them fails.
+        # -----------------------------------------------------------------
+        dependencies = [self.tasks[dependency] for dependency in dependsOn if (dependency in self.tasks)]
+        # The analysis is cancelled together with the run that submitted it
+        token = getCurrentToken()
+
+        def run():
+            setCurrentToken(token)
+
+            for dependency in dependencies:
+                if (not dependency.result()):
+                    print("Analysis %s skipped, a dependency has failed..." % name)
+                    return False
+
+            return function(*args, **kwargs)
+
+        self.tasks[name] = self.executor.submit(run)
+
+        return self.tasks[name]
+
+
+    def isSubmitted(self, name):
+        return (name in self.tasks)
+
+
+    def isPending(self, name):
+        return ((name in self.tasks) and (not self.tasks[name].done()))
+
+
+    def join(self, name, timeout=None):
+        # Result of the task (None when it was never submitted, False when it raised an exception)
+        if (name not in self.tasks):
+            return None
+
+        try:
+            return self.tasks[name].result(timeout=timeout)
+        except:
+            print("Exception in analysis %s..." % name)
+            return False
+
+
+    def joinAll(self, timeout=None):
+        return {name: self.join(name, timeout=timeout) for name in list(self.tasks)}
+
+
+    def shutdown(self, wait=False):
+        self.executor.shutdown(wait=wait)
@@ -0,0 +1,196 @@
+#!/usr/bin/env python3.4
+"""
+Synthetic PMT waveforms (baseline noise, dark pulses, single photoelectron charges and LED pulses with Poisson photoelectrons and saturation), written in the text and binary formats of WaveDump, to test and benchmark the analyses without the digitizer.
+"""
+import os
+import sys
+import time
+import numpy
+import argparse
+
+DEFAULT_RECORD_LENGTH   = 1024          # Samples per event
+DEFAULT_SAMPLE_PERIOD   = 4.0           # Nanoseconds per sample (250 MS/s)
+DEFAULT_BASELINE        = 3800.0        # ADC counts; PMT pulses are negative, so the baseline is near the top of the range
+DEFAULT_ADC_MAXIMUM     = 4095          # 12 bits
+DEFAULT_BLOCK_EVENTS    = 10000         # Events generated (and kept in memory) at once
+TRIGGER_CLOCK_PERIOD    = 8.0           # Nanoseconds per count of the trigger time tag
+
+# Header of each event in the text files of WaveDump (the reader only needs "Record Length")
+TEXT_HEADER = ("Record Length: %d\nBoardID: %2d\nChannel: %d\nEvent Number: %d\n"
+               "Pattern: 0x%04X\nTrigger Time Stamp: %d\nDC offset (DAC): 0x%04X\n")
+
+
+def pulseTemplate(samplePeriod=DEFAULT_SAMPLE_PERIOD, riseTime=2.0, fallTime=8.0):
+    # Shape of one photoelectron (difference of exponentials, times in ns), normalized to unit area
+    times = numpy.arange(0.0, 10.0 * fallTime, samplePeriod)
+    template = numpy.exp(-times / fallTime) - numpy.exp(-times / riseTime)
+
+    return (template / template.sum()).astype(numpy.float32)
+
+
+"""
+Vectorized generator of events of one channel; the charge is the area of the pulse in ADC counts x samples
+"""
+class WaveformGenerator():
+    def __init__(self, recordLength=DEFAULT_RECORD_LENGTH, samplePeriod=DEFAULT_SAMPLE_PERIOD, baseline=DEFAULT_BASELINE, noise=2.0,
+                 polarity=-1, gain=150.0, gainSpread=0.35, darkRate=1000.0, triggerPosition=200, triggerJitter=2,
+                 adcMaximum=DEFAULT_ADC_MAXIMUM, seed=None):
+        self.recordLength       = recordLength
+        self.samplePeriod       = samplePeriod
+        self.baseline           = baseline
+        self.noise              = noise                 # Sigma of the baseline (ADC counts)
+        self.polarity           = polarity
+        self.gain               = gain                  # Mean charge of one photoelectron
+        self.gainSpread         = gainSpread            # Sigma of the single photoelectron charge, relative to the gain
+        self.darkRate           = darkRate              # Hz
+        self.triggerPosition    = triggerPosition       # Sample of the LED pulse
+        self.triggerJitter      = triggerJitter         # Samples
+        self.adcMaximum         = adcMaximum
+        self.template           = pulseTemplate(samplePeriod)
+        self.random             = numpy.random.default_rng(seed)
+
+
+    def generate(self, numberOfEvents, meanPhotoelectrons=0.0):
+        # -----------------------------------------------------------------
+        # Returns the events (uint16, one per row, clipped to the range of
+        # the ADC) and the truth of each one: photoelectrons of the LED,
+        # their charge and the number of dark pulses.
+        # -----------------------------------------------------------------
+        # Noise generated directly in single precision (half of the time of the whole generation)
+        waves = self.random.standard_normal((numberOfEvents, self.recordLength), dtype=numpy.float32)
+        waves *= self.noise
+        waves += self.baseline
+
+        # LED: Poisson photoelectrons, the charge of n photoelectrons is normal (n x gain, sqrt(n) x spread)
+        photoelectrons = self.random.poisson(meanPhotoelectrons, numberOfEvents) if (meanPhotoelectrons > 0.0) else numpy.zeros(numberOfEvents, dtype=numpy.int64)
+        charges = self.gain * (photoelectrons + numpy.sqrt(photoelectrons) * self.gainSpread * self.random.standard_normal(numberOfEvents))
+        charges = numpy.maximum(charges, 0.0)
+        withLight = numpy.flatnonzero(photoelectrons)
+        positions = self.triggerPosition + self.random.integers(-self.triggerJitter, self.triggerJitter + 1, len(withLight))
+        self.__addPulses(waves, withLight, positions, charges[withLight])
+
+        # Dark pulses: Poisson number in the window of each event, single photoelectron charges at random times
+        meanDarkPulses = self.darkRate * self.recordLength * self.samplePeriod * 1e-9
+        darkPulses = self.random.poisson(meanDarkPulses, numberOfEvents)
+        darkEvents = numpy.repeat(numpy.arange(numberOfEvents), darkPulses)
+        darkCharges = numpy.maximum(self.gain * (1.0 + self.gainSpread * self.random.standard_normal(len(darkEvents))), 0.0)
+        self.__addPulses(waves, darkEvents, self.random.integers(0, self.recordLength, len(darkEvents)), darkCharges)
+
+        # Saturation of the ADC
+        numpy.clip(numpy.rint(waves), 0, self.adcMaximum, out=waves)
+
+        return waves.astype(numpy.uint16), {"photoelectrons": photoelectrons, "charge": charges, "darkPulses": darkPulses}
+
+
+    def __addPulses(self, waves, events, positions, charges):
+        # All pulses at once: flat indexes of every sample of every pulse (pulses can overlap, so unbuffered add)
+        if (len(events) == 0):
+            return
+
+        numberOfEvents, recordLength = waves.shape
+        columns = positions[:, numpy.newaxis] + numpy.arange(len(self.template))
+        inside = (columns < recordLength)
+        indexes = (events[:, numpy.newaxis] * recordLength + columns)[inside]
+        weights = (self.polarity * charges[:, numpy.newaxis] * self.template)[inside]
+
+        numpy.add.at(waves.reshape(-1), indexes, weights.astype(numpy.float32))
+
+
+"""
+Writer of the files of one channel, in the text format of WaveDump (wave_N.txt) or in its binary format with header (wave_N.dat)
+"""
+class WaveFileWriter():
+    def __init__(self, fileName, channel=0, binary=False, boardId=0, eventRate=1000.0, adcMaximum=DEFAULT_ADC_MAXIMUM):
+        self.fileName       = fileName
+        self.channel        = channel
+        self.binary         = binary
+        self.boardId        = boardId
+        self.eventRate      = eventRate             # Hz, for the trigger time tags
+        self.eventNumber    = 0
+        self.waveFile       = open(fileName, "wb")
+        # Text of every ADC value, padded with NUL to the same width (removed after the lookup)
+        self.textTable      = numpy.array([("%d\n" % value).encode() for value in range(adcMaximum + 1)], dtype="S%d" % (len(str(adcMaximum)) + 1))
+
+
+    def write(self, waves):
+        numberOfEvents, recordLength = waves.shape
+        numbers = numpy.arange(self.eventNumber, self.eventNumber + numberOfEvents)
+        timeTags = ((numbers * 1e9 / self.eventRate) / TRIGGER_CLOCK_PERIOD).astype(numpy.int64) % (1 << 31)
+        self.eventNumber += numberOfEvents
+
+        if (self.binary):
+            # Header of 6 words: size of the event (bytes), board, pattern, channel, event counter, trigger time tag
+            events = numpy.zeros(numberOfEvents, dtype=[("header", "<u4", 6), ("samples", "<u2", recordLength)])
+            events["header"][:, 0] = 24 + 2 * recordLength
+            events["header"][:, 1] = self.boardId
+            events["header"][:, 3] = self.channel
+            events["header"][:, 4] = numbers
+            events["header"][:, 5] = timeTags
+            events["samples"] = waves
+            events.tofile(self.waveFile)
+            return events.nbytes
+
+        samples = self.textTable[waves].tobytes()
+        width = self.textTable.itemsize * recordLength
+        content = b"".join((TEXT_HEADER % (recordLength, self.boardId, self.channel, number, 0, timeTag, 0x1999)).encode() +
+                           samples[index * width:(index + 1) * width]
+                           for index, (number, timeTag) in enumerate(zip(numbers.tolist(), timeTags.tolist()))).replace(b"\x00", b"")
+        self.waveFile.write(content)
+
+        return len(content)
+
+
+    def flush(self):
+        self.waveFile.flush()
+
+
+    def close(self):
+        self.waveFile.close()
+
+
+def writeWaveFiles(numberOfEvents, channels=(0,), folder=".", meanPhotoelectrons=0.0, binary=False, blockEvents=DEFAULT_BLOCK_EVENTS, seed=None, **generatorParameters):
+    # Files of all channels, generated in blocks of "blockEvents"; returns the number of bytes written
+    extension = "dat" if (binary) else "txt"
+    bytesWritten = 0
+
+    for channel in channels:
+        generator = WaveformGenerator(seed=(None if (seed is None) else seed + channel), **generatorParameters)
+        writer = WaveFileWriter(os.path.join(folder, "wave_%d.%s" % (channel, extension)), channel=channel, binary=binary, adcMaximum=generator.adcMaximum)
+
+        try:
+            for first in range(0, numberOfEvents, blockEvents):
+                waves, truth = generator.generate(min(blockEvents, numberOfEvents - first), meanPhotoelectrons=meanPhotoelectrons)
+                bytesWritten += writer.write(waves)
+        finally:
+            writer.close()
+
+    return bytesWritten
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Write synthetic PMT waveforms in the formats of WaveDump.")
+    parser.add_argument("--events", type=int, default=100000, help="events per channel")
+    parser.add_argument("--channels", type=int, default=1, help="number of channels (0 to N-1)")
+    parser.add_argument("--folder", default=".", help="folder of the wave files")
+    parser.add_argument("--record-length", type=int, default=DEFAULT_RECORD_LENGTH, help="samples per event")
+    parser.add_argument("--mean-pe", type=float, default=0.0, help="mean photoelectrons of the LED by event (0 for dark count)")
+    parser.add_argument("--gain", type=float, default=150.0, help="charge of one photoelectron (ADC counts x samples)")
+    parser.add_argument("--dark-rate", type=float, default=1000.0, help="rate of dark pulses (Hz)")
+    parser.add_argument("--binary", action="store_true", help="binary files (wave_N.dat) instead of text")
+    parser.add_argument("--seed", type=int, help="seed of the random numbers")
+    arguments = parser.parse_args()
+
+    os.makedirs(arguments.folder, exist_ok=True)
+    startTime = time.time()
+
+    bytesWritten = writeWaveFiles(arguments.events, channels=range(arguments.channels), folder=arguments.folder, meanPhotoelectrons=arguments.mean_pe,
+                                  binary=arguments.binary, seed=arguments.seed, recordLength=arguments.record_length,
+                                  gain=arguments.gain, darkRate=arguments.dark_rate)
+    duration = time.time() - startTime
+
+    print("%d events x %d channels, %.1f MB in %.2f s (%.1f MB/s)" % (arguments.events, arguments.channels, bytesWritten / 1e6, duration, bytesWritten / 1e6 / max(duration, 1e-9)))
+
+    return 0
+
+
+if __name__ == "__main__": sys.exit(main())
@@ -0,0 +1,155 @@
+#!/usr/bin/env python3.4
+"""
+Span-based tracing of a run (commands to Linduino, WaveDump, analyses, sleeps, file copies), saved as a Chrome trace JSON file that can be opened in chrome://tracing or Perfetto.
+"""
+import os
+import json
+import time
+import inspect
+import functools
+import threading
+
+from contextlib import contextmanager
+
+from SPMT_Cancel import cancellableSleep
+
+# Sleeps shorter than this (polling loops) are not traced, they would only flood the timeline
+MINIMUM_SLEEP_TRACED = 0.1
+
+"""
+Collector of trace events; disabled it costs only the check of a flag
+"""
+class Tracer():
+    def __init__(self):
+        self.enabled        = False
+        self.events         = []
+        self.lock           = threading.Lock()
+        self.startTime      = time.perf_counter()
+        self.threadNames    = {}
+
+
+    def start(self):
+        with self.lock:
+            self.events         = []
+            self.threadNames    = {}
+            self.startTime      = time.perf_counter()
+            self.enabled        = True
+
+
+    def stop(self):
+        self.enabled = False
+
+
+    def __timestamp(self):
+        # Microseconds since start
+        return (time.perf_counter() - self.startTime) * 1e6
+
+
+    def __add(self, event):
+        thread = threading.current_thread()
+        event.update({"pid": os.getpid(), "tid": thread.ident})
+
+        with self.lock:
+            self.threadNames[thread.ident] = thread.name
+            self.events.append(event)
+
+
+    @contextmanager
+    def span(self, name, category="run", **arguments):
+        if (not self.enabled):
+            yield
+            return
+
+        startTime = self.__timestamp()
+
+        try:
+            yield
+        finally:
+            self.__add({"name": name, "cat": category, "ph": "X", "ts": startTime, "dur": self.__timestamp() - startTime,
+                        "args": {key: self.__toJson(value) for key, value in arguments.items()}})
+
+
+    def begin(self, name, category="run", **arguments):
+        # Begin/end must happen in the same thread
+        if (self.enabled):
+            self.__add({"name": name, "cat": category, "ph": "B", "ts": self.__timestamp(),
+                        "args": {key: self.__toJson(value) for key, value in arguments.items()}})
+
+
+    def end(self, name, category="run", **arguments):
+        if (self.enabled):
+            self.__add({"name": name, "cat": category, "ph": "E", "ts": self.__timestamp(),
+                        "args": {key: self.__toJson(value) for key, value in arguments.items()}})
+
+
+    def instant(self, name, category="run", **arguments):
+        if (self.enabled):
+            self.__add({"name": name, "cat": category, "ph": "i", "s": "t", "ts": self.__timestamp(),
+                        "args": {key: self.__toJson(value) for key, value in arguments.items()}})
+
+
+    def __toJson(self, value):
+        if (isinstance(value, (int, float, str, bool)) or (value is None)):
+            return value
+
+        return str(value)
+
+
+    def save(self, fileName):
+        with self.lock:
+            events = list(self.events)
+            metadata = [{"name": "thread_name", "ph": "M", "pid": os.getpid(), "tid": ident, "args": {"name": name}}
+                        for ident, name in self.threadNames.items()]
+
+        try:
+            with open(fileName + ".tmp", "w") as fileTrace:
+                json.dump({"traceEvents": metadata + events, "displayTimeUnit": "ms"}, fileTrace)
+
+            os.replace(fileName + ".tmp", fileName)
+        except:
+            print("Exception when saving trace %s..." % fileName)
+            return False
+
+        return True
+
+
+# Tracer of the process, shared by all modules
+tracer = Tracer()
+
+
+def traced(category="run", arguments=(), name=None):
+    # -----------------------------------------------------------------
+    # Decorator: one span per call, with the values of "arguments"
+    # (names of parameters of the function) in the trace.
+    # -----------------------------------------------------------------
+    def decorator(function):
+        spanName = name or function.__qualname__
+        signature = inspect.signature(function)
+
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            if (not tracer.enabled):
+                return function(*args, **kwargs)
+
+            values = {}
+
+            if (arguments):
+                bound = signature.bind_partial(*args, **kwargs)
+                bound.apply_defaults()
+                values = {argument: bound.arguments.get(argument) for argument in arguments}
+
+            with tracer.span(spanName, category, **values):
+                return function(*args, **kwargs)
+
+        return wrapper
+
+    return decorator
+
+
+def sleep(seconds):
+    # Same as time.sleep, but the waits of the sequence appear in the trace (and stop when the run is cancelled)
+    if (tracer.enabled and (seconds >= MINIMUM_SLEEP_TRACED)):
+        with tracer.span("sleep", "sleep", seconds=seconds):
+            cancellableSleep(seconds)
+    else:
+        cancellableSleep(seconds)
@@ -0,0 +1,78 @@
+#!/usr/bin/env python3.4
+"""
+Load a Qt Designer file through a compiled Python module kept in cache, regenerated only when the .ui file changes, instead of parsing the XML at every launch.
+"""
+import os
+import io
+import re
+import hashlib
+import importlib.util
+
+from PyQt5 import uic
+
+DEFAULT_CACHE_FOLDER = "./__uicache__"
+
+# Compiled modules import the resources of the .ui ("import icons_rc"); icons are also set by the program, so they are optional
+RESOURCE_IMPORT = re.compile(r'^import (\w+_rc)$', re.MULTILINE)
+
+
+def getCompiledModule(uiFileName, cacheFolder=DEFAULT_CACHE_FOLDER):
+    # -----------------------------------------------------------------
+    # Path of the compiled module of "uiFileName", (re)generated when
+    # the hash of the .ui written in its first line is not the current
+    # one; None when it cannot be written (read-only folder...).
+    # -----------------------------------------------------------------
+    with open(uiFileName, "rb") as uiFile:
+        digest = hashlib.sha1(uiFile.read()).hexdigest()
+
+    moduleFileName = os.path.join(cacheFolder, os.path.splitext(os.path.basename(uiFileName))[0] + "_compiled.py")
+    header = "# Compiled from %s, sha1 %s\n" % (os.path.basename(uiFileName), digest)
+
+    try:
+        with open(moduleFileName, "r") as moduleFile:
+            if (moduleFile.readline() == header):
+                return moduleFileName
+    except (IOError, OSError):
+        pass
+
+    try:
+        code = io.StringIO()
+        uic.compileUi(uiFileName, code)
+        source = RESOURCE_IMPORT.sub(r'try:\n    import \1\nexcept ImportError:\n    pass', code.getvalue())
+
+        os.makedirs(cacheFolder, exist_ok=True)
+
+        with open(moduleFileName + ".tmp", "w") as moduleFile:
+            moduleFile.write(header + source)
+
+        os.replace(moduleFileName + ".tmp", moduleFileName)
+    except:
+        print("Exception when compiling %s to %s..." % (uiFileName, moduleFileName))
+        return None
+
+    return moduleFileName
+
+
+def loadCachedUi(uiFileName, baseInstance, cacheFolder=DEFAULT_CACHE_FOLDER):
+    # Same result of "uic.loadUi(uiFileName, baseInstance)": the widgets become attributes of "baseInstance"
+    moduleFileName = None
+
+    try:
+        moduleFileName = getCompiledModule(uiFileName, cacheFolder=cacheFolder)
+    except (IOError, OSError):
+        print("Exception when reading %s..." % uiFileName)
+
+    if (moduleFileName is None):
+        return uic.loadUi(uiFileName, baseInstance)
+
+    specification = importlib.util.spec_from_file_location(os.path.splitext(os.path.basename(moduleFileName))[0], moduleFileName)
+    module = importlib.util.module_from_spec(specification)
+    specification.loader.exec_module(module)
+
+    # Compiled module has one class "Ui_<name of top level widget>"
+    uiClass = [getattr(module, name) for name in dir(module) if name.startswith("Ui_")][0]
+    ui = uiClass()
+    ui.setupUi(baseInstance)
+    baseInstance.__dict__.update(ui.__dict__)
+
+    return baseInstance
@@ -0,0 +1,180 @@
+#!/usr/bin/env python3.4
+"""
+Read the text files written by WaveDump (wave_N.txt) and extract per-event features (baseline, amplitude, charge and peak time) from the raw samples.
+"""
+import os
+import re
+import numpy
+
+DEFAULT_RECORD_LENGTH   = 1024          # Samples per event when the file has no header
+DEFAULT_BASELINE_LENGTH = 50            # Samples at the beginning of each event used to compute the baseline
+DEFAULT_POLARITY        = -1            # PMT pulses are negative
+HEADER_LINE             = re.compile(rb"^[^\n:]*:[^\n]*\n", re.MULTILINE)
+
+"""
+Incremental reader of one WaveDump text file; each call returns only the events written since the previous call
+"""
+class WaveFileTail():
+    def __init__(self, fileName, recordLength=None):
+        self.fileName       = fileName
+        # When WaveDump writes the header, "Record Length: N" overrides this value
+        self.recordLength   = recordLength
+        # Attributes to keep the position between calls
+        self.position       = 0         # Byte offset already consumed
+        self.pendingLine    = b""       # Incomplete line at the end of last read
+        self.samples        = numpy.zeros(0, dtype=numpy.float32)     # Samples of the event being read
+
+
+    def reset(self):
+        self.position       = 0
+        self.pendingLine    = b""
+        self.samples        = numpy.zeros(0, dtype=numpy.float32)
+
+
+    def readEvents(self):
+        events = []
+
+        try:
+            if (not os.path.exists(self.fileName)):
+                return self.__toArray(events)
+
+            # When a new acquisition starts WaveDump truncates the file, so start again from the beginning
+            if (os.path.getsize(self.fileName) < self.position):
+                self.reset()
+
+            with open(self.fileName, "rb") as waveFile:
+                waveFile.seek(self.position)
+                content = waveFile.read()
+                self.position = waveFile.tell()
+        except:
+            print("Exception when reading wave file %s..." % self.fileName)
+            return self.__toArray(events)
+
+        content = self.pendingLine + content
+        # After the last newline there is an incomplete line (or nothing), keep it for the next call
+        end = content.rfind(b'\n') + 1
+        self.pendingLine = content[end:]
+
+        # -----------------------------------------------------------------
+        # Header lines are like "Record Length: 1024", "Channel: 0", "Event
+        # Number: 12"...; the sample lines between two headers are parsed
+        # as one block by numpy, never line by line.
+        # -----------------------------------------------------------------
+        blockStart = 0
+
+        for header in HEADER_LINE.finditer(content, 0, end):
+            self.__appendSamples(content[blockStart:header.start()], events)
+            blockStart = header.end()
+
+            if (header.group(0).strip().startswith(b'Record Length')):
+                try:
+                    self.recordLength = int(header.group(0).split(b':')[1])
+                except ValueError:
+                    print("Invalid record length in wave file %s..." % self.fileName)
+
+        self.__appendSamples(content[blockStart:end], events)
+
+        return self.__toArray(events)
+
+
+    def __appendSamples(self, block, events):
+        # Complete events (rows) go to "events", the samples of an incomplete one wait for the next block
+        if (not block.strip()):
+            return
+
+        try:
+            samples = numpy.fromstring(block, dtype=numpy.float32, sep=' ')
+        except ValueError:
+            print("Invalid samples in wave file %s..." % self.fileName)
+            return
+
+        recordLength = self.recordLength or DEFAULT_RECORD_LENGTH
+        samples = numpy.concatenate((self.samples, samples))
+        numberOfEvents = len(samples) // recordLength
+
+        if (numberOfEvents > 0):
+            events.append(samples[:numberOfEvents * recordLength].reshape(numberOfEvents, recordLength))
+
+        self.samples = samples[numberOfEvents * recordLength:]
+
+
+    def __toArray(self, events):
+        recordLength = self.recordLength or DEFAULT_RECORD_LENGTH
+
+        if (not events):
+            return numpy.zeros((0, recordLength), dtype=numpy.float32)
+
+        return numpy.concatenate(events)
+
+
+def readWaveFile(fileName, recordLength=None):
+    return WaveFileTail(fileName, recordLength=recordLength).readEvents()
+
+
+def readBinaryWaveFile(fileName):
+    # -----------------------------------------------------------------
+    # Binary files of WaveDump with header: each event has 6 words of
+    # 32 bits (the first one is the size of the event in bytes) and the
+    # samples in 16 bits.
+    # -----------------------------------------------------------------
+    try:
+        header = numpy.fromfile(fileName, dtype="<u4", count=6)
+    except:
+        print("Exception when reading wave file %s..." % fileName)
+        header = []
+
+    if (len(header) < 6):
+        return numpy.zeros((0, DEFAULT_RECORD_LENGTH), dtype=numpy.float32)
+
+    recordLength = (int(header[0]) - 24) // 2
+    events = numpy.fromfile(fileName, dtype=[("header", "<u4", 6), ("samples", "<u2", recordLength)])
+
+    return events["samples"].astype(numpy.float32)
+
+
+def extractFeatures(waves, baselineLength=DEFAULT_BASELINE_LENGTH, polarity=DEFAULT_POLARITY, integrationWindow=None):
+    # -----------------------------------------------------------------
+    # "waves" is a 2D array, one event per row; all features are
+    # computed at once for every event:
+    #     baseline  -> mean of the first "baselineLength" samples;
+    #     amplitude -> maximum of the pulse after baseline subtraction;
+    #     charge    -> sum of the pulse samples inside "integrationWindow"
+    #                  (start, stop), or the whole event when None;
+    #     peakTime  -> sample index of the maximum.
+    # -----------------------------------------------------------------
+    waves = numpy.asarray(waves, dtype=numpy.float32)
+
+    if (waves.shape[0] == 0):
+        empty = numpy.zeros(0, dtype=numpy.float32)
+        return {"baseline": empty, "amplitude": empty, "charge": empty, "peakTime": numpy.zeros(0, dtype=numpy.int32)}
+
+    baseline = waves[:, :baselineLength].mean(axis=1)
+    signal = polarity * (waves - baseline[:, numpy.newaxis])
+
+    if (integrationWindow):
+        start, stop = integrationWindow
+    else:
+        start, stop = 0, waves.shape[1]
+
+    return {"baseline":  baseline,
+            "amplitude": signal.max(axis=1),
+            "charge":    signal[:, start:stop].sum(axis=1),
+            "peakTime":  signal.argmax(axis=1).astype(numpy.int32)}
+
+
+def decimateMinMax(samples, numberOfColumns):
+    # -----------------------------------------------------------------
+    # Reduce "samples" to (at most) "numberOfColumns" pairs of (minimum,
+    # maximum), one per column of the plot; drawing the envelope keeps
+    # every spike visible and costs the width of the plot, not the
+    # number of samples.
+    # -----------------------------------------------------------------
+    samples = numpy.asarray(samples, dtype=numpy.float32)
+    numberOfColumns = max(int(numberOfColumns), 1)
+
+    if (samples.shape[0] <= numberOfColumns):
+        return samples, samples
+
+    starts = numpy.linspace(0, samples.shape[0], numberOfColumns, endpoint=False).astype(numpy.intp)
+
+    return numpy.minimum.reduceat(samples, starts), numpy.maximum.reduceat(samples, starts)
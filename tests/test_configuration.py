@@ -0,0 +1,61 @@
+#!/usr/bin/env python3.4
+"""
+Configuration of the orchestrator: values of JSON or CSV files converted to the type of each parameter.
+"""
+import unittest
+
+from SPMT_Project import Orchestrator, toConfigurationType
+
+
+class ConfigurationTest(unittest.TestCase):
+    def setUp(self):
+        # Linduino is only connected on first use
+        self.orchestrator = Orchestrator(linduinoPort="none")
+
+
+    def test_booleansAreParsedExplicitly(self):
+        for value, expected in [("False", False), ("false", False), ("0", False), ("no", False), ("", False),
+                                ("True", True), ("1", True), ("yes", True), (" YES ", True), (0, False), (1, True), (True, True)]:
+            self.assertIs(toConfigurationType(value, True), expected, value)
+
+
+    def test_integersAcceptFloatText(self):
+        self.assertEqual(toConfigurationType("5000.0", 10), 5000)
+        self.assertEqual(toConfigurationType(2500.0, 10), 2500)
+        self.assertEqual(toConfigurationType("12", 10), 12)
+        self.assertIsInstance(toConfigurationType("12", 10), int)
+        self.assertEqual(toConfigurationType("420", 1.0), 420.0)
+        self.assertIsInstance(toConfigurationType(3, 1.0), float)
+
+
+    def test_setConfigurationKeepsTheTypeOfEachParameter(self):
+        self.orchestrator.setConfiguration({"overlapAnalyses": "False", "adaptiveAcquisition": "true", "darkCountPulses": "5000.0",
+                                            "vMonOutputFactor": "420", "highVoltageIDs": [["A7501PB", 66, "847.38", "3.71"]]})
+
+        self.assertIs(self.orchestrator.overlapAnalyses, False)
+        self.assertIs(self.orchestrator.adaptiveAcquisition, True)
+        self.assertEqual(self.orchestrator.darkCountPulses, 5000)
+        self.assertIsInstance(self.orchestrator.darkCountPulses, int)
+        self.assertEqual(self.orchestrator.vMonOutputFactor, 420.0)
+        self.assertEqual(self.orchestrator.highVoltageIDs, [["A7501PB", "66", 847.38, 3.71]])
+
+
+    def test_configurationRoundTrip(self):
+        configuration = self.orchestrator.getConfiguration()
+        configuration.update({"traceRun": False, "hvMonitorInterval": 30.0})
+
+        other = Orchestrator(linduinoPort="none")
+        other.setConfiguration(configuration)
+        self.assertEqual(other.getConfiguration(), configuration)
+
+
+    def test_refittedCalibrationNeedsBothFlags(self):
+        self.assertFalse(self.orchestrator.useRefittedHVCalibration())
+        self.orchestrator.setConfiguration({"applyHVRefit": "yes"})
+        self.assertFalse(self.orchestrator.useRefittedHVCalibration())
+        self.orchestrator.setConfiguration({"vMonScaleVerified": "true"})
+        self.assertTrue(self.orchestrator.useRefittedHVCalibration())
+
+
+if __name__ == "__main__":
+    unittest.main()
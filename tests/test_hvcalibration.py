@@ -0,0 +1,93 @@
+#!/usr/bin/env python3.4
+"""
+Store of HV calibrations: online refit from the points of every run, drift since the first fit, and refitted coefficients only used when asked for.
+"""
+import os
+import shutil
+import tempfile
+import unittest
+
+from SPMT_HVCalibration import HVCalibrationStore
+
+
+class HVCalibrationStoreTest(unittest.TestCase):
+    def setUp(self):
+        self.folder = tempfile.mkdtemp(prefix="SPMT_test_")
+        self.fileName = os.path.join(self.folder, "HV_calibration.json")
+        self.store = HVCalibrationStore(self.fileName, forgetting=1.0)
+        self.store.register("A7501PB", "066", 847.38, 3.71)
+
+
+    def tearDown(self):
+        shutil.rmtree(self.folder)
+
+
+    def test_refitFindsTheLineOfTheModule(self):
+        inputs = [0.9, 1.0, 1.1, 1.2]
+        self.assertTrue(self.store.addPoints("A7501PB", "066", inputs, [850.0 * x + 5.0 for x in inputs]))
+
+        a, b = self.store.getFit("A7501PB", "066")
+        self.assertAlmostEqual(a, 850.0, places=6)
+        self.assertAlmostEqual(b, 5.0, places=6)
+
+
+    def test_singleLevelOnlyMovesTheOffset(self):
+        self.store.addPoints("A7501PB", "066", [1.0, 1.0], [860.0, 860.0])
+
+        a, b = self.store.getFit("A7501PB", "066")
+        self.assertAlmostEqual(a, 847.38)
+        self.assertAlmostEqual(a + b, 860.0)
+        self.assertFalse(self.store.isFitUsable("A7501PB", "066"))
+
+
+    def test_refitIsOnlyUsedWhenAskedForAndUsable(self):
+        self.store.addPoints("A7501PB", "066", [1.0], [860.0])
+        nominal = [["A7501PB", "066", 847.38, 3.71]]
+
+        # One input level: the nominal coefficients, even when asked for
+        self.assertEqual(self.store.get("A7501PB", "066", refitted=True), (847.38, 3.71))
+        self.assertEqual(self.store.fillCoefficients(nominal, refitted=True), nominal)
+
+        self.store.addPoints("A7501PB", "066", [1.2], [1030.0])
+        self.assertTrue(self.store.isFitUsable("A7501PB", "066"))
+        self.assertEqual(self.store.get("A7501PB", "066"), (847.38, 3.71))
+        self.assertEqual(self.store.fillCoefficients(nominal), nominal)
+        self.assertAlmostEqual(self.store.fillCoefficients(nominal, refitted=True)[0][2], 850.0, places=6)
+
+
+    def test_newCoefficientsOfTheOperatorRestartTheFit(self):
+        self.store.addPoints("A7501PB", "066", [1.0, 1.2], [860.0, 1030.0])
+
+        self.assertFalse(self.store.register("A7501PB", "066", 847.38, 3.71))
+        self.assertTrue(self.store.register("A7501PB", "066", 851.0, 2.0))
+        self.assertEqual(self.store.get("A7501PB", "066"), (851.0, 2.0))
+        self.assertFalse(self.store.isFitUsable("A7501PB", "066"))
+
+
+    def test_driftFromTheFirstFitIsFlagged(self):
+        inputs = [0.9, 1.1]
+        self.store.addPoints("A7501PB", "066", inputs, [850.0 * x + 5.0 for x in inputs])
+        self.assertFalse(self.store.isDrifting("A7501PB", "066"))
+
+        # Output 0.5% lower: within the allowed drift (1%)
+        self.store.addPoints("A7501PB", "066", inputs, [0.995 * (850.0 * x + 5.0) for x in inputs])
+        self.assertFalse(self.store.isDrifting("A7501PB", "066"))
+
+        for run in range(5):
+            self.store.addPoints("A7501PB", "066", inputs, [0.95 * (850.0 * x + 5.0) for x in inputs])
+
+        self.assertTrue(self.store.isDrifting("A7501PB", "066"))
+
+
+    def test_storeIsKeptBetweenRuns(self):
+        self.store.addPoints("A7501PB", "066", [1.0, 1.2], [860.0, 1030.0])
+        self.store.save()
+
+        store = HVCalibrationStore(self.fileName)
+        self.assertEqual(store.getFit("A7501PB", "066"), self.store.getFit("A7501PB", "066"))
+        self.assertIsNone(store.get("A7501PB", "999"))
+        self.assertFalse(store.addPoints("A7501PB", "999", [1.0], [850.0]))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,90 @@
+#!/usr/bin/env python3.4
+"""
+Queue of jobs: grouping by preset when claiming, and retries of failed jobs up to their maximum number of attempts.
+"""
+import os
+import shutil
+import tempfile
+import unittest
+
+from SPMT_JobQueue import JobQueue, JOB_QUEUED, JOB_RUNNING, JOB_DONE, JOB_FAILED
+
+
+class JobQueueTest(unittest.TestCase):
+    def setUp(self):
+        self.folder = tempfile.mkdtemp(prefix="SPMT_test_")
+        self.queue = JobQueue(os.path.join(self.folder, "jobs.sqlite"))
+
+
+    def tearDown(self):
+        shutil.rmtree(self.folder)
+
+
+    def getJob(self, jobId):
+        return [job for job in self.queue.listJobs() if (job["id"] == jobId)][0]
+
+
+    def test_claimTakesQueuedJobsOfTheFirstPreset(self):
+        first = self.queue.addJob("A7501PB", "001", 847.38, 3.71, "standard")
+        other = self.queue.addJob("A7501PB", "002", 847.38, 3.71, "long")
+        second = self.queue.addJob("A7501PB", "003", 847.38, 3.71, "standard")
+
+        jobs = self.queue.claimJobs("A", maximumJobs=8)
+
+        self.assertEqual([job["id"] for job in jobs], [first, second])
+        self.assertEqual(self.getJob(first)["status"], JOB_RUNNING)
+        self.assertEqual(self.getJob(first)["station"], "A")
+        self.assertEqual(self.getJob(other)["status"], JOB_QUEUED)
+        # Claimed jobs are never given to another station
+        self.assertEqual([job["id"] for job in self.queue.claimJobs("B", maximumJobs=8)], [other])
+        self.assertEqual(self.queue.claimJobs("C", maximumJobs=8), [])
+
+
+    def test_failedJobIsRetriedAloneUntilMaximumAttempts(self):
+        failing = self.queue.addJob("A7501PB", "001", 847.38, 3.71, "standard", maximumAttempts=2)
+        healthy = self.queue.addJob("A7501PB", "002", 847.38, 3.71, "standard", maximumAttempts=2)
+
+        self.assertEqual(len(self.queue.claimJobs("A", maximumJobs=8)), 2)
+        self.assertEqual(self.queue.finishJob(failing, succeeded=False, message="run failed"), JOB_QUEUED)
+        self.assertEqual(self.queue.finishJob(healthy, succeeded=True), JOB_DONE)
+
+        # Second (and last) attempt
+        retry = self.queue.claimJobs("A", maximumJobs=8)
+        self.assertEqual([job["id"] for job in retry], [failing])
+        self.assertEqual(self.getJob(failing)["attempts"], 2)
+        self.assertEqual(self.queue.finishJob(failing, succeeded=False, message="run failed"), JOB_FAILED)
+        self.assertEqual(self.queue.claimJobs("A", maximumJobs=8), [])
+
+
+    def test_retriedJobDoesNotJoinNewJobs(self):
+        failing = self.queue.addJob("A7501PB", "001", 847.38, 3.71, "standard")
+        self.queue.claimJobs("A")
+        self.queue.finishJob(failing, succeeded=False)
+        fresh = self.queue.addJob("A7501PB", "002", 847.38, 3.71, "standard")
+
+        self.assertEqual([job["id"] for job in self.queue.claimJobs("A", maximumJobs=8)], [failing])
+        self.assertEqual([job["id"] for job in self.queue.claimJobs("A", maximumJobs=8)], [fresh])
+
+
+    def test_requeueKeepsOrResetsAttempts(self):
+        jobId = self.queue.addJob("A7501PB", "001", 847.38, 3.71, "standard")
+        self.queue.claimJobs("A")
+
+        # Run stopped by the scheduler: the attempt counts
+        self.queue.requeueJob(jobId, resetAttempts=False)
+        self.assertEqual((self.getJob(jobId)["status"], self.getJob(jobId)["attempts"]), (JOB_QUEUED, 1))
+
+        self.queue.requeueJob(jobId)
+        self.assertEqual(self.getJob(jobId)["attempts"], 0)
+
+
+    def test_interruptedJobsAreRecoveredWithoutCountingTheAttempt(self):
+        jobId = self.queue.addJob("A7501PB", "001", 847.38, 3.71, "standard")
+        self.queue.claimJobs("A")
+
+        self.assertEqual(JobQueue(self.queue.fileName).recoverInterruptedJobs(), 1)
+        self.assertEqual((self.getJob(jobId)["status"], self.getJob(jobId)["attempts"]), (JOB_QUEUED, 0))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,98 @@
+#!/usr/bin/env python3.4
+"""
+Search of LED voltage: convergence on a simulated LED response, start from the calibration of a previous run and bracket of the analysis program.
+"""
+import os
+import math
+import shutil
+import tempfile
+import unittest
+
+from SPMT_LEDSearch import LEDCalibration, LEDIntensitySearch, DIRECTION_OK, DIRECTION_DECREASE, DIRECTION_INCREASE
+
+TARGET_FRACTION = 0.5
+TOLERANCE       = 0.03
+
+
+def ledResponse(voltage):
+    # Fraction of events above threshold: smooth, saturated below 2 V and above 6 V
+    return 1.0 / (1.0 + math.exp(-2.0 * (voltage - 4.2)))
+
+
+def analyse(fraction):
+    # As Ricerca.exe: direction to the target fraction
+    if (abs(fraction - TARGET_FRACTION) <= TOLERANCE):
+        return DIRECTION_OK
+
+    return DIRECTION_INCREASE if (fraction < TARGET_FRACTION) else DIRECTION_DECREASE
+
+
+def runSearch(search, maximumTries=20):
+    # Tries until the analysis accepts the voltage; returns (voltage, tries)
+    voltage = search.getInitialVoltage()
+
+    for tries in range(1, maximumTries + 1):
+        fraction = ledResponse(voltage)
+        direction = analyse(fraction)
+        search.addMeasurement(voltage, fraction, direction)
+
+        if (direction == DIRECTION_OK):
+            return voltage, tries
+
+        voltage = search.proposeNextVoltage()
+
+    return None, maximumTries
+
+
+class LEDIntensitySearchTest(unittest.TestCase):
+    def setUp(self):
+        self.folder = tempfile.mkdtemp(prefix="SPMT_test_")
+        self.fileName = os.path.join(self.folder, "LED_calibration.json")
+
+
+    def tearDown(self):
+        shutil.rmtree(self.folder)
+
+
+    def test_convergesWithoutCalibration(self):
+        search = LEDIntensitySearch(1, initialVoltage=2.0, targetFraction=TARGET_FRACTION)
+        voltage, tries = runSearch(search)
+
+        self.assertIsNotNone(voltage)
+        self.assertLessEqual(abs(ledResponse(voltage) - TARGET_FRACTION), TOLERANCE)
+        self.assertLessEqual(tries, 8)
+
+
+    def test_convergesFromDirectionsOnly(self):
+        # Without a target fraction the search follows the analysis (steps, then bisection of the bracket)
+        search = LEDIntensitySearch(1, initialVoltage=7.0)
+        voltage, tries = runSearch(search)
+
+        self.assertIsNotNone(voltage)
+        self.assertLessEqual(abs(ledResponse(voltage) - TARGET_FRACTION), TOLERANCE)
+
+
+    def test_nextRunStartsFromAcceptedVoltage(self):
+        calibration = LEDCalibration(self.fileName)
+        voltage, tries = runSearch(LEDIntensitySearch(1, initialVoltage=2.0, calibration=calibration, targetFraction=TARGET_FRACTION))
+        calibration.save()
+
+        # The target fraction is learned from the accepted point, and the first try is accepted
+        search = LEDIntensitySearch(1, initialVoltage=2.0, calibration=LEDCalibration(self.fileName))
+        self.assertAlmostEqual(search.targetFraction, ledResponse(voltage))
+        self.assertEqual(runSearch(search), (voltage, 1))
+
+
+    def test_proposalStaysInsideBracketAndLimits(self):
+        search = LEDIntensitySearch(1, initialVoltage=3.0, minimumVoltage=0.0, maximumVoltage=10.0, maximumStep=1.0)
+        search.addMeasurement(3.0, None, DIRECTION_INCREASE)
+        search.addMeasurement(4.0, None, DIRECTION_DECREASE)
+        self.assertAlmostEqual(search.proposeNextVoltage(), 3.5)
+
+        search = LEDIntensitySearch(1, initialVoltage=9.8, maximumVoltage=10.0)
+        search.addMeasurement(9.8, None, DIRECTION_INCREASE)
+        self.assertEqual(search.proposeNextVoltage(), 10.0)
+
+
+if __name__ == "__main__":
+    unittest.main()
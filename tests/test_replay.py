@@ -0,0 +1,131 @@
+#!/usr/bin/env python3.4
+"""
+Serial port of the replay: recorded returns by command (same, skipped, changed or extra commands) and exchanges of the HV monitor apart from the sequence.
+"""
+import threading
+import unittest
+
+from SPMT_Replay import ReplaySerial, getThreadKey
+from SPMT_HVMonitor import samplingState
+
+
+def exchange(thread, command, *responses):
+    # Events of the transcript of one command and its returns
+    events = [{"t": 0.0, "thread": thread, "kind": "w", "data": command.replace(";", "\n") + "\n"}]
+    events += [{"t": 0.0, "thread": thread, "kind": "r", "data": response} for response in responses]
+
+    return events
+
+
+def send(port, command):
+    # As Linduino.sendCommand and readReturn: each field with its terminator, then every byte waiting
+    for field in command.split(";"):
+        port.write(str.encode(field))
+        port.write(b'\n')
+
+    data = b""
+
+    while (port.inWaiting()):
+        data += port.read(port.inWaiting())
+
+    return data.decode()
+
+
+class ReplaySerialTest(unittest.TestCase):
+    def setUp(self):
+        self.transcript = (exchange("sequence", "1;0;3;1;0.7", "DAC updated\n") +
+                           exchange("sequence", "9;1;0", "MUX\n", "on\n", "channel 0\n", "\n", "0.701\n") +
+                           exchange("sequence", "9;0", "MUX off\n") +
+                           exchange("sequence", "16;1.0;0;100;1;0", "Loop trigger\n", "Fine trigger\n"))
+
+
+    def test_sameCommandsGetRecordedReturns(self):
+        port = ReplaySerial(self.transcript)
+
+        self.assertEqual(send(port, "1;0;3;1;0.7"), "DAC updated\n")
+        self.assertEqual(send(port, "9;1;0"), "MUX\non\nchannel 0\n\n0.701\n")
+        self.assertEqual(send(port, "9;0"), "MUX off\n")
+        self.assertEqual(send(port, "16;1.0;0;100;1;0"), "Loop trigger\nFine trigger\n")
+        self.assertEqual(port.finish(), [])
+
+
+    def test_skippedCommandsAreMissing(self):
+        port = ReplaySerial(self.transcript)
+
+        self.assertEqual(send(port, "9;0"), "MUX off\n")
+        self.assertEqual(send(port, "16;1.0;0;100;1;0"), "Loop trigger\nFine trigger\n")
+        self.assertEqual([(difference["kind"], difference["recorded"]) for difference in port.finish()],
+                         [("missing", "1;0;3;1;0.7"), ("missing", "9;1;0")])
+
+
+    def test_otherValuesAreChangedWithRecordedReturns(self):
+        port = ReplaySerial(self.transcript)
+
+        self.assertEqual(send(port, "1;0;3;1;0.75"), "DAC updated\n")
+        self.assertEqual(send(port, "9;1;0"), "MUX\non\nchannel 0\n\n0.701\n")
+
+        differences = port.finish()
+        self.assertEqual([(difference["kind"], difference["recorded"], difference["replayed"]) for difference in differences][0],
+                         ("changed", "1;0;3;1;0.7", "1;0;3;1;0.75"))
+        self.assertEqual([difference["kind"] for difference in differences], ["changed", "missing", "missing"])
+
+
+    def test_extraCommandKeepsTheCursor(self):
+        port = ReplaySerial(self.transcript)
+
+        self.assertEqual(send(port, "1;0;3;1;0.7"), "DAC updated\n")
+        self.assertEqual(send(port, "9;1;0"), "MUX\non\nchannel 0\n\n0.701\n")
+        # Not recorded here: returns of the same command elsewhere in the recording (or none)
+        self.assertEqual(send(port, "1;0;3;1;0.7"), "DAC updated\n")
+        self.assertEqual(send(port, "17"), "")
+        self.assertEqual(send(port, "9;0"), "MUX off\n")
+        self.assertEqual(send(port, "16;1.0;0;100;1;0"), "Loop trigger\nFine trigger\n")
+
+        self.assertEqual([(difference["kind"], difference["replayed"]) for difference in port.finish()],
+                         [("extra", "1;0;3;1;0.7"), ("extra", "17")])
+
+
+    def test_monitorExchangesAreMatchedApart(self):
+        transcript = (self.transcript[:2] + exchange("monitor", "17", "IMon VMon\n", "0.10 0.70\n") +
+                      exchange("monitor", "9", "Exit\n") + self.transcript[2:])
+        port = ReplaySerial(transcript)
+        returns = []
+
+        # Sampled at another moment of the replay than in the recording
+        self.assertEqual(send(port, "1;0;3;1;0.7"), "DAC updated\n")
+        self.assertEqual(send(port, "9;1;0"), "MUX\non\nchannel 0\n\n0.701\n")
+
+        monitor = threading.Thread(target=lambda: returns.extend([send(port, "17"), send(port, "9")]), name="HVMonitor")
+        monitor.start()
+        monitor.join()
+
+        self.assertEqual(returns, ["IMon VMon\n0.10 0.70\n", "Exit\n"])
+        self.assertEqual(send(port, "9;0"), "MUX off\n")
+        self.assertEqual(send(port, "16;1.0;0;100;1;0"), "Loop trigger\nFine trigger\n")
+        self.assertEqual(port.finish(), [])
+
+
+    def test_samplesBetweenTriggersAreMonitorExchanges(self):
+        # The sequence samples the monitors between two blocks of triggers
+        self.assertEqual(getThreadKey(), "sequence")
+        samplingState.active = True
+
+        try:
+            self.assertEqual(getThreadKey(), "monitor")
+        finally:
+            samplingState.active = False
+
+
+    def test_waveMarksFollowTheirRead(self):
+        marks = []
+        transcript = self.transcript[:6] + [{"t": 0.0, "thread": "sequence", "kind": "wave", "acquisition": 1, "sizes": [1024]}] + self.transcript[6:]
+        port = ReplaySerial(transcript, onWaveMark=lambda acquisition, sizes: marks.append((acquisition, sizes)))
+
+        send(port, "1;0;3;1;0.7")
+        self.assertEqual(marks, [])
+        send(port, "9;1;0")
+        self.assertEqual(marks, [(1, [1024])])
+
+
+if __name__ == "__main__":
+    unittest.main()